@@ -0,0 +1,505 @@
+"""
+Offline benchmark and load test for the RAG chatbot.
+
+    python benchmark.py run --output results.json
+    python benchmark.py compare baseline.json results.json
+
+"run" indexes DATA/newdata.pdf and synthetic PDFs of several sizes (each in
+its own process, so peak RSS is per dataset), then measures index load time and
+retrieval latency, and finally starts the FastAPI app with the fake LLM and
+drives POST /chat/send at several concurrency levels. Nothing is downloaded:
+the embeddings model must already be in the local Hugging Face cache, or use
+--embedding-backend hash. Results are written as JSON; "compare" reports the
+metrics that got worse by more than a threshold and exits non-zero if any did.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIRECTORY = Path(__file__).resolve().parent
+DEFAULT_PDF = BACKEND_DIRECTORY.parent / "DATA" / "newdata.pdf"
+
+# Synthetic page layout (Helvetica 10pt); about 3,500 characters per page
+LINES_PER_PAGE = 45
+CHARS_PER_LINE = 85
+
+# Metrics where a larger value is better; all others (seconds, bytes) should shrink
+HIGHER_IS_BETTER = ("pages_per_second", "chunks_per_second", "requests_per_second", "ok")
+
+
+# --- Synthetic documents ---
+
+def _vocabulary(rng, size=3000):
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "po", "ven", "dor", "gal", "tre", "qua", "bis", "mon", "fel"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(1, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def _synthetic_lines(pages, seed):
+    """Deterministic prose-like text: Zipf-distributed words, sentences and a few identifiers"""
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    for page in range(pages):
+        lines = [f"Section {page + 1}"]
+        line = ""
+        while len(lines) < LINES_PER_PAGE:
+            sentence = rng.choices(vocabulary, weights=weights, k=rng.randint(6, 18))
+            if rng.random() < 0.2:
+                sentence.insert(rng.randrange(len(sentence)), f"POL-{rng.randint(1000, 9999)}")
+            sentence[0] = sentence[0].capitalize()
+            for word in (" ".join(sentence) + ".").split():
+                if len(line) + len(word) + 1 > CHARS_PER_LINE:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+        yield lines[:LINES_PER_PAGE]
+
+
+def _pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path, pages, seed=0):
+    """Write a text-only PDF of the given number of pages"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for lines in _synthetic_lines(pages, seed):
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({_pdf_text(line)}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(page_refs), len(page_refs))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        f.writelines(b"%010d 00000 n \n" % offset for offset in offsets)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def sample_queries(pdf_path, count, seed=0):
+    """Questions made of short word windows from the document's text"""
+    from pypdf import PdfReader
+
+    words = []
+    for page in PdfReader(pdf_path).pages[:200]:
+        words.extend((page.extract_text() or "").split())
+    if len(words) < 8:
+        raise ValueError(f"Not enough text in {pdf_path} to sample queries")
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        start = rng.randrange(len(words) - 8)
+        queries.append("What does the document say about " + " ".join(words[start:start + rng.randint(3, 8)]) + "?")
+    return queries
+
+
+# --- Measurements ---
+
+def percentiles(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return None
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def benchmark_dataset(name, pdf_path, workdir, embedding_backend, queries):
+    """Ingest, save, reload and query one PDF (run in a fresh process; see ingest-worker)"""
+    from pypdf import PdfReader
+
+    from fake_llm import FakeLLM
+    from rag import SimpleRAGChatbot
+    from vector_persistence import load_native
+
+    pages = len(PdfReader(pdf_path).pages)
+    bot = SimpleRAGChatbot("benchmark", embedding_backend=embedding_backend, llm=FakeLLM())
+    rss_before = _peak_rss_mb()
+
+    start = time.perf_counter()
+    if not bot.load_document(pdf_path, raise_errors=True):
+        raise RuntimeError(f"Failed to index {pdf_path}")
+    ingest_seconds = time.perf_counter() - start
+    chunks = bot.vectorstore.index.ntotal
+    peak_rss = _peak_rss_mb()
+    bot.close(wait=True)  # parse workers must exit before their peak RSS is reported
+
+    index_path = os.path.join(workdir, f"index-{name}")
+    start = time.perf_counter()
+    bot.save_vectorstore(index_path)
+    save_seconds = time.perf_counter() - start
+
+    # Serve from a second instance, as a restarted server would
+    served = SimpleRAGChatbot("benchmark", lazy=True, llm=FakeLLM())
+    served.embeddings = bot.embeddings
+    start = time.perf_counter()
+    served.attach_vectorstore(*load_native(index_path, served.embeddings))
+    load_seconds = time.perf_counter() - start
+
+    questions = sample_queries(pdf_path, queries, seed=1)
+    for question in questions[:5]:
+        served.retrieve(question, served.embeddings.embed_query(question))
+    embed_times, retrieve_times = [], []
+    for question in questions:
+        start = time.perf_counter()
+        vector = served.embeddings.embed_query(question)
+        embedded = time.perf_counter()
+        served.retrieve(question, vector)
+        embed_times.append(embedded - start)
+        retrieve_times.append(time.perf_counter() - embedded)
+
+    index_bytes = sum(f.stat().st_size for f in Path(index_path).rglob("*") if f.is_file())
+    return {
+        "name": name,
+        "pages": pages,
+        "chunks": chunks,
+        "ingest": {
+            "seconds": ingest_seconds,
+            "pages_per_second": pages / ingest_seconds,
+            "chunks_per_second": chunks / ingest_seconds,
+            "peak_rss_mb": peak_rss,
+            "rss_growth_mb": peak_rss - rss_before,
+            "parse_worker_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        },
+        "index": {
+            "save_seconds": save_seconds,
+            "load_seconds": load_seconds,
+            "bytes": index_bytes,
+        },
+        "retrieval": {
+            "embed_query": percentiles(embed_times),
+            "search": percentiles(retrieve_times),
+            "total": percentiles([a + b for a, b in zip(embed_times, retrieve_times)]),
+        },
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _stage_means(metrics_text):
+    """Mean seconds per stage from the server's rag_stage_seconds histogram"""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"rag_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split("\"} ")
+                target[stage] = float(value)
+    return {stage: sums[stage] / counts[stage] * 1000 for stage in sums if counts.get(stage)}
+
+
+async def _drive(client, questions, concurrency):
+    """Send every question with concurrency requests in flight; returns (latencies, status counts, seconds)"""
+    latencies, statuses = [], {}
+    pending = iter(enumerate(questions))
+
+    async def worker(number):
+        for i, question in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/chat/send", data={"message": question, "chat_id": f"bench-{number}"})
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            if status == "200":
+                latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def _load_test(base_url, questions, concurrency_levels, requests_per_level):
+    import httpx
+
+    results = []
+    limits = httpx.Limits(max_connections=max(concurrency_levels) + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        offset = 0
+        for concurrency in concurrency_levels:
+            # Warm the connections, then measure (each level asks questions not asked before)
+            await _drive(client, questions[offset:offset + concurrency], concurrency)
+            offset += concurrency
+            latencies, statuses, seconds = await _drive(client, questions[offset:offset + requests_per_level], concurrency)
+            offset += requests_per_level
+            results.append({
+                "concurrency": concurrency,
+                "requests": requests_per_level,
+                "ok": statuses.get("200", 0),
+                "statuses": statuses,
+                "seconds": seconds,
+                "requests_per_second": statuses.get("200", 0) / seconds,
+                "latency": percentiles(latencies),
+            })
+            print(f"  concurrency {concurrency}: {results[-1]['requests_per_second']:.1f} req/s, "
+                  f"p50 {results[-1]['latency']['p50_ms'] if latencies else float('nan'):.0f} ms, statuses {statuses}")
+        stages = _stage_means((await client.get("/metrics")).text)
+    return results, stages
+
+
+def load_test(pdf_path, workdir, args):
+    """Start the app (fake LLM) on pdf_path and measure /chat/send under concurrent load"""
+    import httpx
+
+    server_directory = os.path.join(workdir, "server")
+    os.makedirs(server_directory, exist_ok=True)
+    port = _free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(BACKEND_DIRECTORY), os.environ.get("PYTHONPATH")])),
+        "HF_HUB_OFFLINE": "1",
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_JITTER_MS": str(args.llm_jitter_ms),
+        "EMBEDDING_BACKEND": args.embedding_backend,
+        "DEFAULT_PDF_PATH": str(pdf_path),
+        "SESSION_STORE_PATH": "sessions.sqlite",
+        # Every question is new; keep near-duplicates from being answered by the semantic cache
+        "CACHE_SIMILARITY_THRESHOLD": os.environ.get("CACHE_SIMILARITY_THRESHOLD", "1.01"),
+    }
+    log_path = os.path.join(workdir, "server.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "rag_chatbot:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning"],
+            cwd=server_directory, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        start = time.perf_counter()
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}; see {log_path}")
+            if time.perf_counter() - start > args.startup_timeout:
+                raise RuntimeError(f"Server not ready after {args.startup_timeout} s; see {log_path}")
+            try:
+                if httpx.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        ready_seconds = time.perf_counter() - start
+
+        needed = sum(args.concurrency) + args.requests * len(args.concurrency)
+        questions = sample_queries(pdf_path, needed, seed=2)
+        levels, stages = asyncio.run(_load_test(base_url, questions, args.concurrency, args.requests))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return {
+        "dataset": str(pdf_path),
+        "startup_seconds": ready_seconds,
+        "llm_latency_ms": args.llm_latency_ms,
+        "levels": levels,
+        "server_stage_mean_ms": stages,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIRECTORY, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+
+    datasets = [("newdata", str(args.pdf))]
+    for pages in args.pages:
+        path = os.path.join(workdir, f"synthetic-{pages}.pdf")
+        write_synthetic_pdf(path, pages, seed=pages)
+        datasets.append((f"synthetic-{pages}", path))
+
+    results = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embedding_backend": args.embedding_backend,
+            "settings": {key: value for key, value in vars(args).items() if key not in ("func", "output", "workdir")},
+        },
+        "datasets": [],
+        "load_test": None,
+    }
+    results["meta"]["settings"]["pdf"] = str(args.pdf)
+
+    for name, path in datasets:
+        print(f"Indexing {name}...")
+        result_path = os.path.join(workdir, f"{name}.json")
+        subprocess.run(
+            [sys.executable, __file__, "ingest-worker", name, path, workdir, result_path,
+             "--embedding-backend", args.embedding_backend, "--queries", str(args.queries)],
+            check=True, stdout=subprocess.DEVNULL if not args.verbose else None
+        )
+        with open(result_path) as f:
+            dataset = json.load(f)
+        results["datasets"].append(dataset)
+        print(f"  {dataset['pages']} pages, {dataset['chunks']} chunks: "
+              f"{dataset['ingest']['pages_per_second']:.1f} pages/s, peak RSS {dataset['ingest']['peak_rss_mb']:.0f} MB, "
+              f"load {dataset['index']['load_seconds'] * 1000:.0f} ms, "
+              f"retrieval p50 {dataset['retrieval']['total']['p50_ms']:.2f} ms")
+
+    if args.concurrency:
+        load_pdf = dict(datasets)[args.load_dataset]
+        print(f"Load testing /chat/send on {args.load_dataset}...")
+        results["load_test"] = load_test(load_pdf, workdir, args)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def ingest_worker(args):
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    result = benchmark_dataset(args.name, args.pdf, args.workdir, args.embedding_backend, args.queries)
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+
+# --- Comparison ---
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, float(value)
+
+
+def _comparable(results):
+    metrics = {}
+    for dataset in results.get("datasets", []):
+        for key in ("ingest", "index", "retrieval"):
+            metrics.update((f"{dataset['name']}.{name}", value) for name, value in _flatten(dataset.get(key, {}), key))
+    for level in (results.get("load_test") or {}).get("levels", []):
+        prefix = f"chat_send.c{level['concurrency']}"
+        metrics[f"{prefix}.requests_per_second"] = level["requests_per_second"]
+        metrics.update((f"{prefix}.{name}", value) for name, value in _flatten(level.get("latency") or {}, "latency"))
+    return {name: value for name, value in metrics.items() if not name.endswith(".count")}
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = _comparable(json.load(f))
+    with open(args.current) as f:
+        current = _comparable(json.load(f))
+
+    regressions = []
+    width = max((len(name) for name in baseline), default=10)
+    print(f"{'metric':<{width}}  {'baseline':>12}  {'current':>12}  {'change':>8}")
+    for name in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[name], current[name]
+        change = (new - old) / old if old else 0.0
+        worse = -change if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<{width}}  {old:>12.3f}  {new:>12.3f}  {change:>+7.1%}{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} metric(s) worse by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print("No regressions")
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write results as JSON")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--pdf", default=DEFAULT_PDF, help="Real document to benchmark alongside the synthetic ones")
+    run_parser.add_argument("--pages", type=_int_list, default=[20, 200, 1000], help="Synthetic PDF sizes in pages")
+    run_parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per dataset")
+    run_parser.add_argument("--embedding-backend", default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    run_parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32], help="Load test concurrency levels (empty to skip)")
+    run_parser.add_argument("--requests", type=int, default=200, help="Measured /chat/send requests per concurrency level")
+    run_parser.add_argument("--load-dataset", default="newdata", help="Dataset served during the load test")
+    run_parser.add_argument("--llm-latency-ms", type=float, default=300)
+    run_parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    run_parser.add_argument("--startup-timeout", type=float, default=600)
+    run_parser.add_argument("--workdir", help="Where PDFs, indexes and server files go (default: a new temp directory)")
+    run_parser.add_argument("--verbose", action="store_true", help="Show indexing output")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    compare_parser.set_defaults(func=compare)
+
+    worker_parser = commands.add_parser("ingest-worker")  # internal: one dataset per process
+    worker_parser.add_argument("name")
+    worker_parser.add_argument("pdf")
+    worker_parser.add_argument("workdir")
+    worker_parser.add_argument("result")
+    worker_parser.add_argument("--embedding-backend", default="torch")
+    worker_parser.add_argument("--queries", type=int, default=200)
+    worker_parser.set_defaults(func=ingest_worker)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Offline bulk indexer: build the corpus index from a directory tree of PDFs.
+
+    python bulk_index.py /data/archive --workers 8
+    python bulk_index.py /data/archive --workers 8   # after a crash: resumes
+    python bulk_index.py /data/archive --collection legal
+
+The PDFs are split into shards balanced by file size, and each shard is
+indexed by its own process into a partial vectorstore under --work-dir. Every
+shard is checkpointed (saved with save_native) each --checkpoint-seconds and
+when it finishes; running the same command again loads the checkpoints and
+skips the files already in them, so a crash costs at most one checkpoint
+interval per shard. Once all shards are done they are merged into one
+vectorstore, the server's index type and compression are applied, and it is
+published as the next version of the corpus (or of a collection). Running
+servers switch to it on their next poll.
+
+The index must be built with the embeddings backend the server uses
+(EMBEDDING_BACKEND, or --embedding-backend).
+"""
+import argparse
+import contextlib
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+PLAN_FILE = "plan.json"
+
+# Default home of the corpus and collections, relative to the server's working directory
+CORPUS_PATH = os.path.join("vectorstores", "corpus")
+COLLECTIONS_PATH = os.path.join("vectorstores", "collections")
+CATALOG_PATH = os.path.join("vectorstores", "catalog.sqlite")
+DEFAULT_COLLECTION = "default"
+
+
+def _log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def _write_json(path, data):
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "w") as f:
+        json.dump(data, f)
+    os.replace(partial, path)
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+# --- Planning ---
+
+def find_pdfs(root):
+    """Relative paths of the PDFs under root, sorted"""
+    found = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        for filename in filenames:
+            if filename.lower().endswith(".pdf") and not filename.startswith("."):
+                found.append(os.path.relpath(os.path.join(directory, filename), root))
+    return sorted(found)
+
+
+def tree_document_id(relative_path, unique_name):
+    """
+    Document ID of a file in the tree. Files with a unique name get the ID an
+    upload of that name would (rag.document_id), so uploading a revised copy
+    later replaces it; files sharing a name are told apart by their path.
+    """
+    key = os.path.basename(relative_path) if unique_name else relative_path.replace(os.sep, "/")
+    return hashlib.sha1(key.lower().encode("utf-8")).hexdigest()[:16]
+
+
+def make_plan(root, shards, previous=None):
+    """
+    Assign every PDF under root to a shard, largest files first to the lightest
+    shard. Files already in the previous plan keep their shard (their work may
+    be checkpointed there); new files are added to the lightest shards.
+    """
+    files = find_pdfs(root)
+    names = {}
+    for relative_path in files:
+        name = os.path.basename(relative_path).lower()
+        names[name] = names.get(name, 0) + 1
+
+    planned = previous["files"] if previous else {}
+    shards = previous["shards"] if previous else max(1, min(shards, len(files)))
+    plan = {"root": root, "shards": shards, "files": {}}
+    loads = [0] * shards
+    new = []
+    for relative_path in files:
+        size = os.path.getsize(os.path.join(root, relative_path))
+        if relative_path in planned:
+            shard = planned[relative_path]["shard"]
+            plan["files"][relative_path] = {**planned[relative_path], "size": size}
+            loads[shard] += size
+        else:
+            new.append((size, relative_path))
+
+    heap = [(load, shard) for shard, load in enumerate(loads)]
+    heapq.heapify(heap)
+    for size, relative_path in sorted(new, reverse=True):
+        load, shard = heapq.heappop(heap)
+        plan["files"][relative_path] = {
+            "shard": shard,
+            "doc_id": tree_document_id(relative_path, names[os.path.basename(relative_path).lower()] == 1),
+            "size": size,
+        }
+        heapq.heappush(heap, (load + size, shard))
+    return plan
+
+
+def shard_path(work_dir, shard):
+    return os.path.join(work_dir, f"shard-{shard:03d}")
+
+
+# --- Shard workers ---
+
+def index_shard(shard, files, work_dir, embedding_backend, embedding_threads, checkpoint_seconds, retry_failed, verbose):
+    """
+    Index files [(path, doc_id)] into the shard's vectorstore, resuming from its
+    last checkpoint (run in a worker process). Files are parsed and embedded
+    one by one and indexed together at each checkpoint, as one new segment.
+    Returns a summary dict.
+    """
+    from fake_llm import FakeLLM
+    from rag import SimpleRAGChatbot
+    from vector_persistence import is_native_vectorstore, load_native
+
+    path = shard_path(work_dir, shard)
+    failed_path = f"{path}.failed.json"
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        # The index stays flat while shards grow; the merged index gets the configured type
+        bot = SimpleRAGChatbot(
+            "bulk-index", embedding_backend=embedding_backend, embedding_threads=embedding_threads,
+            parse_workers=1, index_type="flat", llm=FakeLLM()
+        )
+        if is_native_vectorstore(path):
+            bot.attach_vectorstore(*load_native(path, bot.embeddings))
+        failed = set() if retry_failed else set(_read_json(failed_path, []))
+        pending = [(file, doc_id) for file, doc_id in files if doc_id not in bot.documents and doc_id not in failed]
+        if len(pending) < len(files):
+            _log(f"shard {shard}: resuming, {len(files) - len(pending)} of {len(files)} files already done")
+
+        start = time.perf_counter()
+        last_checkpoint = time.monotonic()
+        unsaved = False
+        indexed = 0
+        prepared = []  # documents parsed and embedded since the last checkpoint
+
+        def checkpoint():
+            if prepared:
+                bot.add_documents(prepared)
+                prepared.clear()
+            if bot.vectorstore is not None:
+                bot.save_vectorstore(path)
+            _write_json(failed_path, sorted(failed))
+
+        try:
+            for done, (file, doc_id) in enumerate(pending, 1):
+                try:
+                    document = bot.prepare_document(file, doc_id=doc_id)
+                except Exception as e:
+                    print(f"Error loading document: {e}")
+                    document = None
+                ok = document is not None
+                if ok:
+                    prepared.append(document)
+                    failed.discard(doc_id)
+                    indexed += 1
+                else:
+                    failed.add(doc_id)
+                unsaved = True
+                _log(f"shard {shard}: {done}/{len(pending)} {'ok' if ok else 'failed'} {file}")
+
+                if time.monotonic() - last_checkpoint >= checkpoint_seconds:
+                    checkpoint()
+                    last_checkpoint = time.monotonic()
+                    unsaved = False
+        finally:
+            # Also on KeyboardInterrupt: keep what was indexed so far
+            if unsaved:
+                checkpoint()
+            bot.close(wait=True)
+
+    return {
+        "shard": shard,
+        "documents": len(bot.documents),
+        "chunks": bot.index_info()["vectors"],
+        "indexed": indexed,
+        "failed": sorted(failed),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# --- Merge ---
+
+def merge_vectorstores(paths, doc_ids=None):
+    """
+    One vectorstore (a single flat segment) and document manifest from several
+    save_native directories. Only documents in doc_ids (if given) are kept. A
+    document ID found in several directories is taken from the last of them,
+    so a file re-indexed in a shard replaces the copy published before; other
+    documents with the same file content are kept once. Vectors and BM25
+    postings are merged in memory; chunk text is copied from the directories
+    when the result is saved.
+    """
+    from index_segments import SegmentedIndex, as_vectorstore, merge_segments
+    from vector_persistence import load_native
+
+    loaded = [load_native(path, None) for path in paths]
+    source = {}
+    for number, (_, shard_documents) in enumerate(loaded):
+        for doc_id in shard_documents:
+            if doc_ids is None or doc_id in doc_ids:
+                source[doc_id] = number
+
+    documents = {}
+    hashes = set()
+    segments = []
+    deleted = {}
+    for number, (vectorstore, shard_documents) in enumerate(loaded):
+        keep = set()
+        for doc_id, info in shard_documents.items():
+            if source.get(doc_id) != number:
+                continue
+            if info.get("file_hash") and info["file_hash"] in hashes:
+                continue
+            documents[doc_id] = info
+            hashes.add(info.get("file_hash"))
+            keep.add(doc_id)
+
+        # Chunks of documents not kept are dropped like deleted ones
+        index = vectorstore.index
+        for segment in index.segments:
+            metadata = segment.metadata()
+            kept = [doc_number for doc_number, doc_id in enumerate(metadata.doc_ids) if doc_id in keep]
+            dropped = np.flatnonzero(~np.isin(metadata.doc_numbers, kept))
+            deleted[segment.name] = index.deleted.get(segment.name, frozenset()) | frozenset(dropped.tolist())
+            segments.append(segment)
+
+    merged = merge_segments(segments, deleted, index_type="flat") if documents else None
+    if merged is None:
+        return None, {}
+    return as_vectorstore(SegmentedIndex([merged]), None), documents
+
+
+def publish(args, plan):
+    """Merge the shards and publish the result as the next index version; returns (output, version, documents, index info)"""
+    from collection_manager import valid_collection_name
+    from document_catalog import DocumentCatalog
+    from fake_llm import FakeLLM
+    from index_versions import IndexVersions
+    from rag import SimpleRAGChatbot
+    from vector_persistence import is_native_vectorstore
+
+    if args.collection:
+        if not valid_collection_name(args.collection):
+            raise SystemExit(f"Invalid collection name: {args.collection!r}")
+        output = os.path.join(COLLECTIONS_PATH, args.collection)
+    else:
+        output = args.output
+
+    bot = SimpleRAGChatbot(
+        "bulk-index", lazy=True, llm=FakeLLM(), index_type=args.index_type, nprobe=args.nprobe,
+        ef_search=args.ef_search, vector_compression=args.vector_compression, parse_workers=1,
+        embedding_backend=args.embedding_backend
+    )
+    versions = IndexVersions(output, keep=int(os.getenv("INDEX_KEEP_VERSIONS", "3")))
+    doc_ids = {info["doc_id"] for info in plan["files"].values()}
+    paths = [shard_path(args.work_dir, shard) for shard in range(plan["shards"])]
+    paths = [path for path in paths if is_native_vectorstore(path)]
+
+    # Held while merging when appending, so uploads through the server are not lost
+    with versions.writer():
+        versions.adopt_flat_layout()
+        current = versions.current()
+        if args.append and current:
+            # First, so the shards' copies of documents re-indexed in this run replace the published ones
+            paths.insert(0, versions.path(current))
+            doc_ids = None
+
+        start = time.perf_counter()
+        vectorstore, documents = merge_vectorstores(paths, doc_ids)
+        if vectorstore is None:
+            raise SystemExit("Nothing was indexed; not publishing")
+        bot.attach_vectorstore(vectorstore, documents)
+        _log(f"Merged {len(documents)} documents, {vectorstore.index.live} chunks in {time.perf_counter() - start:.1f}s")
+        version = versions.publish(bot.save_vectorstore)
+
+        # Record the documents in the server's catalog when publishing to the corpus or a collection
+        if args.collection or os.path.abspath(output) == os.path.abspath(CORPUS_PATH):
+            catalog = DocumentCatalog(args.catalog)
+            catalog.sync(args.collection or DEFAULT_COLLECTION, documents, bot.embedding_model, versions.root, version)
+            catalog.close()
+    return output, version, len(documents), bot.index_info()
+
+
+# --- Command line ---
+
+def run(args):
+    root = os.path.abspath(args.root)
+    os.makedirs(args.work_dir, exist_ok=True)
+    plan_path = os.path.join(args.work_dir, PLAN_FILE)
+    previous = _read_json(plan_path, None)
+    if previous and previous["root"] != root:
+        raise SystemExit(f"{args.work_dir} holds a run over {previous['root']}; use another --work-dir")
+
+    plan = make_plan(root, args.workers, previous)
+    _write_json(plan_path, plan)
+    if not plan["files"]:
+        raise SystemExit(f"No PDF files under {root}")
+
+    shards = {}
+    for relative_path, info in plan["files"].items():
+        shards.setdefault(info["shard"], []).append((os.path.join(root, relative_path), info["doc_id"]))
+    total_bytes = sum(info["size"] for info in plan["files"].values())
+    _log(f"{len(plan['files'])} PDFs ({total_bytes / 1e6:.0f} MB) in {plan['shards']} shards" + (" (resuming)" if previous else ""))
+
+    # Split the cores between the shard processes (each runs its own embeddings model)
+    threads = args.embedding_threads or max(1, (os.cpu_count() or 1) // len(shards))
+    start = time.perf_counter()
+    failed = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(
+                index_shard, shard, files, args.work_dir, args.embedding_backend, threads,
+                args.checkpoint_seconds, args.retry_failed, args.verbose
+            ): shard
+            for shard, files in sorted(shards.items())
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(futures[future])
+                _log(f"shard {futures[future]}: stopped with {e!r}")
+                continue
+            failed.extend(result["failed"])
+            _log(
+                f"shard {result['shard']}: done, {result['documents']} documents, {result['chunks']} chunks "
+                f"({result['indexed']} indexed in {result['seconds']:.0f}s, {len(result['failed'])} failed)"
+            )
+
+    if errors:
+        raise SystemExit(f"Shards {sorted(errors)} did not finish; run the same command again to resume")
+    _log(f"Indexed all shards in {time.perf_counter() - start:.0f}s")
+
+    output, version, documents, info = publish(args, plan)
+    failed = set(failed)
+    print(json.dumps({
+        "output": output,
+        "version": version,
+        "documents": documents,
+        "vectors": info["vectors"],
+        "index_type": info["index_type"],
+        "compression": info["compression"],
+        "failed": sorted(relative_path for relative_path, entry in plan["files"].items() if entry["doc_id"] in failed),
+    }, indent=2))
+
+    if not args.keep_work:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root", help="Directory searched recursively for PDF files")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Shards indexed in parallel, one process each")
+    parser.add_argument("--work-dir", default="bulk_index_work", help="Plan, shard checkpoints and failures; reuse it to resume")
+    parser.add_argument("--checkpoint-seconds", type=float, default=60, help="Save each shard at least this often")
+    parser.add_argument("--output", default=CORPUS_PATH, help="Versioned index directory to publish to (the server's corpus by default)")
+    parser.add_argument("--collection", help="Publish to this named collection instead")
+    parser.add_argument("--catalog", default=os.getenv("DOCUMENT_CATALOG_PATH", CATALOG_PATH), help="Document catalog updated after publishing")
+    parser.add_argument("--append", action="store_true", help="Keep the documents of the currently published version")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry files that failed in an earlier run")
+    parser.add_argument("--keep-work", action="store_true", help="Keep the work directory after publishing")
+    parser.add_argument("--embedding-backend", default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    parser.add_argument("--embedding-threads", type=int, default=int(os.getenv("EMBEDDING_THREADS", "0")), help="Per worker (default: cores / workers)")
+    parser.add_argument("--index-type", default=os.getenv("INDEX_TYPE", "auto"))
+    parser.add_argument("--nprobe", type=int, default=int(os.getenv("IVF_NPROBE", "16")))
+    parser.add_argument("--ef-search", type=int, default=int(os.getenv("HNSW_EF_SEARCH", "64")))
+    parser.add_argument("--vector-compression", default=os.getenv("VECTOR_COMPRESSION", "none"))
+    parser.add_argument("--verbose", action="store_true", help="Show per-document indexing output")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
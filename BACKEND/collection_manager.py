@@ -0,0 +1,226 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from index_versions import IndexVersions
+from metrics import REGISTRY
+from vector_persistence import load_native
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_EVENTS = REGISTRY.counter(
+    "rag_collection_events_total", "Named collection lookups served from memory (hit), loads and evictions", ["event"]
+)
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+def valid_collection_name(name):
+    return bool(_NAME_RE.match(name or ""))
+
+
+class Collection:
+    """
+    One knowledge base: a chatbot serving its index, and the versioned
+    directory (IndexVersions) the index is published to and read from.
+    """
+
+    def __init__(self, name, chatbot, versions: IndexVersions):
+        self.name = name
+        self.chatbot = chatbot
+        self.versions = versions
+        self.served_version = None  # version being served ("" for an empty collection)
+        self.last_used = time.monotonic()
+        self._sync_lock = threading.Lock()
+
+    def sync(self, version=None) -> bool:
+        """Serve the published version (default: the current one) if not already serving it"""
+        with self._sync_lock:
+            if version is None:
+                version = self.versions.current()
+            if version is None or version == self.served_version:
+                return False
+            if version:
+                # Segments already served are reused; only those added since are read
+                served = self.chatbot.vectorstore
+                self.chatbot.attach_vectorstore(*load_native(
+                    self.versions.path(version), self.chatbot.embeddings, loaded=served.index if served else None
+                ))
+            else:
+                self.chatbot.detach_vectorstore()
+            self.served_version = version
+            return True
+
+    def attach(self, version, loaded):
+        """Serve an index already read with load_native from the given version"""
+        with self._sync_lock:
+            self.chatbot.attach_vectorstore(*loaded)
+            self.served_version = version
+
+    def publish(self):
+        """Save the chatbot's index as a new version and make it current (caller holds the writer lock)"""
+        with self._sync_lock:
+            save = self.chatbot.save_vectorstore if self.chatbot.vectorstore is not None else None
+            self.served_version = self.versions.publish(save)
+        logger.info(f"Published {self.name} index version {self.served_version or '(empty)'}")
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "served_version": self.served_version,
+            "documents": len(self.chatbot.documents),
+            "vectors": self.chatbot.index_info()["vectors"],
+            "memory_bytes": self.chatbot.memory_bytes(),
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class CollectionManager:
+    """
+    Named collections, each in its own versioned directory under root, loaded
+    on first use and kept in an LRU bounded by their estimated memory.
+
+    Loading a collection evicts the least recently used ones until the loaded
+    total fits in max_bytes (the collection just loaded always stays). trim,
+    called periodically, does the same for collections that grew through
+    uploads and drops those unused for idle_seconds. Eviction only forgets the
+    in-memory copy; the published index stays on disk and is read again (memory-
+    mapped, so cheaply) on the next request. Queries already running on an
+    evicted collection finish on it.
+
+    create_chatbot() returns the chatbot for a newly loaded collection (normally
+    SimpleRAGChatbot.for_collection, so the models are shared).
+    """
+
+    def __init__(self, root, create_chatbot, max_bytes: int, idle_seconds: float = 0, keep_versions: int = 3):
+        self.root = root
+        self.create_chatbot = create_chatbot
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.keep_versions = keep_versions
+
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # name -> Collection, least recently used first
+        self._loading = {}  # name -> lock held while the collection is being read
+        os.makedirs(root, exist_ok=True)
+
+        # Counters
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def exists(self, name):
+        return valid_collection_name(name) and os.path.isdir(os.path.join(self.root, name))
+
+    def names(self):
+        """Collections on disk, loaded or not"""
+        return sorted(name for name in os.listdir(self.root) if self.exists(name))
+
+    def get(self, name, create=False):
+        """The collection called name, read from disk if not loaded; None if it does not exist (and not create)"""
+        if not valid_collection_name(name):
+            raise ValueError(f"Invalid collection name: {name!r}")
+
+        collection = self._lookup(name)
+        if collection is not None:
+            return collection
+        if not create and not self.exists(name):
+            return None
+
+        # One thread reads a collection; others asking for it at the same time wait for that
+        with self._lock:
+            loading = self._loading.setdefault(name, threading.Lock())
+        with loading:
+            collection = self._lookup(name)
+            if collection is not None:
+                return collection
+
+            start = time.perf_counter()
+            versions = IndexVersions(os.path.join(self.root, name), keep=self.keep_versions)
+            collection = Collection(name, self.create_chatbot(), versions)
+            collection.sync()
+            with self._lock:
+                self._loaded[name] = collection
+                self._loading.pop(name, None)
+                self.loads += 1
+                evicted = self._evict_over_budget(keep=name)
+            COLLECTION_EVENTS.inc(event="load")
+            logger.info(
+                f"Loaded collection {name} ({collection.chatbot.memory_bytes()} bytes) "
+                f"in {time.perf_counter() - start:.2f}s" + (f", evicted {', '.join(evicted)}" if evicted else "")
+            )
+            return collection
+
+    def _lookup(self, name):
+        with self._lock:
+            collection = self._loaded.get(name)
+            if collection is None:
+                return None
+            self._loaded.move_to_end(name)
+            self.hits += 1
+        COLLECTION_EVENTS.inc(event="hit")
+        collection.touch()
+        return collection
+
+    def _evict_over_budget(self, keep):
+        """Drop least recently used collections until the rest fit in max_bytes (caller holds the lock)"""
+        sizes = {name: collection.chatbot.memory_bytes() for name, collection in self._loaded.items()}
+        total = sum(sizes.values())
+        evicted = []
+        for name in list(self._loaded):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            self._evict(name)
+            total -= sizes[name]
+            evicted.append(name)
+        return evicted
+
+    def _evict(self, name):
+        self._loaded.pop(name)
+        self.evictions += 1
+        COLLECTION_EVENTS.inc(event="evict")
+
+    def trim(self):
+        """Drop collections unused for idle_seconds, then the least recently used beyond max_bytes; returns their names"""
+        with self._lock:
+            idle = []
+            if self.idle_seconds:
+                cutoff = time.monotonic() - self.idle_seconds
+                idle = [name for name, collection in self._loaded.items() if collection.last_used < cutoff]
+                for name in idle:
+                    self._evict(name)
+            most_recent = next(reversed(self._loaded), None)
+            return idle + self._evict_over_budget(keep=most_recent)
+
+    def sync_loaded(self):
+        """Switch loaded collections to versions published by other processes; returns the names switched"""
+        with self._lock:
+            loaded = list(self._loaded.values())
+        return [collection.name for collection in loaded if collection.sync()]
+
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded.values())
+
+    def stats(self):
+        loaded = self.loaded()
+        lookups = self.hits + self.loads
+        return {
+            "on_disk": len(self.names()),
+            "loaded": [collection.stats() for collection in loaded],
+            "loaded_bytes": sum(collection.chatbot.memory_bytes() for collection in loaded),
+            "max_bytes": self.max_bytes,
+            "idle_seconds": self.idle_seconds,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
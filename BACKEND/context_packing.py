@@ -0,0 +1,202 @@
+import re
+import threading
+
+from langchain_core.documents import Document
+
+# Passages sharing this share of their word 3-grams with a more relevant passage are dropped
+DUPLICATE_CONTAINMENT = 0.8
+
+# A passage that does not fit is cut to the remaining budget only if at least this many tokens remain
+MIN_TRUNCATED_TOKENS = 32
+
+# Shortest text overlap taken as the splitter's chunk_overlap (when chunks carry no start_index)
+MIN_TEXT_OVERLAP = 20
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class _Passage:
+    def __init__(self, doc, rank):
+        self.text = doc.page_content
+        self.metadata = dict(doc.metadata)
+        self.rank = rank
+        self.chunks = 1
+        self.start = doc.metadata.get("start_index")
+
+    @property
+    def end(self):
+        return self.start + len(self.text) if self.start is not None else None
+
+    @property
+    def key(self):
+        return self.metadata.get("doc_id") or self.metadata.get("source"), self.metadata.get("page")
+
+
+def _merge(first, second):
+    """Text of first followed by second if they are adjacent or overlap on the page, else None"""
+    if first.start is not None and second.start is not None:
+        if first.start <= second.start <= first.end + 1:
+            overlap = first.end - second.start
+            if overlap >= 0:
+                return first.text + second.text[overlap:]
+            return first.text + " " + second.text
+        return None
+
+    # No offsets: look for the splitter's overlap (a suffix of first that starts second)
+    head = second.text[:MIN_TEXT_OVERLAP]
+    if len(head) < MIN_TEXT_OVERLAP:
+        return None
+    position = first.text.find(head, max(0, len(first.text) - 2 * len(second.text)))
+    while position != -1:
+        if second.text.startswith(first.text[position:]):
+            return first.text[:position] + second.text
+        position = first.text.find(head, position + 1)
+    return None
+
+
+def _shingles(text):
+    words = _WORD_RE.findall(text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+class TokenCounter:
+    """
+    Counts tokens with a Hugging Face fast tokenizer (downloaded once, then read
+    from the local cache). Falls back to ~4 characters per token if the
+    tokenizer cannot be loaded.
+    """
+
+    def __init__(self, tokenizer_name):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _get(self):
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    from huggingface_hub import hf_hub_download
+                    from tokenizers import Tokenizer
+
+                    tokenizer = Tokenizer.from_file(hf_hub_download(self.tokenizer_name, "tokenizer.json"))
+                    tokenizer.no_truncation()
+                    tokenizer.no_padding()
+                    self._tokenizer = tokenizer
+                except Exception as e:
+                    print(f"Could not load tokenizer {self.tokenizer_name} ({e}); estimating tokens from length")
+            return self._tokenizer
+
+    def count(self, text):
+        tokenizer = self._get()
+        if tokenizer is None:
+            return (len(text) + 3) // 4
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text, max_tokens):
+        """Longest prefix of text that fits in max_tokens"""
+        tokenizer = self._get()
+        if tokenizer is None:
+            return text[:max_tokens * 4]
+        offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= max_tokens:
+            return text
+        return text[:offsets[max_tokens - 1][1]]
+
+
+class ContextPacker:
+    """
+    Turns retrieved chunks (most relevant first) into the context sent to the LLM:
+    chunks that are adjacent or overlap on the same page are merged, passages
+    that repeat a more relevant one are dropped, and the rest are kept in
+    relevance order until the token budget is spent.
+    """
+
+    def __init__(self, token_budget=1024, tokenizer_name="sentence-transformers/all-MiniLM-L6-v2"):
+        self.token_budget = token_budget
+        self.counter = TokenCounter(tokenizer_name)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.input_tokens = 0
+        self.packed_tokens = 0
+
+    def pack(self, docs):
+        """Returns (packed Documents, report)"""
+        passages = [_Passage(doc, rank) for rank, doc in enumerate(docs)]
+        input_tokens = sum(self.counter.count(passage.text) for passage in passages)
+        report = {"chunks": len(passages), "merged": 0, "duplicates": 0, "truncated": 0}
+
+        # Merge neighbours on the same page, in page order
+        groups = {}
+        for passage in passages:
+            groups.setdefault(passage.key, []).append(passage)
+        merged_passages = []
+        for group in groups.values():
+            group.sort(key=lambda passage: passage.start if passage.start is not None else 0)
+            current = group[0]
+            for passage in group[1:]:
+                text = _merge(current, passage) or _merge(passage, current)
+                if text is None:
+                    merged_passages.append(current)
+                    current = passage
+                    continue
+                if passage.start is not None and current.start is not None:
+                    current.start = min(current.start, passage.start)
+                current.text = text
+                current.rank = min(current.rank, passage.rank)
+                current.chunks += passage.chunks
+                report["merged"] += 1
+            merged_passages.append(current)
+
+        # Most relevant first; drop passages mostly repeated by one already kept
+        merged_passages.sort(key=lambda passage: passage.rank)
+        kept = []
+        for passage in merged_passages:
+            shingles = _shingles(passage.text)
+            if any(len(shingles & other) >= DUPLICATE_CONTAINMENT * min(len(shingles), len(other)) for _, other in kept):
+                report["duplicates"] += 1
+                continue
+            kept.append((passage, shingles))
+
+        # Fill the token budget
+        packed = []
+        remaining = self.token_budget
+        for passage, _ in kept:
+            tokens = self.counter.count(passage.text)
+            if tokens > remaining:
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    passage.text = self.counter.truncate(passage.text, remaining)
+                    tokens = self.counter.count(passage.text)
+                    report["truncated"] += 1
+                else:
+                    break
+            packed.append(Document(page_content=passage.text, metadata={**passage.metadata, "merged_chunks": passage.chunks}))
+            remaining -= tokens
+            if remaining < MIN_TRUNCATED_TOKENS:
+                break
+
+        packed_tokens = self.token_budget - remaining
+        report.update(
+            passages=len(packed),
+            input_tokens=input_tokens,
+            packed_tokens=packed_tokens,
+            saved_tokens=input_tokens - packed_tokens
+        )
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.packed_tokens += packed_tokens
+        return packed, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "tokenizer": self.counter.tokenizer_name,
+                "requests": self.requests,
+                "input_tokens": self.input_tokens,
+                "packed_tokens": self.packed_tokens,
+                "saved_tokens": self.input_tokens - self.packed_tokens,
+            }
@@ -0,0 +1,318 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+STATUSES = ("queued", "processing", "indexed", "duplicate", "failed")
+
+_COLUMNS = (
+    "collection", "doc_id", "filename", "source", "file_hash", "size", "pages", "chunks", "embedding_model",
+    "index_path", "index_version", "status", "error", "job_id", "pid", "instance", "queued_at", "started_at",
+    "finished_at", "timings"
+)
+_SELECT = f"SELECT {', '.join(_COLUMNS)} FROM documents"
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+def _entry(row):
+    entry = dict(zip(_COLUMNS, row))
+    for key in ("queued_at", "started_at", "finished_at"):
+        entry[key] = _isoformat(entry[key])
+    entry["timings"] = json.loads(entry["timings"]) if entry["timings"] else {}
+    del entry["pid"], entry["instance"]
+    return entry
+
+
+def encode_cursor(filename, doc_id):
+    return base64.urlsafe_b64encode(json.dumps([filename, doc_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """(filename, doc_id) from a cursor returned by DocumentCatalog.list; ValueError if malformed"""
+    try:
+        filename, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(filename), str(doc_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def process_alive(pid):
+    """Whether a process with this ID is running on this machine"""
+    if os.name == "nt":
+        import ctypes
+
+        handle = ctypes.windll.kernel32.OpenProcess(0x00100000, False, pid)  # SYNCHRONIZE
+        if not handle:
+            return False
+        try:
+            return ctypes.windll.kernel32.WaitForSingleObject(handle, 0) == 0x102  # WAIT_TIMEOUT: still running
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def process_start_time(pid):
+    """Start time of a running process in clock ticks since boot, or None if not running or unknown (not Linux)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the command name (which may contain spaces); the start time is field 22
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+_BOOT_ID = _boot_id()
+
+
+def process_instance(pid):
+    """Identity of a running process that a restarted or unrelated process with the same PID does not share, or None"""
+    start_time = process_start_time(pid)
+    if _BOOT_ID is None or start_time is None:
+        return None
+    return f"{_BOOT_ID}:{pid}:{start_time}"
+
+
+# This server process: boot ID, PID and start time where the OS tells them, a random token otherwise
+INSTANCE = process_instance(os.getpid()) or f"{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def instance_alive(pid, instance):
+    """Whether the server process that recorded pid and instance is still running"""
+    if instance == INSTANCE:
+        return True
+    if pid == os.getpid():
+        # Our PID, but recorded by another process: the one before a restart (in a container, often PID 1)
+        return False
+    current = process_instance(pid)
+    if current is not None:
+        return current == instance
+    return process_alive(pid)
+
+
+class DocumentCatalog:
+    """
+    Every document of every collection, with its ingest status, in SQLite.
+
+    A row is written when an upload is queued and updated as its ingest job
+    starts, finishes or fails, so the catalog also knows about documents that
+    are not (yet) searchable. For indexed documents it records the file hash,
+    size, pages, chunks, embedding model and the index directory and version
+    that first served them. Rows are keyed by (collection, doc_id); listing
+    walks an index on (collection, filename, doc_id) from a cursor, so a page
+    costs the same however many documents there are. Several server processes
+    can share one catalog file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "collection TEXT NOT NULL, doc_id TEXT NOT NULL, filename TEXT NOT NULL, source TEXT, "
+            "file_hash TEXT, size INTEGER, pages INTEGER, chunks INTEGER, embedding_model TEXT, "
+            "index_path TEXT, index_version TEXT, status TEXT NOT NULL, error TEXT, job_id TEXT, pid INTEGER, instance TEXT, "
+            "queued_at REAL, started_at REAL, finished_at REAL, timings TEXT, "
+            "PRIMARY KEY (collection, doc_id)) WITHOUT ROWID"
+        )
+        # Catalogs created before ingests recorded their process instance
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        if "instance" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN instance TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_by_name ON documents (collection, filename, doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_by_status ON documents (collection, status, filename, doc_id)")
+        self._conn.commit()
+
+    def queued(self, collection, doc_id, filename, source, size, job_id):
+        """Record an upload waiting for its ingest job (the indexed fields of a previous version are kept)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO documents (collection, doc_id, filename, source, size, status, job_id, pid, instance, queued_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?) "
+                "ON CONFLICT (collection, doc_id) DO UPDATE SET filename = excluded.filename, source = excluded.source, "
+                "status = 'queued', error = NULL, job_id = excluded.job_id, pid = excluded.pid, instance = excluded.instance, "
+                "queued_at = excluded.queued_at, started_at = NULL, finished_at = NULL, timings = NULL "
+                # The job may already have started (and moved the row on) before this was written
+                "WHERE documents.job_id IS NOT excluded.job_id",
+                (collection, doc_id, filename, source, size, job_id, os.getpid(), INSTANCE, time.time())
+            )
+            self._conn.commit()
+
+    def started(self, collection, doc_id, filename, source, job_id):
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO documents (collection, doc_id, filename, source, status, job_id, pid, instance, queued_at, started_at) "
+                "VALUES (?, ?, ?, ?, 'processing', ?, ?, ?, ?, ?) "
+                "ON CONFLICT (collection, doc_id) DO UPDATE SET filename = excluded.filename, source = excluded.source, "
+                "status = 'processing', error = NULL, job_id = excluded.job_id, pid = excluded.pid, instance = excluded.instance, "
+                "queued_at = coalesce(documents.queued_at, excluded.queued_at), started_at = excluded.started_at, "
+                "finished_at = NULL, timings = NULL",
+                (collection, doc_id, filename, source, job_id, os.getpid(), INSTANCE, now, now)
+            )
+            self._conn.commit()
+
+    def indexed(self, collection, info, embedding_model, index_path, index_version, timings=None):
+        """Record a document now served from index_version (info is its entry in the index's document manifest)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO documents (collection, doc_id, filename, source, file_hash, size, pages, chunks, "
+                "embedding_model, index_path, index_version, status, finished_at, timings) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'indexed', ?, ?) "
+                "ON CONFLICT (collection, doc_id) DO UPDATE SET filename = excluded.filename, source = excluded.source, "
+                "file_hash = excluded.file_hash, size = excluded.size, pages = excluded.pages, chunks = excluded.chunks, "
+                "embedding_model = excluded.embedding_model, index_path = excluded.index_path, "
+                "index_version = excluded.index_version, status = 'indexed', error = NULL, pid = NULL, instance = NULL, "
+                "finished_at = excluded.finished_at, timings = excluded.timings",
+                (
+                    collection, info["doc_id"], info["filename"], info.get("source"), info.get("file_hash"),
+                    info.get("size"), info.get("pages"), info.get("chunks"), embedding_model, index_path,
+                    index_version, time.time(), json.dumps(timings) if timings else None
+                )
+            )
+            self._conn.commit()
+
+    def finished(self, collection, doc_id, status, error=None, timings=None):
+        """Record an ingest that ended without indexing the document ("failed" or "duplicate")"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET status = ?, error = ?, pid = NULL, instance = NULL, finished_at = ?, timings = ? "
+                "WHERE collection = ? AND doc_id = ?",
+                (status, error, time.time(), json.dumps(timings) if timings else None, collection, doc_id)
+            )
+            self._conn.commit()
+
+    def remove(self, collection, doc_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            self._conn.commit()
+
+    def has_collection(self, collection):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents WHERE collection = ? LIMIT 1", (collection,)).fetchone() is not None
+
+    def get(self, collection, doc_id):
+        with self._lock:
+            row = self._conn.execute(f"{_SELECT} WHERE collection = ? AND doc_id = ?", (collection, doc_id)).fetchone()
+        return _entry(row) if row else None
+
+    def list(self, collection, limit=50, after=None, status=None, name=None):
+        """
+        Up to limit documents of a collection ordered by file name, starting after
+        the cursor returned with the previous page, and the cursor of the next
+        page (None on the last one). status filters on the ingest status, name on
+        a file name prefix.
+        """
+        conditions = ["collection = ?"]
+        params = [collection]
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if name:
+            conditions.append("filename >= ? AND filename < ?")
+            params += [name, name + "\U0010ffff"]
+        if after:
+            conditions.append("(filename, doc_id) > (?, ?)")
+            params += list(decode_cursor(after))
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"{_SELECT} WHERE {' AND '.join(conditions)} ORDER BY filename, doc_id LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        documents = [_entry(row) for row in rows[:limit]]
+        next_after = encode_cursor(documents[-1]["filename"], documents[-1]["doc_id"]) if len(rows) > limit else None
+        return {"documents": documents, "next_after": next_after}
+
+    def sync(self, collection, documents, embedding_model, index_path, index_version):
+        """
+        Reconcile a collection's rows with the document manifest of its published
+        index: add missing documents as indexed, refresh the details of known
+        ones and drop indexed rows for documents no longer in the index. Rows of
+        ingests in progress or failed are left alone.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS synced (doc_id TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM synced")
+            self._conn.executemany("INSERT OR IGNORE INTO synced VALUES (?)", ((doc_id,) for doc_id in documents))
+            self._conn.executemany(
+                "INSERT INTO documents (collection, doc_id, filename, source, file_hash, size, pages, chunks, "
+                "embedding_model, index_path, index_version, status, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'indexed', ?) "
+                "ON CONFLICT (collection, doc_id) DO UPDATE SET filename = excluded.filename, source = excluded.source, "
+                "file_hash = excluded.file_hash, size = excluded.size, pages = excluded.pages, chunks = excluded.chunks, "
+                "embedding_model = coalesce(documents.embedding_model, excluded.embedding_model), "
+                "index_path = excluded.index_path, index_version = coalesce(documents.index_version, excluded.index_version)",
+                (
+                    (
+                        collection, doc_id, info["filename"], info.get("source"), info.get("file_hash"), info.get("size"),
+                        info.get("pages"), info.get("chunks"), embedding_model, index_path, index_version,
+                        now if info.get("indexed_at") is None else datetime.fromisoformat(info["indexed_at"]).timestamp()
+                    )
+                    for doc_id, info in documents.items()
+                )
+            )
+            removed = self._conn.execute(
+                "DELETE FROM documents WHERE collection = ? AND status = 'indexed' "
+                "AND doc_id NOT IN (SELECT doc_id FROM synced)",
+                (collection,)
+            ).rowcount
+            self._conn.execute("DELETE FROM synced")
+            self._conn.commit()
+        return removed
+
+    def claim_interrupted(self):
+        """
+        Take over ingests left queued or processing by server processes that are
+        no longer running (a crash or restart); returns their entries, now owned
+        by this process. Each is claimed by one process only.
+
+        Owners are recognised by their process instance (see INSTANCE), not the
+        bare PID, which a restarted server or an unrelated process may reuse.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"{_SELECT} WHERE status IN ('queued', 'processing') AND pid IS NOT NULL AND instance IS NOT ?", (INSTANCE,)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                entry = dict(zip(_COLUMNS, row))
+                if instance_alive(entry["pid"], entry["instance"]):
+                    continue
+                updated = self._conn.execute(
+                    "UPDATE documents SET pid = ?, instance = ? WHERE collection = ? AND doc_id = ? AND pid = ? AND instance IS ?",
+                    (os.getpid(), INSTANCE, entry["collection"], entry["doc_id"], entry["pid"], entry["instance"])
+                ).rowcount
+                if updated:
+                    claimed.append(_entry(row))
+            self._conn.commit()
+        return claimed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
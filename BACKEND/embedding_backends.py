@@ -0,0 +1,273 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# torch: sentence-transformers on PyTorch (fp32); onnx: same model on ONNX Runtime;
+# onnx-int8: ONNX Runtime with dynamically quantized (int8) weights;
+# hash: hashed bag of words (no model, fully offline; for benchmarks and tests only)
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8", "hash")
+
+# Tokens per text; sentence-transformers truncates all-MiniLM-L6-v2 at 256 too
+MAX_SEQUENCE_LENGTH = 256
+
+# Minimum cosine similarity to the fp32 model for a backend to pass the parity check
+PARITY_MIN_COSINE = 0.99
+
+PARITY_TEXTS = [
+    "What is retrieval augmented generation?",
+    "The quarterly report shows revenue growth of twelve percent.",
+    "Employees must submit leave requests at least two weeks in advance.",
+    "Install the package and restart the server before running the migration.",
+    "The contract may be terminated by either party with thirty days written notice.",
+    "How do I reset my password?",
+    "Vector indexes trade a little recall for much faster search.",
+    "Section 4.2 describes the safety requirements for field equipment.",
+]
+
+
+def create_embeddings(backend, model_name, threads=None, batch_size=32,
+                      max_batch=16, batch_wait_ms=2.0, cache_dir=None):
+    """Embeddings for model_name on the given backend (see EMBEDDING_BACKENDS)"""
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': batch_size}
+        )
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(
+            model_name,
+            quantize=backend == "onnx-int8",
+            threads=threads,
+            batch_size=batch_size,
+            max_batch=max_batch,
+            batch_wait_ms=batch_wait_ms,
+            cache_dir=cache_dir
+        )
+    if backend == "hash":
+        return HashEmbeddings()
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+class QueryBatcher:
+    """
+    Coalesces concurrent single-text embeds into one model call.
+
+    The first waiting text opens a batch; texts arriving within wait_ms (up to
+    max_batch of them) ride along. A lone request only pays the short wait.
+    """
+
+    def __init__(self, encode, max_batch=16, wait_ms=2.0):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._worker.start()
+        self.batches = 0
+        self.texts = 0
+
+    def embed(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            self.texts += len(batch)
+            try:
+                vectors = self.encode([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-transformers model served by ONNX Runtime instead of PyTorch.
+
+    Uses the ONNX export published with the model and, with quantize=True, an
+    int8 copy made once with onnxruntime's dynamic quantization. Output matches
+    the sentence-transformers pipeline: mean pooling over tokens, then L2
+    normalization.
+
+    Documents are sorted by length and padded per batch, so short chunks never
+    pay for the longest one. Queries go through a QueryBatcher so concurrent
+    requests share a model call.
+    """
+
+    def __init__(self, model_name, quantize=False, threads=None, batch_size=32,
+                 max_batch=16, batch_wait_ms=2.0, max_length=MAX_SEQUENCE_LENGTH, cache_dir=None):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.batch_size = batch_size
+
+        tokenizer_path = hf_hub_download(model_name, "tokenizer.json", cache_dir=cache_dir)
+        model_path = hf_hub_download(model_name, "onnx/model.onnx", cache_dir=cache_dir)
+        if quantize:
+            model_path = self._quantized_copy(model_path)
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.query_batcher = QueryBatcher(self._encode, max_batch=max_batch, wait_ms=batch_wait_ms)
+
+    @staticmethod
+    def _quantized_copy(model_path):
+        """int8 weights next to the fp32 export (made once, then reused)"""
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = model_path[:-len(".onnx")] + "_int8.onnx"
+        if not os.path.exists(quantized_path):
+            partial_path = f"{quantized_path}.{os.getpid()}.part"
+            quantize_dynamic(model_path, partial_path, weight_type=QuantType.QInt8)
+            os.replace(partial_path, quantized_path)
+        return quantized_path
+
+    def _encode(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {name: inputs[name] for name in self._input_names})[0]
+
+        # Mean pooling over real tokens, then L2 normalization
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_documents(self, texts):
+        # Length-sorted batches keep padding (and wasted compute) small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text):
+        return self.query_batcher.embed(text)
+
+    def stats(self):
+        return {
+            "backend": "onnx-int8" if self.quantize else "onnx",
+            "query_batches": self.query_batcher.batches,
+            "queries": self.query_batcher.texts,
+        }
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words vectors: each word (and word pair) is hashed into
+    one of dimensions buckets with a hashed sign, then the vector is L2
+    normalized. Texts sharing words land close together, which is enough to
+    exercise ingestion and retrieval without downloading a model.
+    """
+
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def _encode(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = self._WORD_RE.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._encode(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._encode(text)
+
+
+def parity_report(reference, candidate, texts=None, min_cosine=PARITY_MIN_COSINE):
+    """
+    Cosine drift of candidate's embeddings from reference's (normally the fp32
+    torch model) over texts, and the throughput of each.
+    """
+    texts = list(texts or PARITY_TEXTS)
+
+    def timed(embeddings):
+        embeddings.embed_documents(texts[:2])  # warm-up
+        start = time.perf_counter()
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        return vectors, time.perf_counter() - start
+
+    reference_vectors, reference_seconds = timed(reference)
+    candidate_vectors, candidate_seconds = timed(candidate)
+
+    reference_vectors /= np.linalg.norm(reference_vectors, axis=1, keepdims=True)
+    candidate_vectors /= np.linalg.norm(candidate_vectors, axis=1, keepdims=True)
+    cosines = (reference_vectors * candidate_vectors).sum(axis=1)
+
+    # Does each text still retrieve the same nearest neighbour among the others?
+    agreement = None
+    if len(texts) > 2:
+        reference_sim = reference_vectors @ reference_vectors.T
+        candidate_sim = candidate_vectors @ candidate_vectors.T
+        np.fill_diagonal(reference_sim, -np.inf)
+        np.fill_diagonal(candidate_sim, -np.inf)
+        agreement = float((reference_sim.argmax(axis=1) == candidate_sim.argmax(axis=1)).mean())
+
+    return {
+        "texts": len(texts),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "max_drift": float(1 - cosines.min()),
+        "nearest_neighbour_agreement": agreement,
+        "reference_per_second": len(texts) / reference_seconds,
+        "candidate_per_second": len(texts) / candidate_seconds,
+        "speedup": reference_seconds / candidate_seconds,
+        "passed": bool(cosines.min() >= min_cosine),
+    }
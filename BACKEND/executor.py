@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the wait queue is full or a request waited too long for a slot"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RAGExecutor:
+    """
+    Runs blocking RAG work (embedding, FAISS search, LLM calls) on a thread pool
+    so the event loop stays free for other requests.
+
+    At most ``max_workers`` calls run at once. Up to ``max_queue`` further calls
+    may wait for a slot; anything beyond that is rejected immediately with
+    ExecutorSaturated so callers can answer with 503 + Retry-After instead of
+    piling up latency.
+    """
+
+    def __init__(self, name: str, max_workers: int = 4, max_queue: int = 32,
+                 queue_timeout: float = 30.0, retry_after: int = 5):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._slots = asyncio.Semaphore(max_workers)
+
+        # Gauges and counters (only touched from the event loop thread)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """Wait for a free slot, or fail fast if the wait queue is already full"""
+        if self.queued + self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise ExecutorSaturated(f"{self.name} queue is full", self.retry_after)
+
+        self.queued += 1
+        start = time.perf_counter()
+        # Acquire in its own task so we know whether the permit was granted when the wait is cut short
+        # (a pending acquire that gets cancelled never keeps the permit)
+        acquire = asyncio.ensure_future(self._slots.acquire())
+        try:
+            await asyncio.wait({acquire}, timeout=self.queue_timeout)
+        except BaseException:
+            # The caller was cancelled while waiting
+            if acquire.done() and not acquire.cancelled():
+                self._slots.release()
+            else:
+                acquire.cancel()
+            raise
+        finally:
+            self.queued -= 1
+            observe_stage(f"{self.name}_queue_wait", time.perf_counter() - start)
+
+        if not acquire.done():
+            acquire.cancel()
+            self.rejected += 1
+            raise ExecutorSaturated(f"{self.name} queue wait timed out", self.retry_after)
+
+        self.in_flight += 1
+
+    def release(self):
+        """Give back a slot taken with acquire()"""
+        self.in_flight -= 1
+        self.completed += 1
+        self._slots.release()
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """Run fn on the pool without admission control (caller must hold a slot)"""
+        loop = asyncio.get_running_loop()
+        # Carry context variables (e.g. the request's timing breakdown) into the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._pool, functools.partial(context.run, fn, *args, **kwargs))
+
+    async def run(self, fn, *args, **kwargs):
+        """Admit, run fn on the pool and release the slot"""
+        await self.acquire()
+        try:
+            return await self.run_sync(fn, *args, **kwargs)
+        finally:
+            self.release()
+
+    def stats(self):
+        """Current queue-depth and in-flight gauges"""
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
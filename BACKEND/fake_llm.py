@@ -0,0 +1,60 @@
+import hashlib
+import time
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+_WORDS = (
+    "the document states that requests are reviewed within five working days and "
+    "approved by the responsible team before the change takes effect according to section"
+).split()
+
+
+class FakeLLM(LLM):
+    """
+    Deterministic local stand-in for GoogleGenerativeAI, for benchmarks and
+    offline runs. Each call waits latency_ms (plus up to jitter_ms, derived from
+    the prompt so runs repeat exactly) and answers with answer_tokens words
+    chosen from a hash of the prompt. Streaming spends the latency before the
+    first token and token_interval_ms between tokens.
+    """
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    token_interval_ms: float = 0.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    @property
+    def _identifying_params(self):
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms, "answer_tokens": self.answer_tokens}
+
+    def _digest(self, prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).digest()
+
+    def _delay(self, digest):
+        jitter = self.jitter_ms * int.from_bytes(digest[:2], "big") / 65535
+        return (self.latency_ms + jitter) / 1000
+
+    def _tokens(self, digest):
+        return [_WORDS[digest[i % len(digest)] % len(_WORDS)] for i in range(self.answer_tokens)]
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        digest = self._digest(prompt)
+        time.sleep(self._delay(digest))
+        return " ".join(self._tokens(digest)) + "."
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        digest = self._digest(prompt)
+        time.sleep(self._delay(digest))
+        tokens = self._tokens(digest)
+        for i, token in enumerate(tokens):
+            if i and self.token_interval_ms:
+                time.sleep(self.token_interval_ms / 1000)
+            text = (" " if i else "") + token + ("." if i == len(tokens) - 1 else "")
+            if run_manager:
+                run_manager.on_llm_new_token(text)
+            yield GenerationChunk(text=text)
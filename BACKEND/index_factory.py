@@ -0,0 +1,214 @@
+import math
+import time
+
+import faiss
+import numpy as np
+
+from vector_compression import COMPRESSION_MODES, DEFAULT_RESCORE_FACTORS, CompressedIndex
+
+# Corpus sizes at which the automatic choice switches index type
+FLAT_MAX_VECTORS = 20_000
+HNSW_MAX_VECTORS = 1_000_000
+
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+
+# Filters selecting at most this many vectors are searched exactly over just those vectors
+EXACT_FILTER_MAX = 4096
+
+
+def choose_index_type(n_vectors):
+    """Exact search while it is cheap, HNSW for mid-size corpora, IVF beyond that"""
+    if n_vectors <= FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= HNSW_MAX_VECTORS:
+        return "hnsw"
+    return "ivf"
+
+
+def index_type_of(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def build_index(vectors, index_type="flat", metric=faiss.METRIC_L2, nlist=None,
+                hnsw_m=32, ef_construction=200, nprobe=16, ef_search=64):
+    """
+    Build a FAISS index of the given type over vectors (an n x d float32 array).
+
+    IVF lists are trained on the vectors themselves (nlist defaults to about
+    4 * sqrt(n)) and keep a direct map so vectors can be reconstructed later.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlat(dim, metric)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type == "ivf":
+        nlist = nlist or max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+        index = faiss.IndexIVFFlat(faiss.IndexFlat(dim, metric), dim, nlist, metric)
+        index.train(vectors)
+        index.set_direct_map_type(faiss.DirectMap.Array)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    if n:
+        index.add(vectors)
+    configure_search(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Apply search-time knobs (nprobe for IVF, efSearch for HNSW)"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF) and nprobe:
+        index.nprobe = min(nprobe, index.nlist)
+    if isinstance(index, faiss.IndexHNSW) and ef_search:
+        index.hnsw.efSearch = ef_search
+
+
+def id_selector(mask):
+    """
+    FAISS selector of the positions where mask is True. Returns (selector,
+    bitmap); the bitmap must be kept alive while the selector is used.
+    """
+    bitmap = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap)), bitmap
+
+
+def search_parameters(index, selector):
+    """Search parameters restricting index to selector, keeping its nprobe / efSearch"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def exact_search(index, queries, k, positions):
+    """(distances, positions) of the k nearest among the given positions, by exact distance"""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    found = np.full((len(queries), k), -1, dtype=np.int64)
+    if not len(positions):
+        return distances, found
+
+    vectors = index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        scores = -(queries @ vectors.T)
+    else:
+        scores = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    top = np.argsort(scores, axis=1)[:, :k]
+    rows = np.arange(len(queries))[:, None]
+    distances[:, :top.shape[1]] = -scores[rows, top] if index.metric_type == faiss.METRIC_INNER_PRODUCT else scores[rows, top]
+    found[:, :top.shape[1]] = np.asarray(positions, dtype=np.int64)[top]
+    return distances, found
+
+
+def filtered_search(index, queries, k, mask, compressed=None, rescore_factor=None):
+    """
+    index.search restricted to the positions where mask is True, applied before
+    the search: small selections are scanned exactly, larger ones searched with
+    a FAISS ID selector (through compressed codes, if given).
+    """
+    positions = np.flatnonzero(mask)
+    if len(positions) <= EXACT_FILTER_MAX:
+        return exact_search(index, queries, k, positions)
+    selector, bitmap = id_selector(mask)
+    if compressed is not None:
+        return compressed.search(index, queries, k, rescore_factor, selector=selector)
+    return index.search(np.ascontiguousarray(queries, dtype=np.float32), k, params=search_parameters(index, selector))
+
+
+def reconstruct_all(index):
+    """All stored vectors, in position order"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_bytes_per_vector(index):
+    """Serialized (i.e. in-memory) size of an index divided by its vectors"""
+    return len(faiss.serialize_index(index)) / max(index.ntotal, 1)
+
+
+def recall_report(vectors, metric=faiss.METRIC_L2, k=10, n_queries=200,
+                  nprobe_values=(1, 4, 16, 64), ef_search_values=(16, 64, 256),
+                  compression_modes=COMPRESSION_MODES[1:], seed=0):
+    """
+    Recall@k, per-query latency and memory (bytes per vector) of each index
+    type / search setting, measured against the exact flat index over the
+    same vectors. Compressed modes are measured with their first pass alone
+    (rescore_factor 1) and with their default rescoring; their bytes per
+    vector count only the codes, since the full vectors can stay on disk.
+
+    Queries are stored vectors with a little noise added, which approximates
+    real queries landing near existing chunks.
+    """
+    n = len(vectors)
+    if n == 0:
+        return []
+
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(n, size=min(n_queries, n), replace=False)]
+    queries = (sample + rng.normal(scale=0.01, size=sample.shape)).astype(np.float32)
+
+    exact = build_index(vectors, "flat", metric=metric)
+    _, truth = exact.search(queries, k)
+
+    def measure(search, index_type, params, build_seconds, bytes_per_vector):
+        latencies = []
+        hits = 0
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            _, found = search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(found[0]) & set(truth[i]))
+        latencies.sort()
+        return {
+            "index_type": index_type,
+            "params": params,
+            f"recall_at_{k}": hits / (len(queries) * k),
+            "p50_ms": latencies[len(latencies) // 2],
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            "build_seconds": build_seconds,
+            "bytes_per_vector": bytes_per_vector,
+        }
+
+    report = [measure(exact.search, "flat", {}, 0.0, index_bytes_per_vector(exact))]
+
+    start = time.perf_counter()
+    ivf = build_index(vectors, "ivf", metric=metric)
+    ivf_build = time.perf_counter() - start
+    for nprobe in sorted({min(value, ivf.nlist) for value in nprobe_values}):
+        configure_search(ivf, nprobe=nprobe)
+        report.append(measure(ivf.search, "ivf", {"nlist": ivf.nlist, "nprobe": nprobe}, ivf_build, index_bytes_per_vector(ivf)))
+
+    start = time.perf_counter()
+    hnsw = build_index(vectors, "hnsw", metric=metric)
+    hnsw_build = time.perf_counter() - start
+    for ef_search in ef_search_values:
+        configure_search(hnsw, ef_search=ef_search)
+        report.append(measure(hnsw.search, "hnsw", {"efSearch": ef_search}, hnsw_build, index_bytes_per_vector(hnsw)))
+
+    for mode in compression_modes:
+        if mode == "binary" and vectors.shape[1] % 8:
+            continue
+        start = time.perf_counter()
+        compressed = CompressedIndex.build(exact, mode)
+        build_seconds = time.perf_counter() - start
+        for factor in sorted({1, DEFAULT_RESCORE_FACTORS[mode]}):
+            report.append(measure(
+                lambda query, k, factor=factor: compressed.search(exact, query, k, rescore_factor=factor),
+                "flat", {"compression": mode, "rescore_factor": factor}, build_seconds, compressed.code_size
+            ))
+
+    return report
@@ -0,0 +1,460 @@
+import bisect
+import uuid
+from collections.abc import Mapping
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+from index_factory import build_index, choose_index_type, configure_search, filtered_search, index_type_of
+from lexical_index import BM25Index, search_indexes
+from metadata_index import ChunkMetadataIndex
+from vector_compression import CompressedIndex
+
+# Trailing segments are merged while the older one holds at most this many times the chunks of the newer
+MERGE_FACTOR = 2
+
+# A segment is rewritten without its deleted chunks once they make up this share of it
+COMPACT_RATIO = 0.25
+
+# Vectors read back per step while segments are merged
+_MERGE_BATCH = 65536
+
+
+class MemoryDocstore:
+    """
+    Chunks of a segment that is not saved yet: in memory (chunk ID ->
+    Document), or still in the saved files of segments it was merged from
+    (stores, docstores with search_many)
+    """
+
+    def __init__(self, docs, stores=()):
+        self.docs = docs
+        self.stores = list(stores)
+
+    def search_many(self, ids):
+        found = {chunk_id: self.docs[chunk_id] for chunk_id in ids if chunk_id in self.docs}
+        for store in self.stores:
+            missing = [chunk_id for chunk_id in ids if chunk_id not in found]
+            if not missing:
+                break
+            found.update(store.search_many(missing))
+        return found
+
+
+class Segment:
+    """
+    An immutable run of indexed chunks: their vectors (a FAISS index and the
+    compressed codes of just these vectors, if configured), chunk IDs in
+    position order, text (docstore) and BM25 postings.
+
+    Snapshots share segments. A writer adds a segment for the documents it
+    indexes, or replaces a few segments by their merge, so publishing costs
+    the size of the new documents rather than of the index. path is the
+    directory a saved segment's files are in (None until saved).
+    """
+
+    def __init__(self, index, chunk_ids, docstore, lexical_index, compressed=None, name=None, path=None, mapped=False):
+        self.name = name or f"seg-{uuid.uuid4().hex[:16]}"
+        self.index = index
+        self.chunk_ids = chunk_ids
+        self.docstore = docstore  # search_many(ids) -> {chunk_id: Document}
+        self.lexical_index = lexical_index
+        self.compressed = compressed
+        self.path = path
+        self.mapped = mapped
+        self._positions = None
+        self._metadata = None
+        self._lexical_order = None  # segment position of each BM25 chunk number, where they differ
+        self._lexical_checked = False
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def find(self, chunk_ids):
+        """{chunk_id: position} of the given chunks that are in this segment"""
+        if self._positions is None and hasattr(self.docstore, "positions"):
+            return self.docstore.positions(chunk_ids)
+        if self._positions is None:
+            self._positions = {chunk_id: position for position, chunk_id in enumerate(self.chunk_ids)}
+        return {chunk_id: self._positions[chunk_id] for chunk_id in chunk_ids if chunk_id in self._positions}
+
+    def lexical_mask(self, mask):
+        """A boolean mask over this segment's positions, as one over its BM25 chunk numbers"""
+        if not self._lexical_checked:
+            numbered = self.lexical_index.numbered_chunk_ids()
+            # Segments built here number their BM25 chunks by position; older saved indexes may not
+            if numbered != list(self.chunk_ids):
+                positions = self.find([chunk_id for chunk_id in numbered if chunk_id is not None])
+                self._lexical_order = np.array([positions.get(chunk_id, -1) for chunk_id in numbered], dtype=np.int64)
+            self._lexical_checked = True
+        if self._lexical_order is None:
+            return mask
+        # Chunk numbers without a position (-1) pick the appended False
+        return np.append(mask, False)[self._lexical_order]
+
+    def metadata(self):
+        """ChunkMetadataIndex of this segment's positions, read once"""
+        if self._metadata is None:
+            if hasattr(self.docstore, "doc_pages"):
+                doc_pages = self.docstore.doc_pages()
+                rows = (
+                    (position, *doc_pages.get(chunk_id, (None, None))) for position, chunk_id in enumerate(self.chunk_ids)
+                )
+            else:
+                docs = self.docstore.search_many(self.chunk_ids)
+                rows = (
+                    (position, docs[chunk_id].metadata.get("doc_id"), docs[chunk_id].metadata.get("page"))
+                    for position, chunk_id in enumerate(self.chunk_ids)
+                )
+            self._metadata = ChunkMetadataIndex.build(len(self), rows)
+        return self._metadata
+
+    def memory_bytes(self):
+        """Estimated memory: vectors (only their codes when compressed), BM25 postings and chunk IDs"""
+        if self.compressed is not None:
+            total = self.compressed.stats()["bytes"]
+        else:
+            total = self.index.ntotal * self.index.d * 4
+        total += self.lexical_index.stats()["approx_bytes"]
+        total += len(self) * 100  # chunk ID string and list entry
+        if self._metadata is not None:
+            total += self._metadata.nbytes()
+        return total
+
+
+def build_segment(vectors, chunk_ids, docs, index_type="auto", compression="none", metric=faiss.METRIC_L2,
+                  nprobe=16, ef_search=64):
+    """
+    New (unsaved) segment over chunks; docs maps chunk ID -> Document. With
+    index_type "auto" the type suits the segment's own size.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    target = index_type if index_type != "auto" else choose_index_type(len(vectors))
+    index = build_index(vectors, target, metric=metric, nprobe=nprobe, ef_search=ef_search)
+    lexical_index = BM25Index()
+    lexical_index.add(chunk_ids, [docs[chunk_id].page_content for chunk_id in chunk_ids])
+    compressed = CompressedIndex.build(index, compression) if compression != "none" else None
+    return Segment(index, list(chunk_ids), MemoryDocstore(docs), lexical_index, compressed)
+
+
+def segment_from_vectorstore(vectorstore):
+    """A LangChain FAISS store (e.g. read from the pickle format) as one segment, with a BM25 index built from its chunks"""
+    positions = sorted(vectorstore.index_to_docstore_id)
+    if positions != list(range(vectorstore.index.ntotal)):
+        raise ValueError("Vector store positions are not contiguous")
+    chunk_ids = [vectorstore.index_to_docstore_id[position] for position in positions]
+    docs = {chunk_id: vectorstore.docstore.search(chunk_id) for chunk_id in chunk_ids}
+    lexical_index = BM25Index()
+    lexical_index.add(chunk_ids, [docs[chunk_id].page_content for chunk_id in chunk_ids])
+    return Segment(vectorstore.index, chunk_ids, MemoryDocstore(docs), lexical_index)
+
+
+def live_positions(segment, deleted):
+    """Positions of a segment's chunks that are not deleted (deleted: segment name -> positions)"""
+    gone = deleted.get(segment.name)
+    if not gone:
+        return np.arange(len(segment), dtype=np.int64)
+    live = np.ones(len(segment), dtype=bool)
+    live[list(gone)] = False
+    return np.flatnonzero(live)
+
+
+def merge_segments(segments, deleted, index_type="auto", compression="none", nprobe=16, ef_search=64):
+    """
+    One segment holding the chunks of several that are not deleted, or None
+    if there are none. Vectors are read back from the segments' indexes and
+    BM25 postings renumbered; chunk text is read from the old segments until
+    the merged one is saved.
+    """
+    chunk_ids = []
+    vectors = []
+    parts = []
+    docs = {}
+    stores = []
+    for segment in segments:
+        positions = live_positions(segment, deleted)
+        ids = [segment.chunk_ids[position] for position in positions.tolist()]
+        for start in range(0, len(positions), _MERGE_BATCH):
+            vectors.append(segment.index.reconstruct_batch(positions[start:start + _MERGE_BATCH]))
+        chunk_ids.extend(ids)
+        parts.append((segment.lexical_index, ids))
+
+        # Keep in-memory text of the chunks kept (not the old segments), saved text where it is
+        if isinstance(segment.docstore, MemoryDocstore):
+            docs.update((chunk_id, segment.docstore.docs[chunk_id]) for chunk_id in ids if chunk_id in segment.docstore.docs)
+            stores.extend(store for store in segment.docstore.stores if store not in stores)
+        else:
+            stores.append(segment.docstore)
+    if not chunk_ids:
+        return None
+
+    vectors = np.concatenate(vectors)
+    target = index_type if index_type != "auto" else choose_index_type(len(vectors))
+    index = build_index(vectors, target, metric=segments[0].index.metric_type, nprobe=nprobe, ef_search=ef_search)
+    compressed = CompressedIndex.build(index, compression) if compression != "none" else None
+    return Segment(index, chunk_ids, MemoryDocstore(docs, stores), BM25Index.merge(parts), compressed)
+
+
+def maintain_segments(segments, deleted, **settings):
+    """
+    Keep the segment list short (settings as for merge_segments). Segments
+    with COMPACT_RATIO of their chunks deleted are rewritten without them,
+    and trailing segments are merged while the older holds at most
+    MERGE_FACTOR times the chunks of the newer. Sizes then grow geometrically
+    towards the oldest segment: there are O(log n) segments and a chunk is
+    rewritten O(log n) times over its life. Returns (segments, deleted).
+    """
+    segments = list(segments)
+    deleted = dict(deleted)
+
+    def live(segment):
+        return len(segment) - len(deleted.get(segment.name, ()))
+
+    for i, segment in enumerate(segments):
+        gone = deleted.get(segment.name)
+        if gone and len(gone) >= COMPACT_RATIO * len(segment):
+            segments[i] = merge_segments([segment], deleted, **settings)
+            del deleted[segment.name]
+    segments = [segment for segment in segments if segment is not None]
+
+    while len(segments) > 1 and live(segments[-2]) <= MERGE_FACTOR * live(segments[-1]):
+        merged = merge_segments(segments[-2:], deleted, **settings)
+        for segment in segments[-2:]:
+            deleted.pop(segment.name, None)
+        segments[-2:] = [merged] if merged is not None else []
+    return segments, deleted
+
+
+def conform_segment(segment, deleted, index_type="auto", compression="none", nprobe=16, ef_search=64):
+    """
+    The segment with the configured index type and compression: rebuilt (and
+    its deleted chunks dropped) if it has others, else the segment itself
+    with the search knobs applied. Returns a segment or None.
+    """
+    target = index_type if index_type != "auto" else choose_index_type(len(segment))
+    mode = segment.compressed.mode if segment.compressed is not None else "none"
+    if index_type_of(segment.index) != target or mode != compression:
+        print(f"Rebuilding vector index segment as {target} for {len(segment)} vectors...")
+        return merge_segments([segment], deleted, index_type, compression, nprobe, ef_search)
+    configure_search(segment.index, nprobe=nprobe, ef_search=ef_search)
+    return segment
+
+
+class SegmentedIndex:
+    """
+    The segments of one snapshot, searched as a single FAISS-like index.
+
+    Positions run through the segments in order. Deleted chunks keep their
+    rows until their segment is compacted or merged but are never returned;
+    deleted maps a segment name to the positions deleted in it.
+    """
+
+    def __init__(self, segments, deleted=None, previous=None):
+        self.segments = tuple(segments)
+        self.deleted = {name: frozenset(positions) for name, positions in (deleted or {}).items() if positions}
+        self.offsets = []
+        total = 0
+        for segment in self.segments:
+            self.offsets.append(total)
+            total += len(segment)
+        self.ntotal = total
+        self.live = total - sum(len(positions) for positions in self.deleted.values())
+        self.d = self.segments[0].index.d
+        self.metric_type = self.segments[0].index.metric_type
+
+        # Masks of live rows carry over from the previous snapshot where nothing more was deleted
+        self._live_masks = {}
+        if previous is not None:
+            names = {segment.name for segment in self.segments}
+            for name, mask in previous._live_masks.items():
+                if name in names and previous.deleted.get(name) == self.deleted.get(name):
+                    self._live_masks[name] = mask
+
+    def locate(self, position):
+        """(segment, position within it) of a position"""
+        if not 0 <= position < self.ntotal:
+            raise KeyError(position)
+        i = bisect.bisect_right(self.offsets, position) - 1
+        return self.segments[i], position - self.offsets[i]
+
+    def chunk_id(self, position):
+        segment, local = self.locate(position)
+        return segment.chunk_ids[local]
+
+    def live_mask(self, segment):
+        """Boolean array over a segment's rows, False where deleted; None if nothing in it is deleted"""
+        gone = self.deleted.get(segment.name)
+        if not gone:
+            return None
+        mask = self._live_masks.get(segment.name)
+        if mask is None:
+            mask = np.ones(len(segment), dtype=bool)
+            mask[list(gone)] = False
+            self._live_masks[segment.name] = mask
+        return mask
+
+    def search(self, x, k, mask=None, rescore_factor=None):
+        """
+        (distances, positions) of the k nearest live rows, like faiss
+        Index.search. mask (booleans over all positions) restricts the search
+        before it runs; segments with compressed codes are searched through them.
+        """
+        queries = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        found_distances = []
+        found_positions = []
+        for segment, offset in zip(self.segments, self.offsets):
+            allowed = self.live_mask(segment)
+            if mask is not None:
+                part = mask[offset:offset + len(segment)]
+                allowed = part if allowed is None else part & allowed
+            if allowed is not None:
+                if not allowed.any():
+                    continue
+                distances, positions = filtered_search(
+                    segment.index, queries, k, allowed, segment.compressed, rescore_factor
+                )
+            elif segment.compressed is not None:
+                distances, positions = segment.compressed.search(segment.index, queries, k, rescore_factor)
+            else:
+                distances, positions = segment.index.search(queries, k)
+            found_distances.append(distances)
+            found_positions.append(np.where(positions >= 0, positions + offset, -1))
+
+        if not found_positions:
+            return np.full((len(queries), k), np.inf, dtype=np.float32), np.full((len(queries), k), -1, dtype=np.int64)
+        if len(found_positions) == 1:
+            return found_distances[0], found_positions[0]
+
+        # Best k of the segments' results
+        distances = np.concatenate(found_distances, axis=1)
+        positions = np.concatenate(found_positions, axis=1)
+        keys = -distances if self.metric_type == faiss.METRIC_INNER_PRODUCT else distances.copy()
+        keys[positions == -1] = np.inf
+        order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+        rows = np.arange(len(queries))[:, None]
+        return distances[rows, order], positions[rows, order]
+
+    def reconstruct_batch(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        vectors = np.empty((len(positions), self.d), dtype=np.float32)
+        owners = np.searchsorted(self.offsets, positions, side="right") - 1
+        for i in np.unique(owners).tolist():
+            rows = owners == i
+            vectors[rows] = self.segments[i].index.reconstruct_batch(positions[rows] - self.offsets[i])
+        return vectors
+
+    def reconstruct_n(self, start, n):
+        return self.reconstruct_batch(np.arange(start, start + n, dtype=np.int64))
+
+    def reconstruct(self, position):
+        return self.reconstruct_batch([position])[0]
+
+    def lexical_search(self, query, k=20, mask=None):
+        """BM25 over the live chunks of all segments, among the positions set in mask if given; (chunk_id, score) pairs"""
+        masks = []
+        for segment, offset in zip(self.segments, self.offsets):
+            allowed = self.live_mask(segment)
+            if mask is not None:
+                part = mask[offset:offset + len(segment)]
+                allowed = part if allowed is None else part & allowed
+            masks.append(None if allowed is None else segment.lexical_mask(allowed))
+        return search_indexes([segment.lexical_index for segment in self.segments], query, k, masks)
+
+    def lexical_stats(self):
+        stats = {"chunks": 0, "terms": 0, "postings": 0, "tombstones": 0, "approx_bytes": 0}
+        for segment in self.segments:
+            for key, value in segment.lexical_index.stats().items():
+                stats[key] += value
+        stats["chunks"] -= self.ntotal - self.live
+        stats["tombstones"] += self.ntotal - self.live
+        return stats
+
+    def metadata(self):
+        """ChunkMetadataIndex over all positions (each segment's part is read once and shared)"""
+        return ChunkMetadataIndex.concatenate([segment.metadata() for segment in self.segments])
+
+    def index_type(self):
+        """Type of the largest segment's index"""
+        return index_type_of(max(self.segments, key=len).index)
+
+    def compression_stats(self):
+        compressed = [segment.compressed for segment in self.segments if segment.compressed is not None]
+        if not compressed:
+            return None
+        return {
+            "mode": compressed[0].mode,
+            "vectors": sum(codes.ntotal for codes in compressed),
+            "bytes_per_vector": compressed[0].code_size,
+            "bytes": sum(codes.stats()["bytes"] for codes in compressed),
+        }
+
+    def segment_stats(self):
+        return [
+            {
+                "name": segment.name,
+                "index_type": index_type_of(segment.index),
+                "vectors": len(segment),
+                "deleted": len(self.deleted.get(segment.name, ())),
+                "memory_mapped": segment.mapped,
+            }
+            for segment in self.segments
+        ]
+
+    def memory_bytes(self):
+        return sum(segment.memory_bytes() for segment in self.segments)
+
+
+class SegmentedDocstore(Docstore):
+    """Chunk text of a SegmentedIndex, looked up in its segments newest first"""
+
+    def __init__(self, segments):
+        self.segments = segments
+
+    def search(self, search):
+        return self.search_many([search]).get(search, f"ID {search} not found.")
+
+    def search_many(self, ids):
+        """Fetch several chunks at once; returns {chunk_id: Document}"""
+        found = {}
+        for segment in reversed(self.segments):
+            missing = [chunk_id for chunk_id in ids if chunk_id not in found]
+            if not missing:
+                break
+            found.update(segment.docstore.search_many(missing))
+        return found
+
+
+class SegmentPositions(Mapping):
+    """Position -> chunk ID of the live rows of a SegmentedIndex (LangChain's index_to_docstore_id)"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, position):
+        segment, local = self.index.locate(position)
+        live = self.index.live_mask(segment)
+        if live is not None and not live[local]:
+            raise KeyError(position)
+        return segment.chunk_ids[local]
+
+    def __iter__(self):
+        for segment, offset in zip(self.index.segments, self.index.offsets):
+            live = self.index.live_mask(segment)
+            positions = range(len(segment)) if live is None else np.flatnonzero(live).tolist()
+            for position in positions:
+                yield offset + position
+
+    def __len__(self):
+        return self.index.live
+
+
+def as_vectorstore(index, embeddings):
+    """LangChain FAISS store over a SegmentedIndex (for the QA chain's retriever)"""
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=SegmentedDocstore(index.segments),
+        index_to_docstore_id=SegmentPositions(index)
+    )
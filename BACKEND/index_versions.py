@@ -0,0 +1,151 @@
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from vector_persistence import INDEX_FILE, CHUNKS_FILE, is_native_vectorstore, stored_bytes
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIRECTORY = "versions"
+LOCK_FILE = ".writer.lock"
+
+_VERSION_RE = re.compile(r"^v(\d{6,})$")
+
+
+class IndexVersions:
+    """
+    Versioned on-disk home of the corpus index, shared by all server processes.
+
+    Every save is a new, immutable directory ``versions/vNNNNNN`` (written with
+    save_native and only ever read afterwards, so workers can memory-map it).
+    Segments unchanged since the previous version are hard links to its files,
+    so a version only adds the segments written since and old versions kept on
+    disk share most of their data.
+    The ``CURRENT`` file names the version to serve and is replaced atomically;
+    an empty ``CURRENT`` means the corpus is empty. Writers (uploads, deletes)
+    take an inter-process lock, so they always start from the latest version
+    and never publish over each other. The newest ``keep`` versions are kept
+    for workers still switching over; older ones are removed.
+    """
+
+    def __init__(self, root, keep: int = 3):
+        self.root = root
+        self.keep = max(1, keep)
+        self._versions_path = os.path.join(root, VERSIONS_DIRECTORY)
+        self._thread_lock = threading.Lock()
+        os.makedirs(self._versions_path, exist_ok=True)
+
+    def current(self):
+        """Name of the published version, "" if the corpus is empty, or None if nothing was ever published"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def path(self, version):
+        return os.path.join(self._versions_path, version)
+
+    def versions(self):
+        """Saved versions, oldest first"""
+        names = [name for name in os.listdir(self._versions_path) if _VERSION_RE.match(name)]
+        return sorted(names, key=lambda name: int(_VERSION_RE.match(name).group(1)))
+
+    @contextmanager
+    def writer(self):
+        """Hold the writer lock (across processes and threads) for a read-modify-publish cycle"""
+        with self._thread_lock:
+            with open(os.path.join(self.root, LOCK_FILE), "a+") as lock_file:
+                _lock_file(lock_file)
+                try:
+                    yield
+                finally:
+                    _unlock_file(lock_file)
+
+    def publish(self, save):
+        """
+        Save a new version with save(path) (None publishes an empty corpus), make
+        it current and remove old versions. Caller holds the writer lock.
+        Returns the new version's name ("" for an empty corpus).
+        """
+        version = ""
+        if save is not None:
+            existing = self.versions()
+            number = int(_VERSION_RE.match(existing[-1]).group(1)) + 1 if existing else 1
+            version = f"v{number:06d}"
+            save(self.path(version))
+        self._set_current(version)
+        self._remove_old_versions(version)
+        return version
+
+    def adopt_flat_layout(self):
+        """
+        Turn an index saved directly in root (before versioning) into version 1.
+        Caller holds the writer lock.
+        """
+        if self.current() is not None or not is_native_vectorstore(self.root):
+            return False
+        staging = self.path(f".adopt.{uuid.uuid4().hex}.tmp")
+        os.makedirs(staging)
+        for name in os.listdir(self.root):
+            if name in (VERSIONS_DIRECTORY, LOCK_FILE):
+                continue
+            os.rename(os.path.join(self.root, name), os.path.join(staging, name))
+        os.rename(staging, self.path("v000001"))
+        self._set_current("v000001")
+        return True
+
+    def _set_current(self, version):
+        partial = os.path.join(self.root, f".{CURRENT_FILE}.{os.getpid()}.tmp")
+        with open(partial, "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, os.path.join(self.root, CURRENT_FILE))
+
+    def _remove_old_versions(self, current):
+        # Mapped files stay readable after removal on POSIX; elsewhere removal is retried on the next publish
+        others = [version for version in self.versions() if version != current]
+        for version in others[:max(0, len(others) - (self.keep - 1))]:
+            shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def stats(self):
+        current = self.current()
+        path = self.path(current) if current else None
+        return {
+            "root": self.root,
+            "current": current,
+            "versions": self.versions(),
+            "index_bytes": stored_bytes(path, INDEX_FILE) if path else 0,
+            "chunks_bytes": stored_bytes(path, CHUNKS_FILE) if path else 0,
+        }
+
+
+def _lock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def _unlock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        return
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
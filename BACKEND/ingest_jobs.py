@@ -0,0 +1,164 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from executor import ExecutorSaturated
+
+logger = logging.getLogger(__name__)
+
+
+class IngestJob:
+    """Status of one document ingestion"""
+
+    def __init__(self, filename, doc_id, collection=None):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.doc_id = doc_id
+        self.collection = collection
+        self.status = "queued"  # queued / running / succeeded / failed
+        self.stage = "queued"  # parsing / embedding / lock_wait / indexing / publishing / done
+        self.progress = 0.0
+        self.error = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+
+    def update(self, stage, progress):
+        """Progress callback passed to SimpleRAGChatbot.prepare_document"""
+        self.stage = stage
+        self.progress = round(float(progress), 1)
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "doc_id": self.doc_id,
+            "collection": self.collection,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestJobRunner:
+    """
+    Small in-process job runner for document ingestion.
+
+    Jobs run on their own thread pool (``max_workers`` at a time) so a long
+    ingest never occupies the chat workers. At most ``max_pending`` jobs may be
+    queued or running; further submissions raise ExecutorSaturated. Other
+    index writes (document deletes) run on the same pool with run().
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 4,
+                 retry_after: int = 5, history: int = 1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.history = history
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest-worker")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._running_tasks = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn, filename, doc_id, collection=None):
+        """Queue fn(job) and return the job; fn returns False or raises on failure"""
+        job = IngestJob(filename, doc_id, collection)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorSaturated("ingest queue is full", self.retry_after)
+            self._pending += 1
+            self._jobs[job.job_id] = job
+            self._prune()
+
+        self._pool.submit(self._run, fn, job)
+        return job
+
+    def run(self, fn, *args):
+        """Queue fn(*args) on the ingest workers without a job record; returns a concurrent Future"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorSaturated("ingest queue is full", self.retry_after)
+            self._pending += 1
+        return self._pool.submit(self._run_task, fn, *args)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == "running") + self._running_tasks
+            return {
+                "name": "ingest",
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "queued": self._pending - running,
+                "in_flight": running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, job):
+        job.status = "running"
+        job.started_at = datetime.now().isoformat()
+        try:
+            if fn(job) is False:
+                raise RuntimeError("Failed to process the uploaded document")
+            job.status = "succeeded"
+            job.update("done", 100)
+        except Exception as e:
+            logger.error(f"Ingest job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now().isoformat()
+            with self._lock:
+                self._pending -= 1
+                if job.status == "succeeded":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def _run_task(self, fn, *args):
+        with self._lock:
+            self._running_tasks += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running_tasks -= 1
+                self._pending -= 1
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the history limit"""
+        excess = len(self._jobs) - self.history
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
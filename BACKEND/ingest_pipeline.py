@@ -0,0 +1,129 @@
+import queue
+import threading
+from collections import deque
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+# Pages extracted per process-pool task, and tasks kept in flight at once
+PAGES_PER_TASK = 16
+MAX_PENDING_TASKS = 4
+
+# Chunk batches buffered between the parsing thread and the embedder
+MAX_QUEUED_BATCHES = 4
+
+_DONE = object()
+
+
+def extract_pages(pdf_path, start, stop):
+    """Extract the text of pages [start, stop) (runs in a worker process)"""
+    reader = PdfReader(pdf_path)
+    labels = reader.page_labels
+    pages = []
+    for page_number in range(start, stop):
+        text = reader.pages[page_number].extract_text() or ""
+        pages.append((page_number, text, labels[page_number] if page_number < len(labels) else str(page_number + 1)))
+    return pages
+
+
+def iter_pages(pdf_path, total_pages, pool=None):
+    """
+    Yield one Document per page, in page order.
+
+    With a process pool, pages are extracted in ranges of PAGES_PER_TASK across
+    the pool with at most MAX_PENDING_TASKS ranges outstanding, so memory stays
+    bounded however long the PDF is.
+    """
+    metadata = {"source": pdf_path, "total_pages": total_pages}
+
+    if pool is None or total_pages <= PAGES_PER_TASK:
+        for page_number, text, label in extract_pages(pdf_path, 0, total_pages):
+            yield Document(page_content=text, metadata={**metadata, "page": page_number, "page_label": label})
+        return
+
+    pending = deque()
+    next_start = 0
+    try:
+        while next_start < total_pages or pending:
+            while next_start < total_pages and len(pending) < MAX_PENDING_TASKS:
+                stop = min(next_start + PAGES_PER_TASK, total_pages)
+                pending.append(pool.submit(extract_pages, pdf_path, next_start, stop))
+                next_start = stop
+
+            for page_number, text, label in pending.popleft().result():
+                yield Document(page_content=text, metadata={**metadata, "page": page_number, "page_label": label})
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_chunks(pages, text_splitter):
+    """Split pages into chunks lazily, one page at a time"""
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+class PdfIngestPipeline:
+    """
+    Streaming PDF ingestion: page extraction and splitting run on a background
+    thread (fanned out over a process pool when given) while the caller embeds
+    and indexes the previous batch. Only a few batches are ever held in memory.
+    """
+
+    def __init__(self, pdf_path, text_splitter, batch_size=64, pool=None):
+        self.pdf_path = pdf_path
+        self.text_splitter = text_splitter
+        self.batch_size = batch_size
+        self.pool = pool
+        self.total_pages = len(PdfReader(pdf_path).pages)
+        self.pages_done = 0
+        self.chunks_done = 0
+
+    def batches(self):
+        """Yield lists of up to batch_size chunk Documents"""
+        batches = queue.Queue(maxsize=MAX_QUEUED_BATCHES)
+        stop = threading.Event()
+
+        def put(item):
+            # Give up if the consumer went away instead of blocking forever
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                batch = []
+                pages = iter_pages(self.pdf_path, self.total_pages, self.pool)
+                for chunk in iter_chunks(pages, self.text_splitter):
+                    batch.append(chunk)
+                    if len(batch) >= self.batch_size:
+                        if not put((batch, chunk.metadata["page"])):
+                            pages.close()
+                            return
+                        batch = []
+                if batch:
+                    put((batch, self.total_pages - 1))
+                put(_DONE)
+            except Exception as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, name="pdf-parser", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                batch, last_page = item
+                self.pages_done = last_page + 1
+                self.chunks_done += len(batch)
+                yield batch
+        finally:
+            stop.set()
+            producer.join()
@@ -0,0 +1,307 @@
+import math
+import re
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+LEXICAL_FILE = "lexical.sqlite"
+
+# Identifiers such as "AB-1234", "POL.7.2" or "rev_b" are kept whole (and also split into parts)
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were "
+    "will with what which who how when where why do does did can i you we they he she".split()
+)
+
+# Removed chunks are only tombstoned; postings are compacted once they make up this share of the index
+_COMPACT_RATIO = 0.25
+
+_TF_MAX = 65535
+
+
+def tokenize(text):
+    """Lowercased terms; compound identifiers yield the whole token and its parts"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+
+def _to_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    return values
+
+
+def reciprocal_rank_fusion(rankings, k=60, with_scores=False):
+    """
+    Fuse ranked lists of IDs: score(id) = sum of 1 / (k + rank) over the lists containing it.
+    Returns IDs best first, or (id, score) pairs with with_scores.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if with_scores:
+        return [(item, scores[item]) for item in ranked]
+    return ranked
+
+
+def search_indexes(indexes, query, k=20, masks=None):
+    """
+    BM25 over several indexes searched as one: chunk counts, lengths and term
+    document frequencies are summed across them, so the top-k is the one a
+    single index of all their chunks would return. Returns (chunk_id, score)
+    pairs. masks, if given, holds for each index a boolean array over its chunk
+    numbers (or None for all of them); only chunks set in it are returned.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    n = total_length = 0
+    frequencies = Counter()
+    for index in indexes:
+        with index._lock:
+            n += len(index._numbers)
+            total_length += index._total_length
+            for term in terms:
+                postings = index._postings.get(term)
+                if postings is not None:
+                    frequencies[term] += len(postings[0])
+    if not n or not frequencies:
+        return []
+
+    weights = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in frequencies.items()}
+    results = []
+    for index, mask in zip(indexes, masks or [None] * len(indexes)):
+        results.extend(index._top(weights, total_length / n, k, mask))
+    results.sort(key=lambda item: item[1], reverse=True)
+    return results[:k]
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over chunk text, keyed by chunk ID.
+
+    Postings are pairs of typed arrays (uint32 chunk numbers, uint16 term
+    frequencies) per term, so the index costs a few bytes per posting and a
+    query scores whole posting lists with numpy. Chunks can be added and removed
+    incrementally; removed chunks are tombstoned and compacted away in bulk.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.Lock()
+        self._chunk_ids = []  # chunk number -> chunk ID (None once removed)
+        self._numbers = {}  # chunk ID -> chunk number
+        self._lengths = array("I")
+        self._postings = {}  # term -> (array("I") chunk numbers, array("H") term frequencies)
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def add(self, chunk_ids, texts):
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                if chunk_id in self._numbers:
+                    self._tombstone(chunk_id)
+                number = len(self._chunk_ids)
+                terms = tokenize(text)
+                self._chunk_ids.append(chunk_id)
+                self._numbers[chunk_id] = number
+                self._lengths.append(len(terms))
+                self._total_length += len(terms)
+                for term, frequency in Counter(terms).items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(number)
+                    postings[1].append(min(frequency, _TF_MAX))
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self._numbers:
+                    self._tombstone(chunk_id)
+            if len(self._chunk_ids) - len(self._numbers) > _COMPACT_RATIO * len(self._chunk_ids):
+                self._compact()
+
+    def search(self, query, k=20, allowed=None):
+        """Top-k (chunk_id, score) pairs by BM25, among the chunk IDs in allowed if given"""
+        mask = None
+        if allowed is not None:
+            with self._lock:
+                mask = np.zeros(len(self._chunk_ids), dtype=bool)
+                mask[[self._numbers[chunk_id] for chunk_id in allowed if chunk_id in self._numbers]] = True
+        return search_indexes([self], query, k, [mask])
+
+    def numbered_chunk_ids(self):
+        """The chunk ID of each chunk number (None where removed)"""
+        with self._lock:
+            return list(self._chunk_ids)
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        One index over the chunks of several, numbered in the order given:
+        parts are (index, chunk_ids) pairs naming the chunks of each index to
+        keep. Postings are renumbered and concatenated, not re-tokenized.
+        """
+        merged = cls(k1=parts[0][0].k1, b=parts[0][0].b) if parts else cls()
+        collected = {}  # term -> (chunk number arrays, term frequency arrays)
+        for index, chunk_ids in parts:
+            with index._lock:
+                numbers = np.array([index._numbers[chunk_id] for chunk_id in chunk_ids], dtype=np.int64)
+                renumber = np.full(len(index._chunk_ids), -1, dtype=np.int64)
+                renumber[numbers] = np.arange(len(merged._chunk_ids), len(merged._chunk_ids) + len(numbers))
+                lengths = np.frombuffer(index._lengths, dtype=np.uint32)[numbers]
+                for chunk_id in chunk_ids:
+                    merged._numbers[chunk_id] = len(merged._chunk_ids)
+                    merged._chunk_ids.append(chunk_id)
+                merged._lengths.frombytes(lengths.tobytes())
+                merged._total_length += int(lengths.sum())
+                for term, (term_numbers, frequencies) in index._postings.items():
+                    term_numbers = renumber[np.frombuffer(term_numbers, dtype=np.uint32)]
+                    keep = term_numbers >= 0
+                    if not keep.any():
+                        continue
+                    entry = collected.setdefault(term, ([], []))
+                    entry[0].append(term_numbers[keep].astype(np.uint32))
+                    entry[1].append(np.frombuffer(frequencies, dtype=np.uint16)[keep])
+        merged._postings = {
+            term: (_to_array("I", np.concatenate(numbers)), _to_array("H", np.concatenate(frequencies)))
+            for term, (numbers, frequencies) in collected.items()
+        }
+        return merged
+
+    def _top(self, weights, average_length, k, mask=None):
+        """
+        Top-k (chunk_id, score) pairs for the given per-term idf weights and
+        average chunk length, among the chunk numbers set in mask if given
+        """
+        with self._lock:
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+            matched = []
+            partial_scores = []
+            for term, idf in weights.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                numbers = np.frombuffer(postings[0], dtype=np.uint32)
+                frequencies = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths[numbers] / average_length)
+                matched.append(numbers)
+                partial_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+
+            if not matched:
+                return []
+
+            numbers, inverse = np.unique(np.concatenate(matched), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(partial_scores))
+            if mask is not None:
+                allowed = mask[numbers]
+                numbers, scores = numbers[allowed], scores[allowed]
+
+            top = np.argsort(-scores)
+            results = []
+            for i in top:
+                chunk_id = self._chunk_ids[numbers[i]]
+                if chunk_id is None:
+                    continue
+                results.append((chunk_id, float(scores[i])))
+                if len(results) == k:
+                    break
+            return results
+
+    def stats(self):
+        with self._lock:
+            postings = sum(len(numbers) for numbers, _ in self._postings.values())
+            return {
+                "chunks": len(self._numbers),
+                "terms": len(self._postings),
+                "postings": postings,
+                "tombstones": len(self._chunk_ids) - len(self._numbers),
+                "approx_bytes": postings * 6 + len(self._lengths) * 4,
+            }
+
+    def save(self, path):
+        """Write the (compacted) index to an SQLite file"""
+        with self._lock:
+            self._compact()
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value REAL)")
+            conn.execute("CREATE TABLE chunks (number INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, length INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE postings (term TEXT PRIMARY KEY, numbers BLOB NOT NULL, frequencies BLOB NOT NULL)")
+            conn.executemany("INSERT INTO settings VALUES (?, ?)", [("k1", self.k1), ("b", self.b)])
+            conn.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?)",
+                ((number, chunk_id, length) for number, (chunk_id, length) in enumerate(zip(self._chunk_ids, self._lengths)))
+            )
+            conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                ((term, numbers.tobytes(), frequencies.tobytes()) for term, (numbers, frequencies) in self._postings.items())
+            )
+            conn.commit()
+            conn.close()
+
+    @classmethod
+    def load(cls, path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            settings = dict(conn.execute("SELECT key, value FROM settings"))
+            index = cls(k1=settings.get("k1", 1.2), b=settings.get("b", 0.75))
+            for number, chunk_id, length in conn.execute("SELECT number, chunk_id, length FROM chunks ORDER BY number"):
+                index._chunk_ids.append(chunk_id)
+                index._numbers[chunk_id] = number
+                index._lengths.append(length)
+                index._total_length += length
+            for term, numbers, frequencies in conn.execute("SELECT term, numbers, frequencies FROM postings"):
+                index._postings[term] = (_to_array("I", numbers), _to_array("H", frequencies))
+        finally:
+            conn.close()
+        return index
+
+    def _tombstone(self, chunk_id):
+        number = self._numbers.pop(chunk_id)
+        self._chunk_ids[number] = None
+        self._total_length -= self._lengths[number]
+
+    def _compact(self):
+        """Renumber live chunks and drop tombstoned postings (caller holds the lock)"""
+        if len(self._numbers) == len(self._chunk_ids):
+            return
+
+        live = np.array([chunk_id is not None for chunk_id in self._chunk_ids], dtype=bool)
+        renumber = np.cumsum(live, dtype=np.int64) - 1
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+
+        postings = {}
+        for term, (numbers, frequencies) in self._postings.items():
+            numbers = np.frombuffer(numbers, dtype=np.uint32)
+            keep = live[numbers]
+            if not keep.any():
+                continue
+            postings[term] = (
+                _to_array("I", renumber[numbers[keep]].astype(np.uint32)),
+                _to_array("H", np.frombuffer(frequencies, dtype=np.uint16)[keep])
+            )
+
+        self._postings = postings
+        self._lengths = _to_array("I", lengths[live])
+        self._chunk_ids = [chunk_id for chunk_id in self._chunk_ids if chunk_id is not None]
+        self._numbers = {chunk_id: number for number, chunk_id in enumerate(self._chunk_ids)}
@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+
+
+class ChunkFilter:
+    """
+    Restricts retrieval to some documents and/or a page range.
+
+    doc_ids are document IDs; sources match a document's file name or path.
+    Pages count from 1 (the first page of the PDF) and the range is inclusive.
+    """
+
+    def __init__(self, doc_ids=None, sources=None, page_from=None, page_to=None):
+        self.doc_ids = list(doc_ids or [])
+        self.sources = list(sources or [])
+        self.page_from = page_from
+        self.page_to = page_to
+
+    def __bool__(self):
+        return bool(self.doc_ids or self.sources or self.page_from is not None or self.page_to is not None)
+
+    def document_ids(self, documents):
+        """Document IDs selected by doc_ids and sources (given the document manifest), or None for all"""
+        if not self.doc_ids and not self.sources:
+            return None
+        selected = {doc_id for doc_id in self.doc_ids if doc_id in documents}
+        names = set(self.sources)
+        for doc_id, info in documents.items():
+            if info.get("filename") in names or info.get("source") in names or os.path.basename(info.get("source") or "") in names:
+                selected.add(doc_id)
+        return selected
+
+
+class ChunkMetadataIndex:
+    """
+    Document and page of every vector position, as numpy arrays, so a
+    ChunkFilter turns into a mask of positions before the vector search (a
+    FAISS ID selector) instead of dropping hits after it.
+    """
+
+    def __init__(self, doc_numbers, pages, doc_ids):
+        self.doc_numbers = doc_numbers  # position -> index into doc_ids (-1: unknown)
+        self.pages = pages  # position -> 0-based page (-1: unknown)
+        self.doc_ids = doc_ids
+        self._doc_numbers = {doc_id: number for number, doc_id in enumerate(doc_ids)}
+
+    def __len__(self):
+        return len(self.pages)
+
+    @classmethod
+    def build(cls, n, rows):
+        """Index of n positions from (position, doc_id, page) rows (read without the chunk text)"""
+        doc_numbers = np.full(n, -1, dtype=np.int32)
+        pages = np.full(n, -1, dtype=np.int32)
+        doc_ids = {}
+        for position, doc_id, page in rows:
+            if doc_id is not None:
+                doc_numbers[position] = doc_ids.setdefault(doc_id, len(doc_ids))
+            if page is not None:
+                pages[position] = page
+        return cls(doc_numbers, pages, list(doc_ids))
+
+    @classmethod
+    def concatenate(cls, parts):
+        """One index over several, each part's positions following the previous part's"""
+        doc_ids = {}
+        doc_numbers = []
+        for part in parts:
+            # The extra last entry maps -1 (unknown) to itself
+            renumber = np.array([doc_ids.setdefault(doc_id, len(doc_ids)) for doc_id in part.doc_ids] + [-1], dtype=np.int32)
+            doc_numbers.append(renumber[part.doc_numbers])
+        if not parts:
+            return cls(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), [])
+        return cls(np.concatenate(doc_numbers), np.concatenate([part.pages for part in parts]), list(doc_ids))
+
+    def mask(self, chunk_filter, documents):
+        """Boolean array over positions: True where the chunk passes the filter"""
+        mask = np.ones(len(self), dtype=bool)
+        doc_ids = chunk_filter.document_ids(documents)
+        if doc_ids is not None:
+            numbers = [self._doc_numbers[doc_id] for doc_id in doc_ids if doc_id in self._doc_numbers]
+            mask &= np.isin(self.doc_numbers, numbers)
+        if chunk_filter.page_from is not None:
+            mask &= self.pages >= chunk_filter.page_from - 1
+        if chunk_filter.page_to is not None:
+            mask &= (self.pages <= chunk_filter.page_to - 1) & (self.pages >= 0)
+        return mask
+
+    def nbytes(self):
+        return self.doc_numbers.nbytes + self.pages.nbytes
@@ -0,0 +1,185 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond index searches up to slow LLM calls and ingests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Stage timings of the current request ({stage: seconds}); set by the HTTP middleware
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(label_names, label_values):
+    if not label_names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.label_names + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_label_text(bucket_labels, key + (_number(bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.label_names, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_label_text(self.label_names, key)} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauges read at scrape time from fn(), which returns {label values tuple: value}"""
+
+    def __init__(self, name, documentation, label_names, fn):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.fn()
+        except Exception:
+            return lines
+        for key, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_label_text(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """Minimal Prometheus text-format registry"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def gauge_callback(self, name, documentation, label_names, fn):
+        return self._register(GaugeCallback(name, documentation, label_names, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        # Re-registering (e.g. a module reloaded in development) replaces the old metric
+        self._metrics[metric.name] = metric
+        return metric
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering and ingestion", ["stage"]
+)
+STAGE_ERRORS = REGISTRY.counter("rag_stage_errors_total", "Stages that raised an exception", ["stage"])
+HTTP_REQUESTS = REGISTRY.counter("rag_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_SECONDS = REGISTRY.histogram("rag_http_request_seconds", "HTTP request latency (until response headers)", ["method", "route"])
+EVENT_LOOP_LAG = REGISTRY.histogram("rag_event_loop_lag_seconds", "Delay of the event loop in running a scheduled callback")
+SEMANTIC_CACHE = REGISTRY.counter("rag_semantic_cache_lookups_total", "Semantic cache lookups", ["result"])
+CHUNKS_INDEXED = REGISTRY.counter("rag_chunks_indexed_total", "Chunks embedded and added to the index")
+DOCUMENTS_INDEXED = REGISTRY.counter("rag_documents_indexed_total", "Documents ingested", ["result"])
+PROMPT_TOKENS = REGISTRY.counter(
+    "rag_prompt_context_tokens_total", "Context tokens retrieved and actually sent to the LLM", ["kind"]
+)
+LLM_CALLS = REGISTRY.counter("rag_llm_calls_total", "LLM calls", ["result"])
+
+
+def observe_stage(stage, seconds):
+    """Record a stage duration, also in the current request's breakdown"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def start_request_timings():
+    """Begin collecting stage timings for the current request; returns the dict filled in"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings, total=None):
+    """Format timings as a Server-Timing header value (durations in ms)"""
+    parts = [f"{stage.replace(' ', '_')};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
@@ -1,127 +1,686 @@
 import os
+import copy
+import json
+import hashlib
+import time
+import uuid
+import threading
+import weakref
+import multiprocessing
+from itertools import islice
+import numpy as np
+import faiss
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
 from langchain_google_genai import GoogleGenerativeAI
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
+from embedding_backends import create_embeddings, parity_report
+from semantic_cache import SemanticCache
+from lexical_index import reciprocal_rank_fusion
+from context_packing import ContextPacker
+from metrics import (
+    span, observe_stage, SEMANTIC_CACHE, CHUNKS_INDEXED, DOCUMENTS_INDEXED, PROMPT_TOKENS, LLM_CALLS
+)
+from embedding_store import CachedEmbeddings, file_hash
+from ingest_pipeline import PdfIngestPipeline
+from vector_persistence import (
+    MANIFEST_FILE, is_native_vectorstore, is_legacy_vectorstore, load_native, save_native, read_saved
+)
+from index_factory import reconstruct_all, recall_report
+from index_segments import (
+    SegmentedIndex, as_vectorstore, build_segment, conform_segment, maintain_segments, segment_from_vectorstore
+)
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Chunks embedded per model call during ingestion
+EMBEDDING_BATCH_SIZE = 64
+
+# Chunks passed to the LLM, and candidates taken from each retriever before fusion
+RETRIEVAL_K = 3
+RETRIEVAL_CANDIDATES = 20
+RRF_K = 60
+
+def document_id(pdf_path):
+    """Stable document ID derived from the file name, so re-uploads replace the previous version"""
+    filename = os.path.basename(pdf_path).lower()
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16]
+
+class IndexSnapshot:
+    """
+    One published state of the index: vector store (over a SegmentedIndex,
+    which also holds the keyword index), document manifest and the QA chain
+    over them. A query takes the current snapshot when it starts and uses
+    only that one, so an index swap never mixes two versions within a query.
+    Published snapshots are never changed; writers build the next one from
+    their segments (see _IndexDraft).
+    """
+
+    __slots__ = ("version", "vectorstore", "documents", "qa_chain", "metadata", "__weakref__")
+
+    def __init__(self, version=0, vectorstore=None, documents=None, qa_chain=None):
+        self.version = version
+        self.vectorstore = vectorstore
+        self.documents = documents if documents is not None else {}
+        self.qa_chain = qa_chain
+        self.metadata = None  # ChunkMetadataIndex, built by the first filtered search
+
+class PreparedDocument:
+    """
+    A parsed and embedded document not yet in the index: its manifest entry
+    and its chunks (IDs, text, metadata, vectors). duplicate_of is the ID of
+    an indexed document with the same file content, in which case it has no
+    chunks and is not indexed.
+    """
+
+    def __init__(self, info, duplicate_of=None):
+        self.info = info
+        self.duplicate_of = duplicate_of
+        self.chunk_ids = []
+        self.texts = []
+        self.metadatas = []
+        self.vectors = []
+
+    def add(self, chunk_ids, texts, metadatas, vectors):
+        self.chunk_ids.extend(chunk_ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self.vectors.extend(vectors)
+
+class _IndexDraft:
+    """
+    Private, writable parts of the next snapshot while a writer builds it: the
+    list of (shared, immutable) segments, the positions deleted in each and
+    the document manifest
+    """
+
+    def __init__(self, segments, deleted, documents):
+        self.segments = segments
+        self.deleted = deleted
+        self.documents = documents
 
 class SimpleRAGChatbot:
-    def __init__(self, gemini_api_key):
+    def __init__(self, gemini_api_key, semantic_cache=None, embedding_store=None, parse_workers=None,
+                 index_type="auto", nprobe=16, ef_search=64, lazy=False,
+                 embedding_backend="torch", embedding_threads=None, hybrid_retrieval=True,
+                 context_token_budget=1024, llm=None, vector_compression="none", rescore_factor=None):
         """
-        Initialize the RAG chatbot with Gemini LLM and HuggingFace embeddings
+        Initialize the RAG chatbot with Gemini LLM and HuggingFace embeddings.
+        
+        With lazy=True the embeddings model is not loaded here; call
+        load_embeddings_model() (e.g. from a background thread) before use.
+        embedding_backend selects how the model runs: "torch", "onnx" or "onnx-int8".
+        With hybrid_retrieval, BM25 keyword matches are fused with vector search
+        results (reciprocal-rank fusion). Retrieved chunks are packed into at most
+        context_token_budget tokens of context before the LLM call.
+        llm replaces the Gemini model (e.g. fake_llm.FakeLLM for offline benchmarks).
+        vector_compression ("fp16", "sq8", "sq4" or "binary") searches compact
+        codes of the vectors first and rescores rescore_factor * k candidates
+        against the full-precision vectors, which can then stay on disk.
         """
         # Set API key
         os.environ["GOOGLE_API_KEY"] = gemini_api_key
         
         # Initialize Gemini LLM
-        self.llm = GoogleGenerativeAI(
+        self.llm = llm or GoogleGenerativeAI(
             model="gemini-1.5-flash",
             temperature=0.1,
             google_api_key=gemini_api_key
         )
         
-        # Initialize HuggingFace embeddings (free, runs locally)
-        print("Loading HuggingFace embeddings model (first time may take a few minutes)...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",  # Lightweight model
-            model_kwargs={'device': 'cpu'},  # Use CPU
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        self.embeddings = None
+        self._reference_embeddings = None  # fp32 model for embedding_parity, loaded on first use
+        self._parity_lock = threading.Lock()
+        self.embedding_store = embedding_store
+        self.embedding_backend = embedding_backend
+        self.embedding_threads = embedding_threads
         
         # Initialize text splitter
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
+            add_start_index=True,  # lets context packing merge overlapping neighbours exactly
         )
         
-        # Vector store will be initialized after loading documents
-        self.vectorstore = None
-        self.qa_chain = None
+        # Merges overlapping hits, drops repeats and trims the context to a token budget
+        self.context_packer = ContextPacker(token_budget=context_token_budget, tokenizer_name=EMBEDDING_MODEL_NAME)
+        
+        # Keyword (BM25) index over the same chunks, for part numbers, codes and acronyms
+        self.hybrid_retrieval = hybrid_retrieval
+        
+        # The served index (vector store, keyword index, document manifest, QA chain) is an
+        # immutable snapshot swapped in one assignment; the lock only serializes writers
+        self._snapshot = IndexSnapshot()
+        self._retired = weakref.WeakSet()  # replaced snapshots that queries may still be using
+        self._index_lock = threading.RLock()
+        
+        # ANN index type ("auto", "flat", "hnsw" or "ivf") and its search knobs
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        
+        # Compressed first pass over the vectors ("none" searches the index itself)
+        self.vector_compression = vector_compression
+        self.rescore_factor = rescore_factor
+        
+        # Worker processes for PDF page extraction during ingestion
+        self.parse_workers = parse_workers if parse_workers is not None else min(4, max(1, (os.cpu_count() or 1) - 1))
+        self._parse_pool = None
+        self._pool_owner = None  # chatbot whose pool this one shares (see for_collection)
+        
+        # Cache of answers to past (near-duplicate) queries, cleared whenever the vectorstore changes
+        self.semantic_cache = semantic_cache or SemanticCache()
+        
+        if not lazy:
+            self.load_embeddings_model()
         
         print("RAG Chatbot initialized successfully!")
     
-    def load_document(self, pdf_path):
+    # Views of the current snapshot
+    @property
+    def vectorstore(self):
+        return self._snapshot.vectorstore
+    
+    @property
+    def documents(self):
+        """Documents in the vector store: doc_id -> metadata and chunk IDs"""
+        return self._snapshot.documents
+    
+    @property
+    def qa_chain(self):
+        return self._snapshot.qa_chain
+    
+    @property
+    def index_version(self):
+        return self._snapshot.version
+    
+    def for_collection(self, semantic_cache=None):
         """
-        Load and process PDF document for RAG
+        Chatbot over a separate, empty index (a named collection) that shares this
+        one's LLM, embeddings model, context packer, settings and PDF parse
+        workers. Only the index and the answer cache are its own.
+        """
+        bot = copy.copy(self)
+        bot._snapshot = IndexSnapshot()
+        bot._retired = weakref.WeakSet()
+        bot._index_lock = threading.RLock()
+        bot._parse_pool = None
+        bot._pool_owner = self._pool_owner or self
+        bot.semantic_cache = semantic_cache or SemanticCache()
+        return bot
+    
+    def load_embeddings_model(self):
+        """Load the embeddings model (the slow part of startup)"""
+        # Initialize HuggingFace embeddings (free, runs locally)
+        print(f"Loading HuggingFace embeddings model on {self.embedding_backend} (first time may take a few minutes)...")
+        embeddings = create_embeddings(
+            self.embedding_backend,
+            EMBEDDING_MODEL_NAME,
+            threads=self.embedding_threads,
+            batch_size=EMBEDDING_BATCH_SIZE
+        )
+        
+        # Reuse stored embeddings of chunks seen before (re-uploads, revised documents).
+        # Backends produce slightly different vectors, so each keeps its own entries.
+        if self.embedding_store is not None:
+            embeddings = CachedEmbeddings(embeddings, self.embedding_store, self.embedding_model)
+        
+        with self._index_lock:
+            self.embeddings = embeddings
+            if self.vectorstore is not None:
+                self.vectorstore.embedding_function = embeddings
+    
+    @property
+    def embedding_model(self):
+        """Model (and backend, unless torch) the vectors come from"""
+        if self.embedding_backend == "torch":
+            return EMBEDDING_MODEL_NAME
+        return f"{EMBEDDING_MODEL_NAME}@{self.embedding_backend}"
+    
+    def warm_up(self):
+        """Run one query embedding and index search so the first real request is not the slow one"""
+        query_vector = self.embeddings.embed_query("warm up")
+        self.context_packer.counter.count("warm up")
+        if self.vectorstore is not None:
+            self.retrieve("warm up", query_vector)
+    
+    def load_document(self, pdf_path, doc_id=None, progress=None, raise_errors=False):
+        """
+        Load and process PDF document for RAG.
+        
+        The document's chunks are appended to the existing index under a stable
+        document ID (derived from the file name unless given). Loading a document
+        whose ID is already indexed replaces its chunks without touching the others.
+        
+        progress, if given, is called as progress(stage, percent) with stage one of
+        "parsing", "embedding" and "indexing".
         """
         try:
-            print(f"Loading document: {pdf_path}")
-            
-            # Load PDF using LangChain
-            loader = PyPDFLoader(pdf_path)
-            documents = loader.load()
-            
-            if not documents:
-                print("No content found in the PDF")
+            prepared = self.prepare_document(pdf_path, doc_id=doc_id, progress=progress)
+            if prepared is None:
                 return False
+            if progress:
+                progress("indexing", 90)
+            self.add_documents([prepared])
+            return True
+        except Exception as e:
+            print(f"Error loading document: {e}")
+            if raise_errors:
+                raise
+            return False
+    
+    def prepare_document(self, pdf_path, doc_id=None, progress=None):
+        """
+        Parse, split and embed a PDF without touching the index or taking its
+        lock, so several documents can be prepared at once; add_documents then
+        indexes the result. Returns None if no text could be extracted.
+        progress is called as in load_document ("parsing" and "embedding").
+        """
+        report = progress or (lambda stage, percent: None)
+        try:
+            print(f"Loading document: {pdf_path}")
+            doc_id = doc_id or document_id(pdf_path)
             
-            print(f"Loaded {len(documents)} pages from PDF")
-            
-            # Split documents into chunks
-            texts = self.text_splitter.split_documents(documents)
-            print(f"Split into {len(texts)} chunks")
+            # Identical file already indexed: no need to parse it (add_documents checks again under the lock)
+            content_hash = file_hash(pdf_path)
+            info = {
+                "doc_id": doc_id,
+                "filename": os.path.basename(pdf_path),
+                "source": pdf_path,
+                "size": os.path.getsize(pdf_path),
+                "file_hash": content_hash,
+            }
+            duplicate_of = self._find_duplicate(self.documents, content_hash)
+            if duplicate_of is not None:
+                return PreparedDocument(info, duplicate_of=duplicate_of)
             
-            # Create vector store (this will be much faster with local embeddings)
-            print("Creating embeddings and vector store...")
-            self.vectorstore = FAISS.from_documents(texts, self.embeddings)
+            # Stream pages -> chunks -> embedding batches; parsing overlaps with embedding
+            report("parsing", 0)
+            pipeline = PdfIngestPipeline(
+                pdf_path,
+                self.text_splitter,
+                batch_size=EMBEDDING_BATCH_SIZE,
+                pool=self._get_parse_pool()
+            )
+            print(f"Streaming {pipeline.total_pages} pages from PDF")
             
-            # Create custom prompt template
-            prompt_template = """
-Use the following pieces of context to answer the question. If you cannot find the answer in the context, just say "I don't know". Do not make up an answer.
-
-Context: {context}
-
-Question: {question}
-
-Answer:"""
+            prepared = PreparedDocument(info)
+            batches = pipeline.batches()
+            try:
+                while True:
+                    # Time spent waiting on the parser (it runs ahead on its own thread)
+                    with span("ingest_parse_wait"):
+                        batch = next(batches, None)
+                    if batch is None:
+                        break
+                    
+                    for chunk in batch:
+                        chunk.metadata["doc_id"] = doc_id
+                    texts = [chunk.page_content for chunk in batch]
+                    with span("ingest_embed"):
+                        vectors = self.embeddings.embed_documents(texts)
+                    prepared.add(
+                        [f"{doc_id}-{uuid.uuid4().hex}" for _ in batch], texts, [chunk.metadata for chunk in batch], vectors
+                    )
+                    
+                    report("embedding", 5 + 85 * pipeline.pages_done / max(pipeline.total_pages, 1))
+            finally:
+                batches.close()
             
-            PROMPT = PromptTemplate(
-                template=prompt_template,
-                input_variables=["context", "question"]
-            )
+            print(f"Split into {len(prepared.chunk_ids)} chunks")
+            if not prepared.chunk_ids:
+                print("No text could be extracted from the PDF")
+                DOCUMENTS_INDEXED.inc(result="error")
+                return None
             
-            # Create QA chain
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=self.vectorstore.as_retriever(
-                    search_type="similarity",
-                    search_kwargs={"k": 3}  # Retrieve top 3 most similar chunks
-                ),
-                chain_type_kwargs={"prompt": PROMPT},
-                return_source_documents=False
-            )
+            info["pages"] = pipeline.total_pages
+            return prepared
+        except Exception:
+            DOCUMENTS_INDEXED.inc(result="error")
+            raise
+    
+    def add_documents(self, prepared):
+        """
+        Index prepared documents (from prepare_document) and publish them as one
+        new snapshot. Documents whose file is already indexed are skipped (their
+        duplicate_of is set). Returns the IDs of the documents added.
+        """
+        added = []
+        chunks = 0
+        with self._index_lock:
+            draft = self._draft()
+            new = {}  # doc_id -> document, indexed together as one new segment
+            for document in prepared:
+                info = document.info
+                # Checked under the lock, so two concurrent uploads of one file index it once
+                duplicate_of = document.duplicate_of or self._find_duplicate(draft.documents, info["file_hash"])
+                if duplicate_of is not None:
+                    document.duplicate_of = duplicate_of
+                    print(f"Document already indexed as {duplicate_of}, skipping")
+                    continue
+                
+                # Drop the chunks of a previous version of this document
+                previous = draft.documents.get(info["doc_id"])
+                if previous:
+                    self._remove_chunks(draft, previous["chunk_ids"])
+                new[info["doc_id"]] = document
+                
+                draft.documents[info["doc_id"]] = {
+                    **info,
+                    "chunks": len(document.chunk_ids),
+                    "chunk_ids": document.chunk_ids,
+                    "indexed_at": datetime.now().isoformat()
+                }
+                added.append(info["doc_id"])
+                chunks += len(document.chunk_ids)
             
+            if new:
+                with span("ingest_index_add"):
+                    draft.segments.append(self._new_segment(draft, new.values()))
+            if added:
+                with span("ingest_finalize"):
+                    self._maintain(draft)
+                    self._publish(draft)
+        
+        if added:
+            CHUNKS_INDEXED.inc(chunks)
+            DOCUMENTS_INDEXED.inc(len(added), result="ok")
             print("Document loaded and processed successfully!")
-            return True
+        return added
+    
+    def _new_segment(self, draft, documents):
+        """Segment over the chunks of prepared documents (only their vectors are indexed and encoded)"""
+        chunk_ids, vectors, docs = [], [], {}
+        for document in documents:
+            chunk_ids.extend(document.chunk_ids)
+            vectors.extend(document.vectors)
+            for chunk_id, text, metadata in zip(document.chunk_ids, document.texts, document.metadatas):
+                docs[chunk_id] = Document(id=chunk_id, page_content=text, metadata=metadata)
+        metric = draft.segments[0].index.metric_type if draft.segments else faiss.METRIC_L2
+        return build_segment(vectors, chunk_ids, docs, metric=metric, **self._segment_settings())
+    
+    def _segment_settings(self):
+        return {
+            "index_type": self.index_type,
+            "compression": self.vector_compression,
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+        }
+    
+    @staticmethod
+    def _find_duplicate(documents, content_hash):
+        """ID of the document in documents whose file has this content hash, or None"""
+        for info in documents.values():
+            if info.get("file_hash") == content_hash:
+                return info["doc_id"]
+        return None
+    
+    def delete_document(self, doc_id) -> bool:
+        """Remove one document's chunks from the index without re-embedding the others"""
+        with self._index_lock:
+            if doc_id not in self.documents:
+                return False
             
-        except Exception as e:
-            print(f"Error loading document: {e}")
-            return False
+            draft = self._draft()
+            info = draft.documents.pop(doc_id)
+            self._remove_chunks(draft, info["chunk_ids"])
+            self._maintain(draft)
+            self._publish(draft)
+        print(f"Document {doc_id} removed from vector store")
+        return True
+    
+    def _remove_chunks(self, draft, chunk_ids):
+        """Mark chunks deleted in a draft's segments (their rows go when the segment is compacted or merged)"""
+        remaining = set(chunk_ids)
+        for segment in draft.segments:
+            if not remaining:
+                break
+            found = segment.find(remaining)
+            if found:
+                draft.deleted[segment.name] = draft.deleted.get(segment.name, frozenset()) | frozenset(found.values())
+                remaining.difference_update(found)
+    
+    def _maintain(self, draft):
+        """Compact and merge a draft's segments so searches stay fast as documents come and go"""
+        with span("index_merge"):
+            draft.segments, draft.deleted = maintain_segments(draft.segments, draft.deleted, **self._segment_settings())
+    
+    def index_info(self):
+        """Current index type, size and search settings"""
+        snapshot = self._snapshot
+        if snapshot.vectorstore is None:
+            return {"index_type": None, "vectors": 0, "snapshot_version": snapshot.version}
+        
+        index = snapshot.vectorstore.index
+        return {
+            "index_type": index.index_type(),
+            "configured_type": self.index_type,
+            "vectors": index.live,
+            "dimension": index.d,
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "hybrid_retrieval": self.hybrid_retrieval,
+            "lexical": index.lexical_stats(),
+            "memory_mapped": all(segment.mapped for segment in index.segments),
+            "compression": index.compression_stats(),
+            "full_precision_bytes": index.live * index.d * 4,
+            "segments": index.segment_stats(),
+            "snapshot_version": snapshot.version,
+            "retired_snapshots_in_use": len(self._retired)
+        }
+    
+    def memory_bytes(self):
+        """
+        Estimated memory held by the served index: vectors (or only their codes
+        when compressed, the full vectors staying on disk), keyword index, chunk
+        IDs and answer cache
+        """
+        snapshot = self._snapshot
+        total = self.semantic_cache.stats()["bytes"]
+        if snapshot.vectorstore is None:
+            return total
+        
+        total += snapshot.vectorstore.index.memory_bytes()
+        if snapshot.metadata is not None:
+            total += snapshot.metadata.nbytes()
+        return total
+    
+    def index_report(self, k=10, n_queries=200):
+        """Recall@k, latency and bytes per vector of flat / IVF / HNSW settings and compressed modes on the current vectors"""
+        vectorstore = self.vectorstore
+        if vectorstore is None:
+            return []
+        index = vectorstore.index
+        vectors = reconstruct_all(index)
+        return recall_report(vectors, metric=index.metric_type, k=k, n_queries=n_queries)
+    
+    def embedding_parity(self, samples=64):
+        """
+        Compare the active embedding backend with the fp32 torch model on stored
+        chunks (or built-in sentences when nothing is indexed): cosine drift and
+        embeddings/sec of each.
+        """
+        texts = []
+        vectorstore = self.vectorstore
+        if vectorstore is not None:
+            chunk_ids = list(islice(vectorstore.index_to_docstore_id.values(), samples))
+            texts = [vectorstore.docstore.search(chunk_id).page_content for chunk_id in chunk_ids]
+        
+        candidate = getattr(self.embeddings, "embeddings", self.embeddings)
+        report = parity_report(self._parity_reference(), candidate, texts or None)
+        report["backend"] = self.embedding_backend
+        return report
+    
+    def _parity_reference(self):
+        """The fp32 torch model embedding_parity compares against, loaded once"""
+        if self.embedding_backend == "torch":
+            # The active model already is the reference
+            return getattr(self.embeddings, "embeddings", self.embeddings)
+        with self._parity_lock:
+            if self._reference_embeddings is None:
+                self._reference_embeddings = create_embeddings("torch", EMBEDDING_MODEL_NAME, batch_size=EMBEDDING_BATCH_SIZE)
+            return self._reference_embeddings
+    
+    def _get_parse_pool(self):
+        """Process pool for PDF page extraction, created on first use"""
+        if self.parse_workers <= 1:
+            return None
+        if self._pool_owner is not None:
+            return self._pool_owner._get_parse_pool()
+        
+        with self._index_lock:
+            if self._parse_pool is None:
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._parse_pool
+    
+    def close(self, wait=False):
+        """Release worker processes (with wait, until they have exited)"""
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=wait, cancel_futures=True)
+            self._parse_pool = None
+    
+    def list_documents(self):
+        """Documents currently searchable in the vector store"""
+        return [
+            {key: value for key, value in info.items() if key != "chunk_ids"}
+            for info in self.documents.values()
+        ]
     
     def save_vectorstore(self, path: str):
-        """Save the vector store to disk"""
-        if self.vectorstore:
-            self.vectorstore.save_local(path)
-            print(f"Vector store saved to {path}")
+        """Save the vector store and its document manifest to disk (no pickle)"""
+        with self._index_lock:
+            snapshot = self._snapshot
+            if not snapshot.vectorstore:
+                return
+            save_native(snapshot.vectorstore, path, snapshot.documents)
+            
+            # Serve from the saved files: memory-mapped and shared through the page cache
+            saved = read_saved(snapshot.vectorstore.index, path)
+            self._publish(_IndexDraft(list(saved.segments), saved.deleted, snapshot.documents), content_changed=False)
+        print(f"Vector store saved to {path}")
     
-    def load_vectorstore(self, path: str) -> bool:
-        """Load the vector store from disk"""
+    def load_vectorstore(self, path: str, allow_pickle=False) -> bool:
+        """
+        Load the vector store from disk.
+        
+        The FAISS index is memory-mapped and chunk text is read lazily from SQLite.
+        Vector stores in LangChain's pickle-based format are only loaded when
+        allow_pickle is set; saving them again converts them to the native format.
+        """
         try:
-            if os.path.exists(path):
-                self.vectorstore = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
-                self._setup_qa_chain()
+            if is_native_vectorstore(path):
+                self.attach_vectorstore(*load_native(path, self.embeddings))
                 print(f"Vector store loaded from {path}")
                 return True
+            
+            if is_legacy_vectorstore(path):
+                if not allow_pickle:
+                    print(f"Refusing to unpickle legacy vector store at {path}; load it once with allow_pickle=True to convert it")
+                    return False
+                
+                vectorstore = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+                documents = None
+                manifest_path = os.path.join(path, MANIFEST_FILE)
+                if os.path.exists(manifest_path):
+                    with open(manifest_path) as f:
+                        documents = json.load(f)
+                self.attach_vectorstore(vectorstore, documents)
+                print(f"Legacy vector store loaded from {path}")
+                return True
         except Exception as e:
             print(f"Error loading vector store: {e}")
         return False
     
-    def _setup_qa_chain(self):
-        """Setup the QA chain after vector store is ready"""
+    def attach_vectorstore(self, vectorstore, documents=None):
+        """
+        Start serving a vector store read with vector_persistence.load_native (or
+        any LangChain FAISS store). Segments built with another index type or
+        compression than the configured ones are rebuilt.
+        """
+        with self._index_lock:
+            index = vectorstore.index
+            if not isinstance(index, SegmentedIndex):
+                index = SegmentedIndex([segment_from_vectorstore(vectorstore)])
+            documents = documents or self._documents_from_docstore(as_vectorstore(index, self.embeddings))
+            
+            segments = []
+            deleted = dict(index.deleted)
+            for segment in index.segments:
+                conformed = conform_segment(segment, deleted, **self._segment_settings())
+                if conformed is not segment:
+                    deleted.pop(segment.name, None)
+                if conformed is not None:
+                    segments.append(conformed)
+            self._publish(_IndexDraft(segments, deleted, documents))
+
+    def detach_vectorstore(self):
+        """Stop serving the current vector store (the corpus is now empty)"""
+        with self._index_lock:
+            self._publish(_IndexDraft([], {}, {}))
+
+    def _draft(self):
+        """
+        Writable draft of the current snapshot for a writer to change (caller
+        holds the index lock). Segments are immutable and shared with the
+        snapshot: only the segment list, the deleted positions and the manifest
+        are copied, never vectors, text or postings.
+        """
+        snapshot = self._snapshot
+        if snapshot.vectorstore is None:
+            return _IndexDraft([], {}, dict(snapshot.documents))
+        index = snapshot.vectorstore.index
+        return _IndexDraft(list(index.segments), dict(index.deleted), dict(snapshot.documents))
+    
+    def _publish(self, draft, content_changed=True):
+        """Make draft the served snapshot with one swap (caller holds the index lock)"""
+        previous = self._snapshot
+        vectorstore = None
+        if draft.segments:
+            previous_index = previous.vectorstore.index if previous.vectorstore is not None else None
+            vectorstore = as_vectorstore(SegmentedIndex(draft.segments, draft.deleted, previous_index), self.embeddings)
+        self._snapshot = IndexSnapshot(
+            version=previous.version + 1 if content_changed else previous.version,
+            vectorstore=vectorstore,
+            documents=draft.documents,
+            qa_chain=self._build_qa_chain(vectorstore) if vectorstore is not None else None
+        )
+        # Freed by reference counting once the last query holding it finishes
+        self._retired.add(previous)
+        if content_changed:
+            self.semantic_cache.clear()
+    
+    def _documents_from_docstore(self, vectorstore):
+        """Rebuild the document manifest of a vector store saved without one"""
+        documents = {}
+        for chunk_id in vectorstore.index_to_docstore_id.values():
+            doc = vectorstore.docstore.search(chunk_id)
+            source = doc.metadata.get("source", "unknown")
+            doc_id = doc.metadata.get("doc_id") or document_id(source)
+            info = documents.setdefault(doc_id, {
+                "doc_id": doc_id,
+                "filename": os.path.basename(source),
+                "source": source,
+                "size": None,
+                "file_hash": None,
+                "pages": doc.metadata.get("total_pages"),
+                "chunks": 0,
+                "chunk_ids": [],
+                "indexed_at": None
+            })
+            info["chunks"] += 1
+            info["chunk_ids"].append(chunk_id)
+        return documents
+    
+    def _build_qa_chain(self, vectorstore):
+        """QA chain over a vector store"""
         prompt_template = """
 Use the following pieces of context to answer the question. If you cannot find the answer in the context, just say "I don't know". Do not make up an answer.
 
@@ -136,35 +695,125 @@ Answer:"""
             input_variables=["context", "question"]
         )
         
-        self.qa_chain = RetrievalQA.from_chain_type(
+        # Create QA chain
+        return RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
-            retriever=self.vectorstore.as_retriever(
+            retriever=vectorstore.as_retriever(
                 search_type="similarity",
-                search_kwargs={"k": 3}
+                search_kwargs={"k": 3}  # Retrieve top 3 most similar chunks
             ),
             chain_type_kwargs={"prompt": PROMPT},
             return_source_documents=False
         )
     
+    def retrieve(self, query, query_vector=None, k=RETRIEVAL_K, snapshot=None, filters=None, with_scores=False):
+        """
+        The k chunks most relevant to query: the vector index's nearest neighbours,
+        fused with BM25 keyword matches by reciprocal rank when hybrid retrieval is on.
+        Chunk text is fetched only for the final k. Searches the given snapshot
+        (default: the current one); query_vector is computed if not given.
+        
+        filters (a metadata_index.ChunkFilter) limits the search to some
+        documents and pages before it runs, so k hits are still returned when
+        enough chunks match. With with_scores, returns (Document, score) pairs:
+        the fused score with hybrid retrieval, otherwise the vector similarity
+        (cosine for normalized embeddings).
+        """
+        if query_vector is None:
+            query_vector = self._embed_query(query)
+        return self.retrieve_many([query], [query_vector], k=k, snapshot=snapshot, filters=filters, with_scores=with_scores)[0]
+    
+    def retrieve_many(self, queries, query_vectors, k=RETRIEVAL_K, snapshot=None, filters=None, with_scores=False):
+        """retrieve() for several queries with a single FAISS search over the matrix of query vectors"""
+        # No lock: the snapshot is never changed, however long a concurrent ingest takes
+        snapshot = snapshot or self._snapshot
+        vectorstore = snapshot.vectorstore
+        if vectorstore is None or not queries:
+            return [[] for _ in queries]
+        
+        candidates = max(k, RETRIEVAL_CANDIDATES) if self.hybrid_retrieval else k
+        matrix = np.asarray(query_vectors, dtype=np.float32).reshape(len(queries), -1)
+        
+        # Turn the filter into the set of positions allowed, before searching
+        index = vectorstore.index
+        mask = None
+        if filters:
+            with span("metadata_filter"):
+                mask = self._metadata_index(snapshot).mask(filters, snapshot.documents)
+                if not mask.any():
+                    return [[] for _ in queries]
+        
+        with span("vector_search"):
+            distances, positions = index.search(matrix, candidates, mask=mask, rescore_factor=self.rescore_factor)
+        
+        results = []
+        with span("lexical_search_and_fusion"):
+            for query, row, row_distances in zip(queries, positions, distances):
+                hits = [
+                    (index.chunk_id(position), self._similarity(vectorstore, distance))
+                    for position, distance in zip(row.tolist(), row_distances.tolist()) if position != -1
+                ]
+                if self.hybrid_retrieval:
+                    rankings = [[chunk_id for chunk_id, _ in hits]]
+                    rankings.append([chunk_id for chunk_id, _ in index.lexical_search(query, candidates, mask)])
+                    hits = reciprocal_rank_fusion(rankings, k=RRF_K, with_scores=True)
+                results.append(hits[:k])
+        
+        # Fetch the text of all hits at once
+        with span("fetch_chunks"):
+            chunk_ids = list({chunk_id for hits in results for chunk_id, _ in hits})
+            found = vectorstore.docstore.search_many(chunk_ids)
+        if with_scores:
+            return [[(found[chunk_id], score) for chunk_id, score in hits] for hits in results]
+        return [[found[chunk_id] for chunk_id, _ in hits] for hits in results]
+    
+    def _metadata_index(self, snapshot):
+        """The snapshot's document / page index, built on first use (concurrent first uses may both build it)"""
+        if snapshot.metadata is None:
+            snapshot.metadata = snapshot.vectorstore.index.metadata()
+        return snapshot.metadata
+    
+    @staticmethod
+    def _similarity(vectorstore, distance):
+        """Higher-is-better score of a FAISS distance (cosine similarity for normalized vectors under L2)"""
+        if vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return distance
+        return 1.0 - distance / 2.0
+    
     def chat(self, query):
         """
         Main chat function
         """
-        if not self.qa_chain:
+        snapshot = self._snapshot
+        if not snapshot.qa_chain:
             return "Please load a PDF document first using load_document() method."
         
         try:
             print(f"\nQuestion: {query}")
             
-            # Get answer from QA chain
-            result = self.qa_chain.invoke({"query": query})
-            answer = result["result"].strip()
+            # Embed once: the vector is used for both the cache lookup and retrieval
+            query_vector = self._embed_query(query)
+            cached = self._cache_lookup(query_vector)
+            if cached:
+                print(f"Answer (cached): {cached['answer']}")
+                return cached["answer"]
+            
+            # Get answer from QA chain using the documents retrieved for this vector
+            docs = self.retrieve(query, query_vector, snapshot=snapshot)
+            context_docs = self._pack_context(docs)
+            with span("llm"):
+                result = self._call_llm(
+                    snapshot.qa_chain.combine_documents_chain.invoke, {"input_documents": context_docs, "question": query}
+                )
+            answer = result["output_text"].strip()
             
             # Clean up the answer
             if not answer or answer.lower() in ["i don't know", "i don't know.", ""]:
                 answer = "I don't know"
             
+            self._store_answer(snapshot, query_vector, answer, self._format_sources(docs))
+            
             print(f"Answer: {answer}")
             return answer
             
@@ -176,49 +825,215 @@ Answer:"""
         """
         Chat function that also returns source information
         """
-        if not self.vectorstore:
+        snapshot = self._snapshot
+        if not snapshot.vectorstore:
             return "Please load a PDF document first.", []
         
         try:
+            query_vector = self._embed_query(query)
+            cached = self._cache_lookup(query_vector)
+            if cached:
+                return cached["answer"], cached["sources"]
+            
             # Get relevant documents
-            docs = self.vectorstore.similarity_search(query, k=3)
+            docs = self.retrieve(query, query_vector, snapshot=snapshot)
             
             if not docs:
                 return "I don't know", []
             
-            # Create context from retrieved documents
-            context = "\n\n".join([doc.page_content for doc in docs])
+            answer = self._answer_from_docs(query, docs)
+            sources = self._format_sources(docs)
+            self._store_answer(snapshot, query_vector, answer, sources)
             
-            # Create prompt
-            prompt = f"""
-Based on the following context, answer the question. If you cannot find the answer in the context, just say "I don't know".
-
-Context: {context}
-
-Question: {query}
-
-Answer:"""
+            return answer, sources
             
-            # Get answer from LLM
-            answer = self.llm.invoke(prompt).strip()
+        except Exception as e:
+            print(f"Error: {e}")
+            return "I don't know", []
+    
+    def chat_many(self, queries, parallelism=4):
+        """
+        Answer many questions in one go (evaluations, FAQ pre-generation).
+        
+        All questions are embedded in one batched call and retrieved with one
+        multi-query index search; the LLM calls then run at most parallelism at
+        a time. Yields {"index", "question", "answer", "sources", "cached"} for
+        each question as its answer completes (not in input order).
+        """
+        queries = list(queries)
+        snapshot = self._snapshot
+        if not snapshot.vectorstore:
+            for i, query in enumerate(queries):
+                yield {"index": i, "question": query, "answer": "Please load a PDF document first.", "sources": [], "cached": False}
+            return
+        
+        # Queries skip the embedding store (it holds document chunks only)
+        embedder = getattr(self.embeddings, "embeddings", self.embeddings)
+        with span("embed_query_batch"):
+            query_vectors = embedder.embed_documents(queries)
+        
+        pending = []
+        for i, (query, query_vector) in enumerate(zip(queries, query_vectors)):
+            cached = self._cache_lookup(query_vector)
+            if cached:
+                yield {"index": i, "question": query, "answer": cached["answer"], "sources": cached["sources"], "cached": True}
+            else:
+                pending.append(i)
+        
+        retrieved = self.retrieve_many([queries[i] for i in pending], [query_vectors[i] for i in pending], snapshot=snapshot)
+        
+        pool = ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="batch-llm")
+        try:
+            futures = {
+                pool.submit(self._answer_from_docs, queries[i], docs): (i, docs)
+                for i, docs in zip(pending, retrieved)
+            }
+            for future in as_completed(futures):
+                i, docs = futures[future]
+                result = {"index": i, "question": queries[i], "sources": self._format_sources(docs), "cached": False}
+                try:
+                    result["answer"] = future.result()
+                    self._store_answer(snapshot, query_vectors[i], result["answer"], result["sources"])
+                except Exception as e:
+                    print(f"Error answering batch question {i}: {e}")
+                    result.update(answer="I don't know", error=str(e))
+                yield result
+        finally:
+            # Stop queued LLM calls if the caller stops reading
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _answer_from_docs(self, query, docs):
+        """One LLM call over the packed context of docs"""
+        if not docs:
+            return "I don't know"
+        
+        # Create prompt from retrieved documents
+        prompt = self._build_sources_prompt(query, self._pack_context(docs))
+        
+        # Get answer from LLM
+        with span("llm"):
+            answer = self._call_llm(self.llm.invoke, prompt).strip()
+        
+        if not answer or "i don't know" in answer.lower():
+            answer = "I don't know"
+        return answer
+    
+    def stream_chat(self, query):
+        """
+        Streaming chat function. Yields events as they become available:
+        {"type": "sources", ...} right after retrieval, then {"type": "token", ...}
+        for each LLM chunk, and finally {"type": "done", "answer": ...}
+        """
+        snapshot = self._snapshot
+        if not snapshot.vectorstore:
+            yield {"type": "done", "answer": "Please load a PDF document first.", "sources": []}
+            return
+        
+        try:
+            query_vector = self._embed_query(query)
+            cached = self._cache_lookup(query_vector)
+            if cached:
+                yield {"type": "sources", "sources": cached["sources"]}
+                yield {"type": "token", "text": cached["answer"]}
+                yield {"type": "done", "answer": cached["answer"], "sources": cached["sources"]}
+                return
+            
+            # Retrieval first so sources reach the client before generation starts
+            docs = self.retrieve(query, query_vector, snapshot=snapshot)
+            sources = self._format_sources(docs)
+            yield {"type": "sources", "sources": sources}
             
+            if not docs:
+                yield {"type": "done", "answer": "I don't know", "sources": sources}
+                return
+            
+            # Stream tokens from LLM
+            prompt = self._build_sources_prompt(query, self._pack_context(docs))
+            parts = []
+            llm_start = time.perf_counter()
+            try:
+                for chunk in self.llm.stream(prompt):
+                    if not chunk:
+                        continue
+                    if not parts:
+                        observe_stage("llm_first_token", time.perf_counter() - llm_start)
+                    parts.append(chunk)
+                    yield {"type": "token", "text": chunk}
+                LLM_CALLS.inc(result="ok")
+            except Exception:
+                LLM_CALLS.inc(result="error")
+                raise
+            observe_stage("llm", time.perf_counter() - llm_start)
+            
+            answer = "".join(parts).strip()
             if not answer or "i don't know" in answer.lower():
                 answer = "I don't know"
             
-            # Extract source information
-            sources = []
-            for doc in docs:
-                source_info = {
-                    'content': doc.page_content[:200] + "...",
-                    'metadata': doc.metadata
-                }
-                sources.append(source_info)
+            self._store_answer(snapshot, query_vector, answer, sources)
             
-            return answer, sources
+            yield {"type": "done", "answer": answer, "sources": sources}
             
         except Exception as e:
-            print(f"Error: {e}")
-            return "I don't know", []
+            print(f"Error streaming response: {e}")
+            yield {"type": "error", "answer": "I don't know"}
+    
+    def _embed_query(self, query):
+        with span("embed_query"):
+            return self.embeddings.embed_query(query)
+    
+    def _cache_lookup(self, query_vector):
+        with span("cache_lookup"):
+            cached = self.semantic_cache.lookup(query_vector)
+        SEMANTIC_CACHE.inc(result="hit" if cached else "miss")
+        return cached
+    
+    def _store_answer(self, snapshot, query_vector, answer, sources):
+        """Cache an answer unless the index changed while it was being generated"""
+        if snapshot.version == self._snapshot.version:
+            self.semantic_cache.store(query_vector, answer, sources)
+    
+    def _call_llm(self, fn, *args):
+        try:
+            result = fn(*args)
+        except Exception:
+            LLM_CALLS.inc(result="error")
+            raise
+        LLM_CALLS.inc(result="ok")
+        return result
+    
+    def _pack_context(self, docs):
+        """Retrieved chunks -> the (smaller) set of passages actually sent to the LLM"""
+        with span("pack_context"):
+            packed, report = self.context_packer.pack(docs)
+        PROMPT_TOKENS.inc(report["input_tokens"], kind="retrieved")
+        PROMPT_TOKENS.inc(report["packed_tokens"], kind="sent")
+        print(f"Context: {report['packed_tokens']} tokens from {report['chunks']} chunks ({report['saved_tokens']} saved)")
+        return packed
+    
+    def _build_sources_prompt(self, query, docs):
+        """Build the prompt used by chat_with_sources and stream_chat"""
+        # Create context from retrieved documents
+        context = "\n\n".join([doc.page_content for doc in docs])
+        
+        return f"""
+Based on the following context, answer the question. If you cannot find the answer in the context, just say "I don't know".
+
+Context: {context}
+
+Question: {query}
+
+Answer:"""
+    
+    def _format_sources(self, docs):
+        """Extract source information from retrieved documents"""
+        sources = []
+        for doc in docs:
+            source_info = {
+                'content': doc.page_content[:200] + "...",
+                'metadata': doc.metadata
+            }
+            sources.append(source_info)
+        return sources
 
 def main():
     """
@@ -1,18 +1,33 @@
-from fastapi import FastAPI, HTTPException, Form, File, UploadFile
+from fastapi import FastAPI, HTTPException, Form, File, UploadFile, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 import os
 import json
 import asyncio
 import logging  
+import time
 from datetime import datetime
-import uuid
 from pathlib import Path
 
 # Import your RAG chatbot class
-from rag import SimpleRAGChatbot
+from rag import SimpleRAGChatbot, document_id
+from executor import RAGExecutor, ExecutorSaturated
+from semantic_cache import SemanticCache
+from embedding_store import EmbeddingStore
+from ingest_jobs import IngestJob, IngestJobRunner
+from readiness import Readiness
+from session_store import SessionStore
+from single_flight import SingleFlight, normalize_query
+from metrics import (
+    REGISTRY, HTTP_REQUESTS, HTTP_SECONDS, EVENT_LOOP_LAG, start_request_timings, server_timing_header
+)
+from vector_persistence import load_native, read_manifest
+from index_versions import IndexVersions
+from collection_manager import Collection, CollectionManager, valid_collection_name
+from metadata_index import ChunkFilter
+from document_catalog import DocumentCatalog, STATUSES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +45,11 @@ class ChatResponse(BaseModel):
     status: str = "success"
     sources: Optional[List[Dict[str, Any]]] = None
 
+class BatchChatRequest(BaseModel):
+    questions: List[str]
+    parallelism: Optional[int] = None
+    collection: Optional[str] = None
+
 class ChatSession(BaseModel):
     chat_id: str
     messages: List[Dict[str, Any]]
@@ -54,64 +74,509 @@ app.add_middleware(
 
 # Global variables
 chatbot_instance = None
-chat_sessions: Dict[str, Dict] = {}
 UPLOAD_DIRECTORY = "uploaded_documents"
 VECTORSTORE_DIRECTORY = "vectorstores"
+CORPUS_VECTORSTORE_PATH = os.path.join(VECTORSTORE_DIRECTORY, "corpus")
+EMBEDDING_STORE_PATH = os.path.join(VECTORSTORE_DIRECTORY, "embeddings.sqlite")
+
+# The corpus index lives in versioned directories under CORPUS_VECTORSTORE_PATH, shared by all
+# server processes (uvicorn --workers N): each maps the published version read-only and
+# switches to a new one within INDEX_POLL_INTERVAL seconds of an upload on any worker
+INDEX_POLL_INTERVAL = float(os.getenv("INDEX_POLL_INTERVAL", "1.0"))
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+index_versions = IndexVersions(CORPUS_VECTORSTORE_PATH, keep=INDEX_KEEP_VERSIONS)
+default_collection = None  # the corpus above, served by chatbot_instance
+index_watch_task = None
+
+# Named collections (one knowledge base per team or product), each versioned like the corpus
+# under COLLECTIONS_PATH/<name>. They are loaded on first use and kept in an LRU bounded by
+# their estimated memory; idle ones are dropped and read again from disk when next asked for.
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_PATH = os.path.join(VECTORSTORE_DIRECTORY, "collections")
+COLLECTION_MAX_BYTES = int(os.getenv("COLLECTION_MAX_BYTES", str(1024 * 1024 * 1024)))
+COLLECTION_IDLE_SECONDS = float(os.getenv("COLLECTION_IDLE_SECONDS", "1800"))
+COLLECTION_CACHE_MAX_BYTES = int(os.getenv("COLLECTION_CACHE_MAX_BYTES", str(1024 * 1024)))
+collections = None
+
+# Set to 1 once to convert a vectorstore saved in LangChain's pickle format (unpickling runs code from the file)
+ALLOW_LEGACY_VECTORSTORE = os.getenv("ALLOW_LEGACY_VECTORSTORE", "0") == "1"
 
 # Ensure directories exist
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 os.makedirs(VECTORSTORE_DIRECTORY, exist_ok=True)
 
+# Every document of every collection with its ingest status, shared by all server processes
+DOCUMENT_CATALOG_PATH = os.getenv("DOCUMENT_CATALOG_PATH", os.path.join(VECTORSTORE_DIRECTORY, "catalog.sqlite"))
+document_catalog = DocumentCatalog(DOCUMENT_CATALOG_PATH)
+
+# Document indexed on first start when there is no saved vectorstore yet
+DEFAULT_PDF_PATH = os.getenv(
+    "DEFAULT_PDF_PATH",
+    str(Path(__file__).resolve().parent.parent / "DATA" / "newdata.pdf")
+)
+
 # Configuration
 GEMINI_API_KEY = "_api_key_"  # Replace with your actual API key or use environment variable
 
+# LLM_BACKEND=fake answers with a deterministic local stand-in (benchmarks, offline runs)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "0"))
+
+# Worker pools for blocking RAG work (retrieval + generation) and ingestion jobs
+RAG_WORKER_THREADS = int(os.getenv("RAG_WORKER_THREADS", "4"))
+RAG_MAX_QUEUE = int(os.getenv("RAG_MAX_QUEUE", "32"))
+RAG_QUEUE_TIMEOUT = float(os.getenv("RAG_QUEUE_TIMEOUT", "30"))
+INGEST_WORKER_THREADS = int(os.getenv("INGEST_WORKER_THREADS", "1"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "4"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")  # auto, flat, hnsw or ivf
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+VECTOR_COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none")  # none, fp16, sq8, sq4 or binary
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "0")) or None
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # torch, onnx or onnx-int8
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or None
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, max(1, (os.cpu_count() or 1) - 1)))))
+
+chat_executor = RAGExecutor(
+    "chat",
+    max_workers=RAG_WORKER_THREADS,
+    max_queue=RAG_MAX_QUEUE,
+    queue_timeout=RAG_QUEUE_TIMEOUT,
+    retry_after=RETRY_AFTER_SECONDS
+)
+# Batch question answering (/chat/batch) runs apart from interactive chat
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "1"))
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "2"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "16"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "10000"))
+
+batch_executor = RAGExecutor(
+    "batch",
+    max_workers=BATCH_MAX_JOBS,
+    max_queue=BATCH_MAX_QUEUE,
+    queue_timeout=RAG_QUEUE_TIMEOUT,
+    retry_after=RETRY_AFTER_SECONDS
+)
+# Retrieval-only requests (/search) have their own pool, so they never queue behind LLM calls
+SEARCH_WORKER_THREADS = int(os.getenv("SEARCH_WORKER_THREADS", "4"))
+SEARCH_MAX_QUEUE = int(os.getenv("SEARCH_MAX_QUEUE", "64"))
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "50"))
+
+search_executor = RAGExecutor(
+    "search",
+    max_workers=SEARCH_WORKER_THREADS,
+    max_queue=SEARCH_MAX_QUEUE,
+    queue_timeout=RAG_QUEUE_TIMEOUT,
+    retry_after=RETRY_AFTER_SECONDS
+)
+# Embedding parity checks load a second model and embed for seconds: one at a time, off the chat pool
+parity_executor = RAGExecutor(
+    "parity",
+    max_workers=1,
+    max_queue=2,
+    queue_timeout=RAG_QUEUE_TIMEOUT,
+    retry_after=RETRY_AFTER_SECONDS
+)
+ingest_jobs = IngestJobRunner(
+    max_workers=INGEST_WORKER_THREADS,
+    max_pending=INGEST_MAX_QUEUE,
+    retry_after=RETRY_AFTER_SECONDS
+)
+
+# Startup components; requests other than probes get a fast 503 while any is still loading
+readiness = Readiness(["llm", "embeddings", "index", "warmup"])
+STARTUP_EXEMPT_PATHS = {"/", "/livez", "/readyz", "/health", "/docs", "/openapi.json", "/redoc", "/executor/stats", "/metrics"}
+startup_task = None
+
+# Add a Server-Timing header with the per-stage breakdown to every response
+# (clients can also ask for it per request with "X-Request-Timing: 1")
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "0") == "1"
+EVENT_LOOP_PROBE_INTERVAL = 0.5
+loop_monitor_task = None
+
+# Chat sessions: SQLite-backed, with a bounded in-memory tier of recently used sessions
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "chat_sessions.sqlite")
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_CACHED_MESSAGES = int(os.getenv("SESSION_CACHED_MESSAGES", "50"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+MAX_PAGE_SIZE = 200
+
+chat_sessions = SessionStore(
+    SESSION_STORE_PATH,
+    max_sessions=SESSION_CACHE_SIZE,
+    ttl_seconds=SESSION_TTL_SECONDS,
+    cached_messages=SESSION_CACHED_MESSAGES,
+    flush_interval=SESSION_FLUSH_INTERVAL
+)
+
+# Semantic answer cache
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Maximum tokens of retrieved context sent to the LLM per question
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1024"))
+
+# Identical questions arriving while one is being answered share its retrieval and LLM call
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+chat_flights = SingleFlight("chat")
+
+async def run_in_executor(executor: RAGExecutor, fn, *args, **kwargs):
+    """Run blocking chatbot work off the event loop, mapping saturation to 503"""
+    try:
+        return await executor.run(fn, *args, **kwargs)
+    except ExecutorSaturated as e:
+        logger.warning(f"Rejecting request: {e.reason}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def answer_once(collection: Collection, method: str, message: str):
+    """
+    Run the collection's chatbot method(message) on the chat pool. Concurrent calls
+    with the same normalized question against the same collection and index
+    version share one run.
+    """
+    fn = getattr(collection.chatbot, method)
+    if not COALESCE_REQUESTS:
+        return await run_in_executor(chat_executor, fn, message)
+    key = (method, collection.name, normalize_query(message), collection.chatbot.index_version)
+    return await chat_flights.run(key, run_in_executor, chat_executor, fn, message)
+
+def collection_name(name: Optional[str]) -> str:
+    """The collection a request names (the default one if none); 400 if the name is invalid"""
+    if not chatbot_instance:
+        raise HTTPException(
+            status_code=503, 
+            detail="Chatbot not initialized. Please try again later."
+        )
+    if not name or name == DEFAULT_COLLECTION:
+        return DEFAULT_COLLECTION
+    if not valid_collection_name(name):
+        raise HTTPException(
+            status_code=400,
+            detail="Collection names are 1-64 letters, digits, '-' or '_'"
+        )
+    return name
+
+async def resolve_collection(name: Optional[str], create: bool = False) -> Collection:
+    """The default collection, or a named one (read from disk if not loaded); 404 if it does not exist"""
+    name = collection_name(name)
+    if name == DEFAULT_COLLECTION:
+        return default_collection
+    
+    collection = await asyncio.to_thread(collections.get, name, create)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"Collection {name} not found")
+    return collection
+
+def create_collection_chatbot():
+    """Chatbot for a named collection: shares the models of chatbot_instance, with a small answer cache of its own"""
+    return chatbot_instance.for_collection(SemanticCache(
+        threshold=CACHE_SIMILARITY_THRESHOLD,
+        max_entries=CACHE_MAX_ENTRIES,
+        ttl_seconds=CACHE_TTL_SECONDS,
+        max_bytes=COLLECTION_CACHE_MAX_BYTES
+    ))
+
+def create_llm():
+    """The configured LLM, or None for the default (Gemini)"""
+    if LLM_BACKEND == "fake":
+        from fake_llm import FakeLLM
+
+        logger.info(f"Using fake LLM ({FAKE_LLM_LATENCY_MS:g} ms latency)")
+        return FakeLLM(latency_ms=FAKE_LLM_LATENCY_MS, jitter_ms=FAKE_LLM_JITTER_MS)
+    if LLM_BACKEND != "gemini":
+        raise ValueError(f"Unknown LLM backend: {LLM_BACKEND}")
+    return None
+
 async def initialize_chatbot():
-    """Initialize the RAG chatbot"""
-    global chatbot_instance
+    """Create the RAG chatbot; the embeddings model and index are loaded by staged_startup"""
+    global chatbot_instance, default_collection, collections
+    readiness.loading("llm")
     try:
         logger.info("Initializing RAG chatbot...")
-        chatbot_instance = SimpleRAGChatbot(GEMINI_API_KEY)
+        semantic_cache = SemanticCache(
+            threshold=CACHE_SIMILARITY_THRESHOLD,
+            max_entries=CACHE_MAX_ENTRIES,
+            ttl_seconds=CACHE_TTL_SECONDS,
+            max_bytes=CACHE_MAX_BYTES
+        )
+        chatbot_instance = SimpleRAGChatbot(
+            GEMINI_API_KEY,
+            semantic_cache=semantic_cache,
+            embedding_store=EmbeddingStore(EMBEDDING_STORE_PATH),
+            parse_workers=PARSE_WORKERS,
+            index_type=INDEX_TYPE,
+            nprobe=IVF_NPROBE,
+            ef_search=HNSW_EF_SEARCH,
+            vector_compression=VECTOR_COMPRESSION,
+            rescore_factor=RESCORE_FACTOR,
+            lazy=True,
+            embedding_backend=EMBEDDING_BACKEND,
+            embedding_threads=EMBEDDING_THREADS,
+            hybrid_retrieval=HYBRID_RETRIEVAL,
+            context_token_budget=CONTEXT_TOKEN_BUDGET,
+            llm=create_llm()
+        )
+        default_collection = Collection(DEFAULT_COLLECTION, chatbot_instance, index_versions)
+        collections = CollectionManager(
+            COLLECTIONS_PATH,
+            create_collection_chatbot,
+            max_bytes=COLLECTION_MAX_BYTES,
+            idle_seconds=COLLECTION_IDLE_SECONDS,
+            keep_versions=INDEX_KEEP_VERSIONS
+        )
+        readiness.ready("llm")
         logger.info("RAG chatbot initialized successfully")
         return True
     except Exception as e:
+        readiness.failed("llm", e)
         logger.error(f"Failed to initialize chatbot: {e}")
         return False
 
-async def load_default_document():
-    """Load default document if available"""
-    global chatbot_instance
-    # default_pdf_path = "D:/main_RAG_bot/newdata.pdf"
-    
-    default_pdf_path = r"C:\Users\prakarsh.modi\python_work\delivered_RAG_bot\DATA\newdata.pdf"
- 
+async def load_embeddings():
+    """Load the embeddings model on a worker thread"""
+    readiness.loading("embeddings")
+    try:
+        await asyncio.to_thread(chatbot_instance.load_embeddings_model)
+        readiness.ready("embeddings")
+        logger.info("Embeddings model loaded")
+        return True
+    except Exception as e:
+        readiness.failed("embeddings", e)
+        logger.error(f"Failed to load embeddings model: {e}")
+        return False
+
+async def read_corpus_index():
+    """Map the published corpus index on a worker thread (does not need the embeddings model)"""
+    try:
+        await asyncio.to_thread(adopt_flat_layout)
+        version = index_versions.current()
+        if not version:
+            return None
+        return version, await asyncio.to_thread(load_native, index_versions.path(version), None)
+    except Exception as e:
+        logger.error(f"Error reading vectorstore: {e}")
+        return None
+
+def adopt_flat_layout():
+    """Move an index saved before versioning into the versioned layout"""
+    with index_versions.writer():
+        if index_versions.adopt_flat_layout():
+            logger.info("Moved the saved vectorstore into the versioned index directory")
+
+def load_default_index() -> bool:
+    """
+    Serve the published index, converting a legacy vectorstore or indexing the
+    default document first if nothing was published yet. Runs under the writer
+    lock, so only the first of several starting workers does the work.
+    """
+    with index_versions.writer():
+        if index_versions.current() is not None:
+            default_collection.sync()
+            return chatbot_instance.vectorstore is not None
 
+        if ALLOW_LEGACY_VECTORSTORE and chatbot_instance.load_vectorstore(CORPUS_VECTORSTORE_PATH, allow_pickle=True):
+            # Rewrite in the native format so later starts never unpickle
+            default_collection.publish()
+            logger.info(f"Converted legacy vectorstore with {len(chatbot_instance.documents)} documents")
+            return True
+
+        if os.path.exists(DEFAULT_PDF_PATH):
+            logger.info("Loading default document...")
+            if not chatbot_instance.load_document(DEFAULT_PDF_PATH):
+                raise RuntimeError("Failed to load default document")
+            default_collection.publish()
+            logger.info("Default document loaded successfully")
+            return True
+    return False
+
+async def load_default_document(loaded_index):
+    """Serve the published corpus if there is one, otherwise index the default document"""
+    if loaded_index is not None:
+        version, loaded = loaded_index
+        default_collection.attach(version, loaded)
+        logger.info(f"Loaded index version {version} with {len(chatbot_instance.documents)} documents")
+        return "loaded"
+
+    if await asyncio.to_thread(load_default_index):
+        return "loaded"
+    return None
+
+async def watch_index_versions():
+    """
+    Switch to newly published index versions (an upload or delete on any worker),
+    of the corpus and of loaded collections, and unload idle collections and
+    those over the memory budget
+    """
+    while True:
+        await asyncio.sleep(INDEX_POLL_INTERVAL)
+        if not readiness.is_ready:
+            continue
+        try:
+            version = index_versions.current()
+            if version is not None and version != default_collection.served_version:
+                if await asyncio.to_thread(default_collection.sync, version):
+                    logger.info(f"Switched to index version {version or '(empty)'}")
+            for name in await asyncio.to_thread(collections.sync_loaded):
+                logger.info(f"Switched collection {name} to a new index version")
+            for name in await asyncio.to_thread(collections.trim):
+                logger.info(f"Unloaded collection {name}")
+        except Exception as e:
+            logger.error(f"Error switching index version: {e}")
+
+def restore_catalog():
+    """Reconcile the catalog with the served corpus and resume ingests that a restart interrupted"""
+    removed = document_catalog.sync(
+        DEFAULT_COLLECTION, chatbot_instance.documents, chatbot_instance.embedding_model,
+        index_versions.root, default_collection.served_version
+    )
+    if removed:
+        logger.info(f"Dropped {removed} catalog entries for documents no longer in the index")
     
-    if os.path.exists(default_pdf_path) and chatbot_instance:
+    # Named collections indexed before the catalog existed: read their manifests, not their indexes
+    for name in collections.names():
+        if document_catalog.has_collection(name):
+            continue
+        versions = IndexVersions(os.path.join(COLLECTIONS_PATH, name), keep=INDEX_KEEP_VERSIONS)
+        version = versions.current()
+        if version:
+            document_catalog.sync(name, read_manifest(versions.path(version)), chatbot_instance.embedding_model, versions.root, version)
+    
+    for entry in document_catalog.claim_interrupted():
+        name, doc_id, file_path = entry["collection"], entry["doc_id"], entry["source"]
         try:
-            vectorstore_path = default_pdf_path.replace('.pdf', '_hf_vectorstore')
-            
-            # Try to load existing vectorstore first
-            if not chatbot_instance.load_vectorstore(vectorstore_path):
-                logger.info("Loading default document...")
-                success = chatbot_instance.load_document(default_pdf_path)
-                if success:
-                    chatbot_instance.save_vectorstore(vectorstore_path)
-                    logger.info("Default document loaded successfully")
-                else:
-                    logger.warning("Failed to load default document")
-            else:
-                logger.info("Loaded existing vectorstore for default document")
+            if not file_path or not os.path.exists(file_path):
+                raise FileNotFoundError(file_path)
+            target = default_collection if name == DEFAULT_COLLECTION else collections.get(name, create=True)
+            job = ingest_jobs.submit(
+                lambda job, target=target, file_path=file_path, doc_id=doc_id: ingest_document(target, file_path, doc_id, job),
+                entry["filename"],
+                doc_id,
+                collection=name
+            )
+            document_catalog.queued(name, doc_id, entry["filename"], file_path, entry["size"], job.job_id)
+            logger.info(f"Resumed interrupted ingest of {entry['filename']} ({name})")
         except Exception as e:
-            logger.error(f"Error loading default document: {e}")
+            logger.warning(f"Could not resume ingest of {entry['filename']} ({name}): {e!r}")
+            document_catalog.finished(name, doc_id, "failed", "Interrupted by a server restart")
+
+async def staged_startup():
+    """
+    Bring the chatbot up in the background: the embeddings model loads while the
+    saved index is mapped, then the index is attached and a warm-up query runs.
+    Progress is reported by /readyz.
+    """
+    if not await initialize_chatbot():
+        logger.error("Failed to initialize chatbot. Some endpoints may not work.")
+        readiness.abort("chatbot initialization failed")
+        return
+
+    readiness.loading("index")
+    embeddings_loaded, loaded_index = await asyncio.gather(load_embeddings(), read_corpus_index())
+    if not embeddings_loaded:
+        readiness.failed("index", "embeddings model unavailable")
+        readiness.abort("embeddings model unavailable")
+        return
+
+    try:
+        if await load_default_document(loaded_index):
+            readiness.ready("index")
+        else:
+            readiness.skipped("index", "no saved vectorstore or default document")
+        await asyncio.to_thread(restore_catalog)
+    except Exception as e:
+        readiness.failed("index", e)
+        logger.error(f"Error loading default document: {e}")
+
+    readiness.loading("warmup")
+    try:
+        await asyncio.to_thread(chatbot_instance.warm_up)
+        readiness.ready("warmup")
+        logger.info("Startup complete")
+    except Exception as e:
+        readiness.failed("warmup", e)
+        logger.error(f"Warm-up failed: {e}")
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize chatbot on startup"""
-    success = await initialize_chatbot()
-    if success:
-        await load_default_document()
-    else:
-        logger.error("Failed to initialize chatbot. Some endpoints may not work.")
+    """Start loading the chatbot without blocking the server from accepting connections"""
+    global startup_task, loop_monitor_task, index_watch_task
+    startup_task = asyncio.create_task(staged_startup())
+    loop_monitor_task = asyncio.create_task(monitor_event_loop())
+    index_watch_task = asyncio.create_task(watch_index_versions())
+
+async def monitor_event_loop():
+    """Measure how late the event loop runs a timer (blocking work on the loop shows up here)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + EVENT_LOOP_PROBE_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_PROBE_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - scheduled))
+
+@app.middleware("http")
+async def reject_until_ready(request, call_next):
+    """Fast 503 for work that needs the model and index while startup is still running, or after it failed"""
+    if request.url.path not in STARTUP_EXEMPT_PATHS:
+        if readiness.aborted:
+            # Retrying will not help: no Retry-After
+            return JSONResponse(
+                status_code=503,
+                content={"detail": f"Server failed to start: {readiness.aborted}", "components": readiness.snapshot()}
+            )
+        if readiness.is_starting:
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "Server is starting up. Please retry shortly.", "components": readiness.snapshot()},
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+    return await call_next(request)
+
+@app.middleware("http")
+async def instrument_requests(request, call_next):
+    """Request counters and latency by route, plus the optional Server-Timing breakdown"""
+    timings = start_request_timings()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        # Label by route template (not raw path) to keep the number of series bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=str(status))
+        HTTP_SECONDS.observe(elapsed, method=request.method, route=route)
+    
+    if TIMING_HEADERS or request.headers.get("x-request-timing") == "1":
+        response.headers["Server-Timing"] = server_timing_header(timings, total=elapsed)
+    return response
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop worker pools"""
+    chat_executor.shutdown()
+    batch_executor.shutdown()
+    search_executor.shutdown()
+    parity_executor.shutdown()
+    ingest_jobs.shutdown()
+    chat_sessions.close()
+    document_catalog.close()
+    for task in (loop_monitor_task, index_watch_task):
+        if task:
+            task.cancel()
+    if chatbot_instance:
+        chatbot_instance.close()
 
 @app.get("/")
 async def root():
@@ -121,8 +586,13 @@ async def root():
         "status": "active",
         "endpoints": {
             "chat": "/chat/send",
+            "search": "/search",
+            "chat_stream": "/chat/stream",
             "upload": "/documents/upload",
-            "health": "/health"
+            "collections": "/collections",
+            "health": "/health",
+            "livez": "/livez",
+            "readyz": "/readyz"
         }
     }
 
@@ -130,14 +600,12 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     document_loaded = False
-    vectorstore_exists = False
+    vectorstore_exists = bool(index_versions.current())
     qa_chain_ready = False
     
     if chatbot_instance:
         document_loaded = chatbot_instance.vectorstore is not None
         qa_chain_ready = chatbot_instance.qa_chain is not None
-        vectorstore_path = DEFAULT_PDF_PATH.replace('.pdf', '_hf_vectorstore')
-        vectorstore_exists = os.path.exists(vectorstore_path)
     
     return {
         "status": "healthy" if chatbot_instance and qa_chain_ready else "unhealthy",
@@ -146,22 +614,215 @@ async def health_check():
         "document_loaded": document_loaded,
         "qa_chain_ready": qa_chain_ready,
         "vectorstore_exists": vectorstore_exists,
+        "index_version": default_collection.served_version if default_collection else None,
+        "published_index_version": index_versions.current(),
         "default_pdf_path": DEFAULT_PDF_PATH,
-        "default_pdf_exists": os.path.exists(DEFAULT_PDF_PATH)
+        "default_pdf_exists": os.path.exists(DEFAULT_PDF_PATH),
+        "ready": readiness.is_ready,
+        "components": readiness.snapshot(),
+        "executors": [chat_executor.stats(), batch_executor.stats(), search_executor.stats(), parity_executor.stats(), ingest_jobs.stats()]
+    }
+
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and serving HTTP"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat(), "components": readiness.snapshot()}
+
+@app.get("/readyz")
+async def readiness_check():
+    """Readiness probe: 200 once the model, index and warm-up are done, 503 until then or if startup failed"""
+    ready = readiness.is_ready
+    starting = readiness.is_starting
+    status = "ready" if ready else "starting" if starting else "failed"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": status, "components": readiness.snapshot()},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)} if starting else {}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, request and pipeline counters, pool gauges"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def _pool_gauges(field):
+    pools = (chat_executor, batch_executor, search_executor, parity_executor, ingest_jobs)
+    return lambda: {(stats["name"],): stats[field] for stats in (pool.stats() for pool in pools)}
+
+REGISTRY.gauge_callback("rag_pool_queued", "Requests waiting for a worker", ["pool"], _pool_gauges("queued"))
+REGISTRY.gauge_callback("rag_pool_in_flight", "Requests running on a worker", ["pool"], _pool_gauges("in_flight"))
+REGISTRY.gauge_callback("rag_pool_rejected", "Requests rejected with 503 since start", ["pool"], _pool_gauges("rejected"))
+REGISTRY.gauge_callback(
+    "rag_index_vectors", "Vectors in the search index", [],
+    lambda: {(): chatbot_instance.index_info()["vectors"]} if chatbot_instance else {}
+)
+REGISTRY.gauge_callback(
+    "rag_semantic_cache_entries", "Answers held by the semantic cache", [],
+    lambda: {(): chatbot_instance.semantic_cache.stats().get("entries")} if chatbot_instance else {}
+)
+REGISTRY.gauge_callback(
+    "rag_sessions_cached", "Chat sessions held in memory", [],
+    lambda: {(): chat_sessions.stats()["cached_sessions"]}
+)
+
+REGISTRY.gauge_callback(
+    "rag_collections_loaded", "Named collections held in memory", [],
+    lambda: {(): len(collections.loaded())} if collections else {}
+)
+REGISTRY.gauge_callback(
+    "rag_collections_loaded_bytes", "Estimated memory of the named collections held in memory", [],
+    lambda: {(): sum(collection.chatbot.memory_bytes() for collection in collections.loaded())} if collections else {}
+)
+
+@app.get("/collections")
+async def list_collections():
+    """Named collections on disk, the ones loaded in this process, and LRU counters"""
+    if not collections:
+        raise HTTPException(
+            status_code=503, 
+            detail="Chatbot not initialized. Please try again later."
+        )
+    
+    stats = await asyncio.to_thread(collections.stats)
+    return {
+        "default": default_collection.stats(),
+        "collections": collections.names(),
+        **stats
+    }
+
+@app.get("/executor/stats")
+async def executor_stats():
+    """Queue-depth and in-flight gauges for the worker pools"""
+    return {
+        "chat": chat_executor.stats(),
+        "batch": batch_executor.stats(),
+        "search": search_executor.stats(),
+        "parity": parity_executor.stats(),
+        "ingest": ingest_jobs.stats(),
+        "coalescing": chat_flights.stats()
+    }
+
+async def append_chat_message(chat_id: str, text: str, sender: str) -> Dict[str, Any]:
+    """Append a message to a chat session, creating the session if needed (a cache miss reads SQLite, so off the event loop)"""
+    return await asyncio.to_thread(chat_sessions.append, chat_id, text, sender)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Semantic cache and embedding store hit/miss counters"""
+    if not chatbot_instance:
+        raise HTTPException(
+            status_code=503, 
+            detail="Chatbot not initialized. Please try again later."
+        )
+    
+    embeddings = chatbot_instance.embeddings
+    return {
+        "semantic_cache": chatbot_instance.semantic_cache.stats(),
+        "embedding_store": embeddings.stats() if hasattr(embeddings, "stats") else None
+    }
+
+@app.get("/context/stats")
+async def context_stats():
+    """Prompt tokens sent to the LLM vs. retrieved, after context packing"""
+    if not chatbot_instance:
+        raise HTTPException(
+            status_code=503, 
+            detail="Chatbot not initialized. Please try again later."
+        )
+    
+    return chatbot_instance.context_packer.stats()
+
+@app.get("/index/info")
+async def index_info(collection: Optional[str] = None):
+    """Current vector index type, size and search settings (of the default or a named collection)"""
+    target = await resolve_collection(collection)
+    return target.chatbot.index_info()
+
+@app.get("/index/report")
+async def index_report(k: int = 10, queries: int = 200, collection: Optional[str] = None):
+    """Recall@k, latency and bytes per vector of flat / IVF / HNSW settings and compressed modes on the current vectors"""
+    target = await resolve_collection(collection)
+    report = await run_in_executor(chat_executor, target.chatbot.index_report, k, queries)
+    return {
+        "index": target.chatbot.index_info(),
+        "report": report
+    }
+
+@app.get("/embeddings/parity")
+async def embeddings_parity(samples: int = 64):
+    """Cosine drift and throughput of the active embedding backend against the fp32 model"""
+    if not chatbot_instance:
+        raise HTTPException(
+            status_code=503, 
+            detail="Chatbot not initialized. Please try again later."
+        )
+    
+    return await run_in_executor(parity_executor, chatbot_instance.embedding_parity, samples)
+
+@app.get("/search")
+async def search(
+    q: str,
+    k: int = 5,
+    doc_id: Optional[List[str]] = Query(default=None),
+    source: Optional[List[str]] = Query(default=None),
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None,
+    collection: Optional[str] = None
+):
+    """
+    Top-k chunks for a query with their scores and full text, without an LLM
+    call. doc_id and source (file name; both repeatable) and the inclusive page
+    range (pages count from 1) restrict the search before it runs.
+    """
+    target = await resolve_collection(collection)
+    
+    if not q.strip():
+        raise HTTPException(
+            status_code=400, 
+            detail="Query cannot be empty"
+        )
+    if not 1 <= k <= SEARCH_MAX_K:
+        raise HTTPException(
+            status_code=400,
+            detail=f"k must be between 1 and {SEARCH_MAX_K}"
+        )
+    
+    start = time.perf_counter()
+    filters = ChunkFilter(doc_ids=doc_id, sources=source, page_from=page_from, page_to=page_to)
+    hits = await run_in_executor(search_executor, target.chatbot.retrieve, q, k=k, filters=filters, with_scores=True)
+    
+    results = []
+    for doc, score in hits:
+        page = doc.metadata.get("page")
+        results.append({
+            "chunk_id": doc.id,
+            "doc_id": doc.metadata.get("doc_id"),
+            "source": os.path.basename(doc.metadata.get("source", "")),
+            "page": page + 1 if page is not None else None,
+            "page_label": doc.metadata.get("page_label"),
+            "score": score,
+            "content": doc.page_content,
+            "metadata": doc.metadata
+        })
+    
+    return {
+        "query": q,
+        "k": k,
+        "collection": target.name,
+        "retrieval": "hybrid" if target.chatbot.hybrid_retrieval else "vector",
+        "results": results,
+        "took_ms": round((time.perf_counter() - start) * 1000, 2)
     }
 
 @app.post("/chat/send")
 async def send_message(
     message: str = Form(...),
-    chat_id: str = Form(default="1")
+    chat_id: str = Form(default="1"),
+    collection: Optional[str] = Form(default=None)
 ):
-    """Send a message to the chatbot and get response"""
+    """Send a message to the chatbot and get response (from the default or a named collection)"""
     try:
-        if not chatbot_instance:
-            raise HTTPException(
-                status_code=503, 
-                detail="Chatbot not initialized. Please try again later."
-            )
+        target = await resolve_collection(collection)
         
         if not message or not message.strip():
             raise HTTPException(
@@ -171,49 +832,30 @@ async def send_message(
         
         logger.info(f"Processing message for chat_id: {chat_id}")
         
-        # Initialize chat session if doesn't exist
-        if chat_id not in chat_sessions:
-            chat_sessions[chat_id] = {
-                "chat_id": chat_id,
-                "messages": [],
-                "created_at": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat()
-            }
-        
         # Add user message to session
-        user_message = {
-            "id": str(uuid.uuid4()),
-            "text": message,
-            "sender": "user",
-            "timestamp": datetime.now().isoformat()
-        }
-        chat_sessions[chat_id]["messages"].append(user_message)
+        await append_chat_message(chat_id, message, "user")
         
         # Get response from chatbot
         try:
-            bot_response = chatbot_instance.chat(message)
+            bot_response = await answer_once(target, "chat", message)
             
             if not bot_response:
                 bot_response = "I apologize, but I couldn't generate a response. Please try again."
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error getting chatbot response: {e}")
             bot_response = "I'm experiencing some technical difficulties. Please try again later."
         
         # Add bot response to session
-        bot_message = {
-            "id": str(uuid.uuid4()),
-            "text": bot_response,
-            "sender": "bot",
-            "timestamp": datetime.now().isoformat()
-        }
-        chat_sessions[chat_id]["messages"].append(bot_message)
-        chat_sessions[chat_id]["last_updated"] = datetime.now().isoformat()
+        await append_chat_message(chat_id, bot_response, "bot")
         
         response_data = {
             "response": bot_response,
             "message": bot_response,  # Alternative field name for compatibility
             "chat_id": chat_id,
+            "collection": target.name,
             "timestamp": datetime.now().isoformat(),
             "status": "success"
         }
@@ -229,15 +871,12 @@ async def send_message(
 @app.post("/chat/send_with_sources")
 async def send_message_with_sources(
     message: str = Form(...),
-    chat_id: str = Form(default="1")
+    chat_id: str = Form(default="1"),
+    collection: Optional[str] = Form(default=None)
 ):
     """Send a message and get response with source information"""
     try:
-        if not chatbot_instance:
-            raise HTTPException(
-                status_code=503, 
-                detail="Chatbot not initialized. Please try again later."
-            )
+        target = await resolve_collection(collection)
         
         if not message or not message.strip():
             raise HTTPException(
@@ -249,7 +888,9 @@ async def send_message_with_sources(
         
         # Get response with sources
         try:
-            bot_response, sources = chatbot_instance.chat_with_sources(message)
+            bot_response, sources = await answer_once(target, "chat_with_sources", message)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error getting chatbot response with sources: {e}")
             bot_response = "I'm experiencing some technical difficulties. Please try again later."
@@ -258,6 +899,7 @@ async def send_message_with_sources(
         response_data = {
             "response": bot_response,
             "chat_id": chat_id,
+            "collection": target.name,
             "timestamp": datetime.now().isoformat(),
             "status": "success",
             "sources": sources
@@ -271,64 +913,282 @@ async def send_message_with_sources(
         logger.error(f"Unexpected error in send_message_with_sources: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/documents/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Upload and process a PDF document for RAG"""
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def stream_message(
+    message: str = Form(...),
+    chat_id: str = Form(default="1"),
+    collection: Optional[str] = Form(default=None)
+):
+    """Send a message and stream sources and answer tokens as Server-Sent Events"""
+    target = await resolve_collection(collection)
+    
+    if not message or not message.strip():
+        raise HTTPException(
+            status_code=400, 
+            detail="Message cannot be empty"
+        )
+    
+    logger.info(f"Streaming message for chat_id: {chat_id}")
+    
+    # Take a worker slot before the response starts so saturation is still a plain 503
     try:
-        if not chatbot_instance:
-            raise HTTPException(
-                status_code=503, 
-                detail="Chatbot not initialized. Please try again later."
-            )
+        await chat_executor.acquire()
+    except ExecutorSaturated as e:
+        logger.warning(f"Rejecting request: {e.reason}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    try:
+        await append_chat_message(chat_id, message, "user")
+    except BaseException:
+        chat_executor.release()
+        raise
+    
+    async def event_stream():
+        events = target.chatbot.stream_chat(message)
+        bot_response = None
+        try:
+            while True:
+                # Each step of the generator (retrieval, next LLM chunk) blocks, so run it on the pool
+                event = await chat_executor.run_sync(next, events, None)
+                if event is None:
+                    break
+                
+                if event["type"] in ("done", "error"):
+                    bot_response = event["answer"]
+                
+                yield format_sse(event["type"], {**event, "chat_id": chat_id})
+        except Exception as e:
+            logger.error(f"Error streaming chatbot response: {e}")
+            bot_response = "I'm experiencing some technical difficulties. Please try again later."
+            yield format_sse("error", {"type": "error", "answer": bot_response, "chat_id": chat_id})
+        finally:
+            chat_executor.release()
+            try:
+                events.close()
+            except ValueError:
+                # Generator is still running on a worker (client went away mid-step)
+                pass
+            
+            # Write the assembled answer into the session once the stream ends
+            if bot_response is not None:
+                await append_chat_message(chat_id, bot_response, "bot")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest):
+    """
+    Answer many questions in one request. Results stream back as NDJSON, one
+    line per question as soon as its answer is ready; "index" is the question's
+    position in the request.
+    """
+    target = await resolve_collection(request.collection)
+    
+    questions = [question.strip() for question in request.questions]
+    if not questions or not all(questions):
+        raise HTTPException(
+            status_code=400, 
+            detail="Questions cannot be empty"
+        )
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch"
+        )
+    
+    parallelism = max(1, min(request.parallelism or BATCH_PARALLELISM, BATCH_MAX_PARALLELISM))
+    logger.info(f"Answering batch of {len(questions)} questions (parallelism {parallelism})")
+    
+    # Take a batch slot before the response starts so saturation is still a plain 503
+    try:
+        await batch_executor.acquire()
+    except ExecutorSaturated as e:
+        logger.warning(f"Rejecting batch: {e.reason}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    async def ndjson_stream():
+        results = target.chatbot.chat_many(questions, parallelism=parallelism)
+        try:
+            while True:
+                result = await batch_executor.run_sync(next, results, None)
+                if result is None:
+                    break
+                yield json.dumps(result, default=str) + "\n"
+        except Exception as e:
+            logger.error(f"Error answering batch: {e}")
+            yield json.dumps({"error": "Batch processing failed"}) + "\n"
+        finally:
+            batch_executor.release()
+            try:
+                results.close()
+            except ValueError:
+                # Generator is still running on a worker (client went away mid-step)
+                pass
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+def ingest_document(collection: Collection, file_path: str, doc_id: str, job: IngestJob) -> bool:
+    """
+    Add a document to the collection's latest index and publish it as a new
+    version (runs as an ingest job). Parsing and embedding run before the
+    writer lock is taken, so jobs only wait for each other to index and
+    publish. Its status and the seconds spent in each stage are recorded in
+    the document catalog.
+    """
+    document_catalog.started(collection.name, doc_id, os.path.basename(file_path), file_path, job.job_id)
+    timings = {}
+    stage = ["parsing", time.perf_counter()]
+    
+    def enter(name):
+        now = time.perf_counter()
+        timings[stage[0]] = round(timings.get(stage[0], 0.0) + now - stage[1], 3)
+        stage[:] = [name, now]
+    
+    def progress(name, percent):
+        if name != stage[0]:
+            enter(name)
+        job.update(name, percent)
+    
+    chatbot = collection.chatbot
+    try:
+        prepared = chatbot.prepare_document(file_path, doc_id=doc_id, progress=progress)
+        if prepared is None:
+            raise RuntimeError("No text could be extracted from the document")
         
-        # Check file type
+        progress("lock_wait", 90)
+        with collection.versions.writer():
+            enter("index_sync")
+            collection.sync()
+            progress("indexing", 90)
+            added = chatbot.add_documents([prepared])
+            if added:
+                enter("publishing")
+                collection.publish()
+        info = chatbot.documents.get(doc_id) if added else None
+        enter("done")
+    except Exception as e:
+        enter("done")
+        document_catalog.finished(collection.name, doc_id, "failed", str(e), timings)
+        # Clean up file if processing failed
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    
+    if info is None:
+        # The file's content is already indexed under another ID
+        document_catalog.finished(collection.name, doc_id, "duplicate", "Identical content is already indexed", timings)
+    else:
+        document_catalog.indexed(
+            collection.name, info, chatbot.embedding_model,
+            collection.versions.root, collection.served_version, timings
+        )
+    return True
+
+def remove_document(collection: Collection, doc_id: str) -> bool:
+    """Remove a document from the collection's latest index and publish it as a new version (runs on the ingest pool)"""
+    with collection.versions.writer():
+        collection.sync()
+        removed = collection.chatbot.delete_document(doc_id)
+        if removed:
+            collection.publish()
+            document_catalog.remove(collection.name, doc_id)
+    return removed
+
+def upload_directory(name: str) -> str:
+    """Where uploaded PDFs of a collection are kept"""
+    if name == DEFAULT_COLLECTION:
+        return UPLOAD_DIRECTORY
+    return os.path.join(UPLOAD_DIRECTORY, name)
+
+def upload_collection(name: str) -> Collection:
+    """The collection an accepted upload goes into, created if new"""
+    if name == DEFAULT_COLLECTION:
+        return default_collection
+    return collections.get(name, create=True)
+
+@app.post("/documents/upload")
+async def upload_document(
+    file: UploadFile = File(...),
+    collection: Optional[str] = Form(default=None)
+):
+    """Upload and process a PDF document for RAG (into the default or a named collection, created if new)"""
+    try:
+        # Check the request first: a new collection is only created once the upload is accepted
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(
                 status_code=400, 
                 detail="Only PDF files are supported"
             )
+        name = collection_name(collection)
         
-        # Save uploaded file
-        file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
+        # Stream uploaded file to disk in chunks instead of reading it into memory
+        directory = upload_directory(name)
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, file.filename)
+        partial_path = f"{file_path}.part"
         
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        try:
+            with open(partial_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    buffer.write(chunk)
+            os.replace(partial_path, file_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
         
         logger.info(f"File saved: {file_path}")
         
-        # Process document with chatbot
+        # Queue the document for ingestion and return right away
+        doc_id = document_id(file.filename)
+        size = os.path.getsize(file_path)
         try:
-            vectorstore_path = os.path.join(VECTORSTORE_DIRECTORY, f"{Path(file.filename).stem}_vectorstore")
-            
-            # Load document
-            success = chatbot_instance.load_document(file_path)
-            
-            if success:
-                # Save vectorstore
-                chatbot_instance.save_vectorstore(vectorstore_path)
-                
-                return JSONResponse(content={
-                    "message": "Document uploaded and processed successfully",
-                    "filename": file.filename,
-                    "status": "success",
-                    "vectorstore_path": vectorstore_path
-                })
-            else:
-                raise HTTPException(
-                    status_code=500, 
-                    detail="Failed to process the uploaded document"
-                )
-                
-        except Exception as e:
-            logger.error(f"Error processing document: {e}")
-            # Clean up file if processing failed
+            job = ingest_jobs.submit(
+                lambda job: ingest_document(upload_collection(name), file_path, doc_id, job),
+                file.filename,
+                doc_id,
+                collection=name
+            )
+        except ExecutorSaturated as e:
             if os.path.exists(file_path):
                 os.remove(file_path)
+            logger.warning(f"Rejecting upload: {e.reason}")
             raise HTTPException(
-                status_code=500, 
-                detail=f"Error processing document: {str(e)}"
+                status_code=503,
+                detail="Too many documents are being processed. Please retry shortly.",
+                headers={"Retry-After": str(e.retry_after)}
             )
+        # Accepted: create a new collection now, so it is listed while the job waits
+        await asyncio.to_thread(upload_collection, name)
+        await asyncio.to_thread(document_catalog.queued, name, doc_id, file.filename, file_path, size, job.job_id)
+        
+        return JSONResponse(status_code=202, content={
+            "message": "Document uploaded and queued for processing",
+            "filename": file.filename,
+            "doc_id": doc_id,
+            "collection": name,
+            "job_id": job.job_id,
+            "status": "queued",
+            "status_url": f"/documents/jobs/{job.job_id}"
+        })
             
     except HTTPException:
         raise
@@ -336,69 +1196,139 @@ async def upload_document(file: UploadFile = File(...)):
         logger.error(f"Unexpected error in upload_document: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.get("/chat/sessions")
-async def get_chat_sessions():
-    """Get all chat sessions"""
+@app.get("/documents/jobs")
+async def list_ingest_jobs():
+    """List recent ingestion jobs, newest first"""
+    jobs = ingest_jobs.list()
     return {
-        "sessions": list(chat_sessions.values()),
-        "total_sessions": len(chat_sessions)
+        "jobs": jobs,
+        "total_jobs": len(jobs)
     }
 
+@app.get("/documents/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """Get the stage, progress and errors of an ingestion job"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    
+    return job.to_dict()
+
+@app.get("/chat/sessions")
+async def get_chat_sessions(limit: int = 50, offset: int = 0):
+    """List chat sessions (most recently updated first), without their messages"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return await asyncio.to_thread(chat_sessions.list_sessions, limit, max(0, offset))
+
 @app.get("/chat/sessions/{chat_id}")
-async def get_chat_session(chat_id: str):
-    """Get a specific chat session"""
-    if chat_id not in chat_sessions:
+async def get_chat_session(chat_id: str, limit: int = 50):
+    """Get a specific chat session with its latest messages"""
+    session = await asyncio.to_thread(chat_sessions.get_session, chat_id, max(1, min(limit, MAX_PAGE_SIZE)))
+    if session is None:
         raise HTTPException(status_code=404, detail="Chat session not found")
     
-    return chat_sessions[chat_id]
+    return session
+
+@app.get("/chat/sessions/{chat_id}/messages")
+async def get_chat_messages(chat_id: str, limit: int = 50, before: Optional[int] = None):
+    """
+    Page through a session's messages, oldest first within a page. Pass the
+    returned next_before as before to get the page preceding it.
+    """
+    session = await asyncio.to_thread(
+        chat_sessions.get_session, chat_id, max(1, min(limit, MAX_PAGE_SIZE)), before
+    )
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    
+    return {"chat_id": chat_id, "messages": session["messages"], "next_before": session["next_before"]}
 
 @app.delete("/chat/sessions/{chat_id}")
 async def delete_chat_session(chat_id: str):
     """Delete a chat session"""
-    if chat_id not in chat_sessions:
+    if not await asyncio.to_thread(chat_sessions.delete, chat_id):
         raise HTTPException(status_code=404, detail="Chat session not found")
     
-    del chat_sessions[chat_id]
     return {"message": f"Chat session {chat_id} deleted successfully"}
 
 @app.post("/chat/sessions/{chat_id}/clear")
 async def clear_chat_session(chat_id: str):
     """Clear messages in a chat session but keep the session"""
-    if chat_id not in chat_sessions:
+    if not await asyncio.to_thread(chat_sessions.clear, chat_id):
         raise HTTPException(status_code=404, detail="Chat session not found")
     
-    chat_sessions[chat_id]["messages"] = []
-    chat_sessions[chat_id]["last_updated"] = datetime.now().isoformat()
-    
     return {"message": f"Chat session {chat_id} cleared successfully"}
 
 @app.get("/documents/list")
-async def list_documents():
-    """List all uploaded documents"""
+async def list_documents(
+    collection: Optional[str] = None,
+    limit: int = 50,
+    after: Optional[str] = None,
+    status: Optional[str] = None,
+    name: Optional[str] = None
+):
+    """
+    List the documents of the default or a named collection from the catalog,
+    ordered by file name, a page at a time (pass next_after as after). status
+    filters on the ingest status and name on a file name prefix.
+    """
+    name_of_collection = catalog_collection(collection)
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(STATUSES)}")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
     try:
-        documents = []
-        
-        # List uploaded files
-        if os.path.exists(UPLOAD_DIRECTORY):
-            for filename in os.listdir(UPLOAD_DIRECTORY):
-                file_path = os.path.join(UPLOAD_DIRECTORY, filename)
-                if os.path.isfile(file_path) and filename.lower().endswith('.pdf'):
-                    stat = os.stat(file_path)
-                    documents.append({
-                        "filename": filename,
-                        "size": stat.st_size,
-                        "uploaded_at": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                        "vectorstore_exists": os.path.exists(os.path.join(VECTORSTORE_DIRECTORY, f"{Path(filename).stem}_vectorstore"))
-                    })
-        
-        return {
-            "documents": documents,
-            "total_documents": len(documents)
-        }
-        
+        page = await asyncio.to_thread(document_catalog.list, name_of_collection, limit, after, status, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving document list")
+    return {"collection": name_of_collection, "limit": limit, **page}
+
+def catalog_collection(name: Optional[str]) -> str:
+    """Name of the default or an existing named collection, without loading it; 400/404 otherwise"""
+    if not name or name == DEFAULT_COLLECTION:
+        return DEFAULT_COLLECTION
+    if not valid_collection_name(name):
+        raise HTTPException(
+            status_code=400,
+            detail="Collection names are 1-64 letters, digits, '-' or '_'"
+        )
+    if not collections or not collections.exists(name):
+        raise HTTPException(status_code=404, detail=f"Collection {name} not found")
+    return name
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: str, collection: Optional[str] = None):
+    """Remove a document from the index (of the default or a named collection) without re-embedding the others"""
+    target = await resolve_collection(collection)
+    
+    info = target.chatbot.documents.get(doc_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    entry = await asyncio.to_thread(document_catalog.get, target.name, doc_id)
+    # Deletes wait for the same writer lock as uploads, so they queue with them rather than hold a chat worker
+    try:
+        removed = await asyncio.wrap_future(ingest_jobs.run(remove_document, target, doc_id))
+    except ExecutorSaturated as e:
+        logger.warning(f"Rejecting delete: {e.reason}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if not removed:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    # Remove the uploaded copy, but never a file indexed from elsewhere (e.g. by bulk_index.py)
+    file_path = (entry or {}).get("source") or os.path.join(upload_directory(target.name), info["filename"])
+    in_uploads = os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(upload_directory(target.name))
+    if in_uploads and os.path.exists(file_path):
+        os.remove(file_path)
+    
+    return {"message": f"Document {doc_id} deleted successfully", "doc_id": doc_id}
 
 # Error handlers
 @app.exception_handler(404)
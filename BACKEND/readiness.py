@@ -0,0 +1,67 @@
+import threading
+import time
+from datetime import datetime
+
+
+class Readiness:
+    """
+    Tracks the startup state of each component (pending, loading, ready,
+    skipped or failed) so liveness and readiness can be reported separately.
+
+    If startup stops early, abort marks the components it never reached as
+    failed, so the server is no longer reported as starting.
+    """
+
+    def __init__(self, components):
+        self._lock = threading.Lock()
+        self._components = {
+            name: {"state": "pending", "error": None, "started_at": None, "seconds": None}
+            for name in components
+        }
+        self._started = {}
+        self.aborted = None  # why startup stopped early, if it did
+
+    def loading(self, name):
+        with self._lock:
+            self._started[name] = time.perf_counter()
+            self._components[name].update(state="loading", started_at=datetime.now().isoformat())
+
+    def ready(self, name):
+        self._finish(name, "ready")
+
+    def skipped(self, name, reason=None):
+        self._finish(name, "skipped", reason)
+
+    def failed(self, name, error):
+        self._finish(name, "failed", str(error))
+
+    def abort(self, reason):
+        """Startup stopped: fail every component not finished yet"""
+        with self._lock:
+            self.aborted = str(reason)
+            for component in self._components.values():
+                if component["state"] in ("pending", "loading"):
+                    component.update(state="failed", error=f"Not started: {reason}")
+
+    @property
+    def is_ready(self):
+        with self._lock:
+            return all(component["state"] in ("ready", "skipped") for component in self._components.values())
+
+    @property
+    def is_starting(self):
+        with self._lock:
+            return any(component["state"] in ("pending", "loading") for component in self._components.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(component) for name, component in self._components.items()}
+
+    def _finish(self, name, state, error=None):
+        with self._lock:
+            started = self._started.get(name)
+            self._components[name].update(
+                state=state,
+                error=error,
+                seconds=round(time.perf_counter() - started, 3) if started else None
+            )
@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by query embedding.
+
+    Past queries are kept in a small inner-product FAISS index over normalized
+    vectors, so a lookup returns the stored answer and sources of the most
+    similar past query when its cosine similarity is at least ``threshold``.
+    Entries are evicted LRU-first when ``max_entries`` or ``max_bytes`` is
+    exceeded, and lazily once older than ``ttl_seconds``.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000,
+                 ttl_seconds: float = 3600, max_bytes: int = 32 * 1024 * 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()  # id -> (answer, sources, created_at, nbytes)
+        self._next_id = 0
+        self._bytes = 0
+
+        # Counters for tuning the threshold
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, query_vector):
+        """Return {"answer", "sources", "similarity"} for a close enough past query, or None"""
+        vector = self._as_matrix(query_vector)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                self.misses += 1
+                return None
+
+            scores, ids = self._index.search(vector, 1)
+            score, entry_id = float(scores[0][0]), int(ids[0][0])
+            entry = self._entries.get(entry_id)
+
+            if entry is not None and time.monotonic() - entry[2] > self.ttl_seconds:
+                self._remove(entry_id)
+                entry = None
+
+            if entry is None or score < self.threshold:
+                self.misses += 1
+                return None
+
+            # Mark as recently used
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return {"answer": entry[0], "sources": entry[1], "similarity": score}
+
+    def store(self, query_vector, answer, sources):
+        """Remember the answer and sources for a query"""
+        vector = self._as_matrix(query_vector)
+        nbytes = vector.nbytes + len(answer.encode("utf-8")) + len(json.dumps(sources, default=str))
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (answer, sources, time.monotonic(), nbytes)
+            self._bytes += nbytes
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (called whenever the underlying vectorstore changes)"""
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+            self._index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+    @staticmethod
+    def _as_matrix(query_vector):
+        vector = np.array([query_vector], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
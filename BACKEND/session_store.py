@@ -0,0 +1,368 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+SENDERS = {"user": "u", "bot": "b"}
+_SENDER_NAMES = {code: name for name, code in SENDERS.items()}
+
+# Sessions looked up per query when a batch is written
+_QUERY_BATCH = 500
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+class _Session:
+    """In-memory view of a session: counters plus its most recent messages"""
+
+    __slots__ = ("chat_id", "created_at", "last_updated", "message_count", "recent", "touched")
+
+    def __init__(self, chat_id, created_at, last_updated, message_count, recent, max_recent):
+        self.chat_id = chat_id
+        self.created_at = created_at
+        self.last_updated = last_updated
+        self.message_count = message_count
+        self.recent = deque(recent, maxlen=max_recent)  # (seq, sender code, timestamp, text)
+        self.touched = time.monotonic()
+
+    def summary(self):
+        return {
+            "chat_id": self.chat_id,
+            "created_at": _isoformat(self.created_at),
+            "last_updated": _isoformat(self.last_updated),
+            "message_count": self.message_count,
+        }
+
+
+def _message(row):
+    seq, sender, timestamp, text = row
+    return {"id": seq, "text": text, "sender": _SENDER_NAMES.get(sender, sender), "timestamp": _isoformat(timestamp)}
+
+
+class SessionStore:
+    """
+    Chat sessions persisted in SQLite with a bounded in-memory tier.
+
+    Recently used sessions (at most ``max_sessions``, each idle for less than
+    ``ttl_seconds``) are kept in memory with their last ``cached_messages``
+    messages, so memory stays flat however many sessions exist. New messages
+    are buffered and written to SQLite in batches by a background thread every
+    ``flush_interval`` seconds (or sooner once ``max_pending`` accumulate).
+
+    Several processes (server workers) can share one file: message numbers are
+    allocated from the stored count in the transaction that writes them, and
+    reads check the cached session against SQLite, so a session is consistent
+    across workers once their buffered messages are written.
+    """
+
+    def __init__(self, path, max_sessions: int = 1000, ttl_seconds: float = 3600,
+                 cached_messages: int = 50, flush_interval: float = 1.0, max_pending: int = 1000):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.cached_messages = cached_messages
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._sessions = OrderedDict()  # chat_id -> _Session, least recently used first
+        # Numbers of unwritten messages are provisional: the flush numbers them after the stored ones
+        self._pending_messages = []  # (chat_id, seq, sender, timestamp, text)
+        self._pending_sessions = {}  # chat_id -> (created_at, last_updated)
+        self._flush_lock = threading.Lock()
+        self._flushing = ([], {})  # batch being written (still visible to readers until committed)
+        self._flushed = False  # the batch in _flushing is committed (set and read under the db lock)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "chat_id TEXT PRIMARY KEY, created_at REAL NOT NULL, last_updated REAL NOT NULL, "
+            "message_count INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_by_update ON sessions (last_updated)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "chat_id TEXT NOT NULL, seq INTEGER NOT NULL, sender TEXT NOT NULL, timestamp REAL NOT NULL, "
+            "text TEXT NOT NULL, PRIMARY KEY (chat_id, seq)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+        self.flushes = 0
+        self.evictions = 0
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    def append(self, chat_id, text, sender):
+        """Add a message (creating the session if needed) and return it"""
+        now = time.time()
+        with self._lock:
+            session = self._get(chat_id)
+            if session is None:
+                session = self._cache(_Session(chat_id, now, now, 0, (), self.cached_messages))
+
+            row = (session.message_count, SENDERS.get(sender, sender), now, text)
+            session.recent.append(row)
+            session.message_count += 1
+            session.last_updated = now
+
+            self._pending_messages.append((chat_id, *row))
+            self._pending_sessions[chat_id] = (session.created_at, now)
+            if len(self._pending_messages) >= self.max_pending:
+                self._wake.set()
+        return _message(row)
+
+    def get_session(self, chat_id, limit=50, before=None):
+        """Session summary with a page of messages (see get_messages), or None"""
+        with self._lock:
+            session = self._get(chat_id, fresh=True)
+            if session is None:
+                return None
+            summary = session.summary()
+        return {**summary, **self.get_messages(chat_id, limit=limit, before=before)}
+
+    def get_messages(self, chat_id, limit=50, before=None):
+        """
+        Up to limit messages with id < before (default: the latest ones), oldest
+        first, and the "before" value for the previous page (None at the start).
+        """
+        with self._lock:
+            session = self._get(chat_id, fresh=True)
+            if session is None:
+                return {"messages": [], "next_before": None}
+            end = session.message_count if before is None else min(before, session.message_count)
+            start = max(0, end - limit)
+            cached_from = session.recent[0][0] if session.recent else session.message_count
+            if start >= cached_from:
+                rows = [row for row in session.recent if start <= row[0] < end]
+
+        if start < cached_from:
+            self.flush()
+            with self._db_lock:
+                rows = self._conn.execute(
+                    "SELECT seq, sender, timestamp, text FROM messages WHERE chat_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                    (chat_id, start, end)
+                ).fetchall()
+        return {"messages": [_message(row) for row in rows], "next_before": start if start > 0 else None}
+
+    def list_sessions(self, limit=50, offset=0):
+        """Session summaries (no messages), most recently updated first"""
+        self.flush()
+        with self._db_lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT chat_id, created_at, last_updated, message_count FROM sessions "
+                "ORDER BY last_updated DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        sessions = [
+            {
+                "chat_id": chat_id,
+                "created_at": _isoformat(created_at),
+                "last_updated": _isoformat(last_updated),
+                "message_count": message_count,
+            }
+            for chat_id, created_at, last_updated, message_count in rows
+        ]
+        return {"sessions": sessions, "total_sessions": total, "limit": limit, "offset": offset}
+
+    def delete(self, chat_id):
+        """Delete a session and its messages; returns False if it does not exist"""
+        with self._flush_lock:
+            self._write_pending()
+            with self._lock:
+                self._drop_pending(chat_id)
+                cached = self._sessions.pop(chat_id, None)
+                with self._db_lock:
+                    deleted = self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,)).rowcount
+                    self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                    self._conn.commit()
+        return deleted > 0 or cached is not None
+
+    def clear(self, chat_id):
+        """Delete a session's messages but keep the session; returns False if it does not exist"""
+        with self._flush_lock:
+            self._write_pending()
+            with self._lock:
+                session = self._get(chat_id)
+                if session is None:
+                    return False
+                self._drop_pending(chat_id)
+                session.recent.clear()
+                session.message_count = 0
+                session.last_updated = time.time()
+                with self._db_lock:
+                    self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                    self._conn.execute(
+                        "INSERT INTO sessions (chat_id, created_at, last_updated, message_count) VALUES (?, ?, ?, 0) "
+                        "ON CONFLICT (chat_id) DO UPDATE SET last_updated = excluded.last_updated, message_count = 0",
+                        (chat_id, session.created_at, session.last_updated)
+                    )
+                    self._conn.commit()
+        return True
+
+    def flush(self):
+        """Write buffered messages to SQLite"""
+        with self._flush_lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Write the buffered batch (caller holds the flush lock)"""
+        with self._lock:
+            messages, self._pending_messages = self._pending_messages, []
+            sessions, self._pending_sessions = self._pending_sessions, {}
+            self._flushing = (messages, sessions)
+        if not messages and not sessions:
+            return
+
+        by_chat = {}
+        for message in messages:
+            by_chat.setdefault(message[0], []).append(message)
+
+        renumbered = []
+        try:
+            with self._db_lock:
+                # Number the messages after the stored count in the same write transaction, so
+                # processes sharing the file never hand out one number twice
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    chat_ids = list(sessions)
+                    stored = {}
+                    for start in range(0, len(chat_ids), _QUERY_BATCH):
+                        batch = chat_ids[start:start + _QUERY_BATCH]
+                        stored.update(self._conn.execute(
+                            f"SELECT chat_id, message_count FROM sessions WHERE chat_id IN ({','.join('?' * len(batch))})", batch
+                        ))
+
+                    rows, session_rows = [], []
+                    for chat_id, (created_at, last_updated) in sessions.items():
+                        first = stored.get(chat_id, 0)
+                        chat_messages = by_chat.get(chat_id, [])
+                        if chat_messages and chat_messages[0][1] != first:
+                            # Another process wrote to this session since it was cached
+                            renumbered.append(chat_id)
+                        rows.extend((chat_id, first + i, *message[2:]) for i, message in enumerate(chat_messages))
+                        session_rows.append((chat_id, created_at, last_updated, first + len(chat_messages)))
+
+                    self._conn.executemany(
+                        "INSERT INTO sessions (chat_id, created_at, last_updated, message_count) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (chat_id) DO UPDATE SET last_updated = max(last_updated, excluded.last_updated), "
+                        "message_count = excluded.message_count",
+                        session_rows
+                    )
+                    self._conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?)", rows)
+                    self._conn.commit()
+                except BaseException:
+                    self._conn.rollback()
+                    raise
+                self._flushed = True
+                self.flushes += 1
+        except Exception:
+            # Keep the batch for the next attempt
+            with self._lock:
+                self._pending_messages = messages + self._pending_messages
+                self._pending_sessions = {**sessions, **self._pending_sessions}
+            raise
+        finally:
+            with self._lock:
+                self._flushing = ([], {})
+                self._flushed = False
+                # Their cached messages carry other numbers than the stored ones: read them again on next use
+                for chat_id in renumbered:
+                    self._sessions.pop(chat_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "pending_messages": len(self._pending_messages),
+                "flushes": self.flushes,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def _get(self, chat_id, fresh=False):
+        """
+        Session from memory, else loaded from SQLite (caller holds the lock).
+        With fresh, a cached session is first checked against SQLite and read
+        again if another process has written to it.
+        """
+        session = self._sessions.get(chat_id)
+        if session is not None:
+            if time.monotonic() - session.touched <= self.ttl_seconds and not (fresh and self._stale(session)):
+                session.touched = time.monotonic()
+                self._sessions.move_to_end(chat_id)
+                return session
+            del self._sessions[chat_id]
+            self.evictions += 1
+
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT created_at, last_updated, message_count FROM sessions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            recent = self._conn.execute(
+                "SELECT seq, sender, timestamp, text FROM messages WHERE chat_id = ? ORDER BY seq DESC LIMIT ?",
+                (chat_id, self.cached_messages)
+            ).fetchall()[::-1]
+            unwritten = self._unwritten(chat_id)
+        pending = self._pending_sessions.get(chat_id) or self._flushing[1].get(chat_id)
+        if row is None and pending is None:
+            return None
+
+        # Messages not yet written follow the stored ones, as the flush will number them
+        created_at, last_updated, stored = row or (*pending, 0)
+        if pending is not None:
+            last_updated = max(last_updated, pending[1])
+        recent += [(stored + i, *message[2:]) for i, message in enumerate(unwritten)]
+        return self._cache(_Session(
+            chat_id, created_at, last_updated, stored + len(unwritten), recent[-self.cached_messages:], self.cached_messages
+        ))
+
+    def _unwritten(self, chat_id):
+        """A session's buffered messages not yet committed (caller holds the lock and the db lock)"""
+        flushing_messages = [] if self._flushed else self._flushing[0]
+        return [message for message in flushing_messages + self._pending_messages if message[0] == chat_id]
+
+    def _stale(self, session):
+        """Whether SQLite holds another message count than this cached session implies (caller holds the lock)"""
+        with self._db_lock:
+            row = self._conn.execute("SELECT message_count FROM sessions WHERE chat_id = ?", (session.chat_id,)).fetchone()
+            unwritten = len(self._unwritten(session.chat_id))
+        return (row[0] if row else 0) != session.message_count - unwritten
+
+    def _drop_pending(self, chat_id):
+        """Forget unwritten messages of a session (caller holds the lock)"""
+        self._pending_messages = [message for message in self._pending_messages if message[0] != chat_id]
+        self._pending_sessions.pop(chat_id, None)
+
+    def _cache(self, session):
+        self._sessions[session.chat_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing chat sessions: {e}")
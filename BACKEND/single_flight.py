@@ -0,0 +1,67 @@
+import asyncio
+import re
+
+from metrics import REGISTRY, span
+
+COALESCED_CALLS = REGISTRY.counter(
+    "rag_coalesced_calls_total", "Calls that ran (leader) or shared an identical in-flight call (follower)", ["role"]
+)
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Case-folded, whitespace-collapsed query without trailing punctuation"""
+    return _SPACE_RE.sub(" ", query).strip().casefold().rstrip("?!. ")
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is running,
+    callers with the same key await its result instead of starting their own.
+
+    The shared call runs as its own task, so a caller that gives up (client
+    disconnect, timeout) does not cancel it for the others. Exceptions are
+    shared too. Only in-flight calls are shared; nothing is kept once the call
+    finishes (that is the semantic cache's job).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}  # key -> task
+
+        # Counters (only touched from the event loop thread)
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) (a coroutine function), sharing it with concurrent callers of key"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            COALESCED_CALLS.inc(role="leader")
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        COALESCED_CALLS.inc(role="follower")
+        with span(f"{self.name}_coalesced_wait"):
+            return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Nobody may be left to retrieve the exception of an abandoned call
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+        }
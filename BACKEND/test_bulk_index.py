@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+from benchmark import write_synthetic_pdf
+from index_versions import IndexVersions
+from vector_persistence import load_native
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def bulk_index(root, output, work_dir, *options):
+    subprocess.run(
+        [
+            sys.executable, os.path.join(BACKEND, "bulk_index.py"), str(root), "--workers", "1",
+            "--output", str(output), "--work-dir", str(work_dir), "--embedding-backend", "hash", *options
+        ],
+        check=True, capture_output=True
+    )
+    versions = IndexVersions(str(output))
+    return load_native(versions.path(versions.current()), None)
+
+
+def chunk_texts(vectorstore, info):
+    return sorted(doc.page_content for doc in vectorstore.docstore.search_many(info["chunk_ids"]).values())
+
+
+def test_append_replaces_reindexed_file(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    write_synthetic_pdf(first / "report.pdf", pages=3, seed=1)
+    write_synthetic_pdf(first / "other.pdf", pages=2, seed=2)
+    # A revised report.pdf, indexed on its own into the published corpus
+    write_synthetic_pdf(second / "report.pdf", pages=4, seed=3)
+
+    output = tmp_path / "corpus"
+    published, published_documents = bulk_index(first, output, tmp_path / "work1")
+    appended, documents = bulk_index(second, output, tmp_path / "work2", "--append")
+
+    by_name = {info["filename"]: info for info in documents.values()}
+    old = {info["filename"]: info for info in published_documents.values()}["report.pdf"]
+    assert sorted(by_name) == ["other.pdf", "report.pdf"]
+    assert by_name["report.pdf"]["doc_id"] == old["doc_id"]
+    assert by_name["report.pdf"]["file_hash"] != old["file_hash"]
+    assert chunk_texts(appended, by_name["report.pdf"]) != chunk_texts(published, old)
+    # No chunks of the stale copy are left in the index
+    assert appended.index.live == sum(info["chunks"] for info in documents.values())
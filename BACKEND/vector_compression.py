@@ -0,0 +1,150 @@
+import os
+
+import faiss
+import numpy as np
+
+COMPRESSION_MODES = ("none", "fp16", "sq8", "sq4", "binary")
+
+# First-pass candidates per result that are rescored at full precision: coarser codes need more
+DEFAULT_RESCORE_FACTORS = {"fp16": 2, "sq8": 4, "sq4": 8, "binary": 16}
+
+_SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+    "sq4": faiss.ScalarQuantizer.QT_4bit,
+}
+
+# Vectors reconstructed from the full index per step while building codes, and used to train quantizers
+_BUILD_BATCH = 65536
+_TRAIN_SAMPLE = 100_000
+
+
+def compressed_file(mode):
+    return f"index.{mode}.faiss"
+
+
+def _binarize(vectors):
+    """One bit per dimension (the sign), packed 8 per byte"""
+    return np.packbits(vectors > 0, axis=1)
+
+
+class CompressedIndex:
+    """
+    Compact codes of the vectors in a full-precision index, for a fast first pass.
+
+    A search scans the codes for rescore_factor * k candidates and ranks those
+    by exact distance, reconstructing their vectors from the full index. The
+    full index can be memory-mapped: only the candidates' rows are read, so it
+    stays on disk (in the page cache at most) and only the codes need RAM.
+
+    Modes: "fp16" (2 bytes per dimension), "sq8" (1 byte), "sq4" (half a
+    byte; scalar quantizers trained on the vectors) and "binary" (1 bit, the
+    sign, compared by Hamming distance). The first pass is a brute-force scan
+    over the codes whatever the full index type.
+    """
+
+    def __init__(self, mode, codes, metric=faiss.METRIC_L2):
+        self.mode = mode
+        self.codes = codes
+        self.metric = metric
+
+    @property
+    def ntotal(self):
+        return self.codes.ntotal
+
+    @property
+    def code_size(self):
+        """Bytes per vector"""
+        return self.codes.code_size
+
+    @classmethod
+    def build(cls, full_index, mode):
+        """Encode every vector of full_index (read in batches, so a mapped index is never copied whole)"""
+        n, dim = full_index.ntotal, full_index.d
+        if mode == "binary":
+            if dim % 8:
+                raise ValueError(f"Binary codes need a dimension divisible by 8, not {dim}")
+            codes = faiss.IndexBinaryFlat(dim)
+        elif mode in _SCALAR_QUANTIZERS:
+            codes = faiss.IndexScalarQuantizer(dim, _SCALAR_QUANTIZERS[mode], full_index.metric_type)
+            if n:
+                sample = np.linspace(0, n - 1, num=min(n, _TRAIN_SAMPLE), dtype=np.int64)
+                codes.train(full_index.reconstruct_batch(sample))
+        else:
+            raise ValueError(f"Unknown compression mode: {mode}")
+
+        for start in range(0, n, _BUILD_BATCH):
+            vectors = full_index.reconstruct_n(start, min(_BUILD_BATCH, n - start))
+            codes.add(_binarize(vectors) if mode == "binary" else vectors)
+        return cls(mode, codes, full_index.metric_type)
+
+    def search(self, full_index, queries, k, rescore_factor=None, selector=None):
+        """
+        (distances, positions) like faiss Index.search, ranked by exact distance
+        against full_index; a FAISS ID selector restricts the first pass
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        factor = rescore_factor or DEFAULT_RESCORE_FACTORS[self.mode]
+        candidates = min(max(k, k * factor), self.ntotal)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        if not candidates:
+            return distances, positions
+
+        params = faiss.SearchParameters(sel=selector) if selector is not None else None
+        if self.mode == "binary":
+            _, found = self.codes.search(_binarize(queries), candidates, params=params)
+        else:
+            _, found = self.codes.search(queries, candidates, params=params)
+
+        # Rescore: read each distinct candidate's full vector once, then rank per query
+        unique = np.unique(found[found != -1])
+        vectors = full_index.reconstruct_batch(unique) if len(unique) else np.zeros((0, queries.shape[1]), np.float32)
+        lookup = dict(zip(unique.tolist(), range(len(unique))))
+        for i, (query, row) in enumerate(zip(queries, found)):
+            row = row[row != -1]
+            rows = vectors[[lookup[position] for position in row.tolist()]]
+            if self.metric == faiss.METRIC_INNER_PRODUCT:
+                exact = rows @ query
+                order = np.argsort(-exact)[:k]
+            else:
+                exact = ((rows - query) ** 2).sum(axis=1)
+                order = np.argsort(exact)[:k]
+            distances[i, :len(order)] = exact[order]
+            positions[i, :len(order)] = row[order]
+        return distances, positions
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "vectors": self.ntotal,
+            "bytes_per_vector": self.code_size,
+            "bytes": self.ntotal * self.code_size,
+        }
+
+    def save(self, path):
+        """Write the codes next to the full index in a save_native directory"""
+        file_path = os.path.join(path, compressed_file(self.mode))
+        if self.mode == "binary":
+            faiss.write_index_binary(self.codes, file_path)
+        else:
+            faiss.write_index(self.codes, file_path)
+
+    @classmethod
+    def load(cls, path, metric=faiss.METRIC_L2, mmap=True):
+        """The codes saved in a save_native directory (memory-mapped if possible), or None"""
+        for mode in COMPRESSION_MODES[1:]:
+            file_path = os.path.join(path, compressed_file(mode))
+            if not os.path.exists(file_path):
+                continue
+            read = faiss.read_index_binary if mode == "binary" else faiss.read_index
+            codes = None
+            if mmap:
+                try:
+                    codes = read(file_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    pass
+            if codes is None:
+                codes = read(file_path)
+            return cls(mode, codes, metric)
+        return None
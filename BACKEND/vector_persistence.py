@@ -0,0 +1,311 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from index_segments import Segment, SegmentedIndex, as_vectorstore
+from lexical_index import LEXICAL_FILE, BM25Index
+from vector_compression import CompressedIndex, compressed_file
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+MANIFEST_FILE = "documents.json"
+SEGMENTS_FILE = "segments.json"
+
+# LangChain's save_local format (pickled docstore)
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+_FETCH_BATCH = 500
+
+
+def is_native_vectorstore(path):
+    if os.path.exists(os.path.join(path, SEGMENTS_FILE)):
+        return True
+    # Saved before segments: one index and chunk table in the directory itself
+    return os.path.exists(os.path.join(path, INDEX_FILE)) and os.path.exists(os.path.join(path, CHUNKS_FILE))
+
+
+def is_legacy_vectorstore(path):
+    return os.path.exists(os.path.join(path, LEGACY_DOCSTORE_FILE)) and not is_native_vectorstore(path)
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Read-only docstore backed by the chunks table of a saved segment.
+
+    Chunk text and metadata are fetched from SQLite only when a search hit needs
+    them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def search(self, search):
+        return self.search_many([search]).get(search, f"ID {search} not found.")
+
+    def search_many(self, ids):
+        """Fetch several chunks at once; returns {chunk_id: Document}"""
+        found = {}
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), _FETCH_BATCH):
+                batch = ids[start:start + _FETCH_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, content, metadata FROM chunks WHERE chunk_id IN ({placeholders})", batch
+                )
+                for chunk_id, content, metadata in rows:
+                    found[chunk_id] = Document(id=chunk_id, page_content=content, metadata=json.loads(metadata))
+        return found
+
+    def positions(self, ids):
+        """{chunk_id: position} of the given chunks that are stored here"""
+        found = {}
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), _FETCH_BATCH):
+                batch = ids[start:start + _FETCH_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT chunk_id, position FROM chunks WHERE chunk_id IN ({placeholders})", batch
+                ))
+        return found
+
+    def doc_pages(self):
+        """{chunk_id: (doc_id, page)} of all chunks, read from the indexed columns (not the text)"""
+        with self._lock:
+            return {chunk_id: (doc_id, page) for chunk_id, doc_id, page in self._conn.execute(
+                "SELECT chunk_id, doc_id, page FROM chunks"
+            )}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def save_native(vectorstore, path, documents):
+    """
+    Save a vectorstore over a SegmentedIndex without pickle: one directory per
+    segment (the FAISS index via write_index, chunk text and metadata in an
+    SQLite table keyed by position and chunk ID, the BM25 postings and the
+    compressed codes), the segment list with the positions deleted in each as
+    JSON, and the document manifest as JSON.
+
+    Segments already saved elsewhere (an earlier version) are hard-linked
+    rather than written again, so a save only writes the segments added since.
+
+    The new files are written to a sibling directory and swapped in, so a crash
+    never leaves a half-written vectorstore behind. The vectorstore itself is
+    not changed (it may still be serving queries); see read_saved.
+    """
+    index = vectorstore.index
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = os.path.join(parent, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    os.makedirs(staging)
+
+    try:
+        for segment in index.segments:
+            segment_path = os.path.join(staging, segment.name)
+            if segment.path is None or not link_segment(segment, segment_path):
+                save_segment(segment, segment_path)
+
+        with open(os.path.join(staging, SEGMENTS_FILE), "w") as f:
+            json.dump({"segments": [
+                {"name": segment.name, "chunks": len(segment), "deleted": sorted(index.deleted.get(segment.name, ()))}
+                for segment in index.segments
+            ]}, f)
+
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump(documents, f)
+
+        # Swap the new directory in
+        previous = None
+        if os.path.exists(path):
+            previous = f"{staging}.old"
+            os.rename(path, previous)
+        os.rename(staging, path)
+        if previous:
+            shutil.rmtree(previous, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def save_segment(segment, path):
+    """Write one segment's index, chunk table, BM25 postings and compressed codes to a new directory"""
+    os.makedirs(path)
+    faiss.write_index(segment.index, os.path.join(path, INDEX_FILE))
+
+    def rows():
+        for start in range(0, len(segment), _FETCH_BATCH):
+            chunk_ids = segment.chunk_ids[start:start + _FETCH_BATCH]
+            docs = segment.docstore.search_many(chunk_ids)
+            for position, chunk_id in enumerate(chunk_ids, start):
+                doc = docs[chunk_id]
+                yield (
+                    position, chunk_id, doc.metadata.get("doc_id"), doc.metadata.get("source"),
+                    doc.metadata.get("page"), doc.page_content, json.dumps(doc.metadata, default=str)
+                )
+
+    conn = sqlite3.connect(os.path.join(path, CHUNKS_FILE))
+    conn.execute(
+        "CREATE TABLE chunks ("
+        "position INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, doc_id TEXT, "
+        "source TEXT, page INTEGER, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO chunks (position, chunk_id, doc_id, source, page, content, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows()
+    )
+    conn.commit()
+    conn.close()
+
+    segment.lexical_index.save(os.path.join(path, LEXICAL_FILE))
+    if segment.compressed is not None:
+        segment.compressed.save(path)
+
+
+def link_segment(segment, path):
+    """
+    Give a saved segment a directory in a new vectorstore by hard-linking its
+    files (copying them where links are not supported). Saved segments never
+    change, so versions can share their files. Returns False, creating nothing,
+    if some of the files are missing (e.g. saved before the keyword index).
+    """
+    names = [INDEX_FILE, CHUNKS_FILE, LEXICAL_FILE]
+    if segment.compressed is not None:
+        names.append(compressed_file(segment.compressed.mode))
+    sources = [os.path.join(segment.path, name) for name in names]
+    if not all(os.path.exists(source) for source in sources):
+        return False
+
+    os.makedirs(path)
+    for source, name in zip(sources, names):
+        target = os.path.join(path, name)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    return True
+
+
+def read_saved(index, path, mmap=True):
+    """
+    The SegmentedIndex just saved to path by save_native, served from the
+    saved files: segments that were only in memory are re-opened with their
+    index memory-mapped and their chunks read from SQLite.
+    """
+    segments = []
+    for segment in index.segments:
+        segment_path = os.path.join(path, segment.name)
+        if segment.path is None:
+            segment_index, mapped = read_index(segment_path, mmap=mmap)
+            compressed = CompressedIndex.load(segment_path, metric=segment_index.metric_type, mmap=mmap)
+            segment = Segment(
+                segment_index, segment.chunk_ids, SQLiteDocstore(os.path.join(segment_path, CHUNKS_FILE)),
+                segment.lexical_index, compressed, name=segment.name, path=segment_path, mapped=mapped
+            )
+        else:
+            segment.path = segment_path
+        segments.append(segment)
+    return SegmentedIndex(segments, index.deleted, previous=index)
+
+
+def read_index(path, mmap=True):
+    """
+    Open a saved FAISS index. With mmap the vectors are mapped read-only from the
+    file (shared between processes through the page cache) instead of copied.
+    Returns (index, mapped).
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    if mmap:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError:
+            pass
+    return faiss.read_index(index_path), False
+
+
+def read_manifest(path):
+    """Document manifest of a vectorstore saved by save_native ({} if it has none)"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load_segment(path, name=None, mmap=True):
+    """
+    A segment saved by save_segment (or a whole vectorstore saved before
+    segments). Only the chunk IDs and the BM25 postings are read eagerly.
+    """
+    index, mapped = read_index(path, mmap=mmap)
+
+    chunks_path = os.path.join(path, CHUNKS_FILE)
+    conn = sqlite3.connect(f"file:{chunks_path}?mode=ro", uri=True)
+    try:
+        chunk_ids = [chunk_id for (chunk_id,) in conn.execute("SELECT chunk_id FROM chunks ORDER BY position")]
+        lexical_path = os.path.join(path, LEXICAL_FILE)
+        if os.path.exists(lexical_path):
+            lexical_index = BM25Index.load(lexical_path)
+        else:
+            # Saved before the keyword index existed: build it from the chunks
+            lexical_index = BM25Index()
+            rows = conn.execute("SELECT chunk_id, content FROM chunks ORDER BY position").fetchall()
+            lexical_index.add([chunk_id for chunk_id, _ in rows], [content for _, content in rows])
+    finally:
+        conn.close()
+
+    compressed = CompressedIndex.load(path, metric=index.metric_type, mmap=mmap)
+    return Segment(
+        index, chunk_ids, SQLiteDocstore(chunks_path), lexical_index, compressed, name=name, path=path, mapped=mapped
+    )
+
+
+def load_native(path, embeddings, mmap=True, loaded=None):
+    """
+    Load a vectorstore saved by save_native. Returns (vectorstore, documents);
+    the vectorstore's index is a SegmentedIndex.
+
+    loaded is the SegmentedIndex already served from an earlier version, if
+    any: its segments are reused instead of read again, so switching to a new
+    version only reads the segments added since.
+    """
+    segments_path = os.path.join(path, SEGMENTS_FILE)
+    if not os.path.exists(segments_path):
+        return as_vectorstore(SegmentedIndex([load_segment(path, mmap=mmap)]), embeddings), read_manifest(path)
+
+    with open(segments_path) as f:
+        layout = json.load(f)["segments"]
+    reusable = {segment.name: segment for segment in loaded.segments} if loaded is not None else {}
+    segments = []
+    for entry in layout:
+        segment_path = os.path.join(path, entry["name"])
+        segment = reusable.get(entry["name"])
+        if segment is None:
+            segment = load_segment(segment_path, name=entry["name"], mmap=mmap)
+        else:
+            # Same files, hard-linked into this version (the older one may be removed)
+            segment.path = segment_path
+        segments.append(segment)
+    deleted = {entry["name"]: entry["deleted"] for entry in layout}
+    return as_vectorstore(SegmentedIndex(segments, deleted, previous=loaded), embeddings), read_manifest(path)
+
+
+def stored_bytes(path, filename):
+    """Total size of the files called filename in a saved vectorstore (one per segment)"""
+    total = 0
+    for directory, _, filenames in os.walk(path):
+        if filename in filenames:
+            total += os.path.getsize(os.path.join(directory, filename))
+    return total